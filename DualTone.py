@@ -6,16 +6,40 @@ import tkinter.ttk as ttk
 import _tkinter
 from idlelib.tooltip import Hovertip
 import copy
-from PIL import Image, ImageTk, ImageOps, ImageFilter, ImageEnhance
+from PIL import Image, ImageTk, ImageOps, ImageFilter, ImageEnhance, ImageStat, ImageSequence
 from PIL.Image import Resampling
 import PIL
 import os
+import re
+import math
+import io
+import json
+import hashlib
+import asyncio
+import argparse
+import urllib.parse
+import time
+import bisect
+import atexit
+import ctypes
+import contextlib
+import select
+import struct
+import tempfile
+import weakref
 import numpy as np
-from copy import deepcopy
 import keyboard
-from threading import Thread
+from threading import Thread, Lock, current_thread, main_thread
+from concurrent.futures import ThreadPoolExecutor, CancelledError, TimeoutError as FutureTimeoutError
+from collections import deque, OrderedDict
 import webbrowser
 
+# Windows has no resource module, peak memory is found by ctypes there
+try:
+    import resource
+except ImportError:
+    resource = None
+
 
 # https://coderslegacy.com/add-image-data-files-in-pyinstaller-exe/
 def resource_path(relative_path):
@@ -29,124 +53,3214 @@ def has_transparency(image):
     "Checks if opening image is transparent"
 
     if image.mode == 'RGBA':
-        alpha_channel = image.split()[3]
-        return any(alpha != 255 for alpha in alpha_channel.getdata())
+        return image.getchannel("A").getextrema()[0] != 255
+
+    # palette image is transparent if at least one of its used colors is transparent
+    if image.mode == 'P':
+        counts = image.histogram()
+        return any(counts[i] and alpha != 255 for i, alpha in enumerate(palette_alpha(image)))
 
     return False
 
 
+def palette_alpha(image):
+    "Returns list of alpha values of palette colors, they can be stored both in palette and image info"
+
+    alpha = image.getpalette("RGBA")[3::4]
+    transparency = image.info.get("transparency")
+
+    # index of one transparent color or alpha values of first palette colors
+    if isinstance(transparency, int) and transparency < len(alpha):
+        alpha[transparency] = 0
+    elif isinstance(transparency, bytes):
+        alpha[:len(transparency)] = list(transparency)[:len(alpha)]
+
+    return alpha
+
+
+def get_palette_image(image):
+    "Returns palette of P image as an image with one row of pixels, RGBA if palette image is transparent"
+
+    palette = image.getpalette("RGB")
+    colors = Image.frombytes("RGB", (len(palette) // 3, 1), bytes(palette))
+
+    if has_transparency(image):
+        colors.putalpha(Image.frombytes("L", colors.size, bytes(palette_alpha(image))))
+
+    return colors
+
+
+def set_palette_image(image, colors):
+    "Returns copy of P image with RGB colors of palette taken from one row image, transparency stays the same"
+
+    new_image = image.copy()
+    palette = np.array(image.getpalette("RGBA"), dtype=np.uint8).reshape(-1, 4)
+    palette[:, :3] = np.asarray(colors.convert("RGB")).reshape(-1, 3)
+
+    if image.palette.mode == "RGBA":
+        new_image.putpalette(palette.tobytes(), "RGBA")
+    else:
+        new_image.putpalette(palette[:, :3].tobytes(), "RGB")
+
+    return new_image
+
+
+# pixels of one row band, float arrays of band stay small and all cores get many bands of large image
+BAND_PIXELS = 1 << 20
+
+# threads filtering bands of one image, they are created when the first large image is filtered
+band_executor = None
+band_executor_lock = Lock()
+
+
+def map_bands(function, img_array):
+    """Applies batch function to row bands of H x W x C array by thread pool and returns H x W x C result. NumPy and PIL
+    release GIL while they process a band, so one large image is filtered by all cores"""
+
+    global band_executor
+
+    rows = max(1, BAND_PIXELS // img_array.shape[1])
+    if img_array.shape[0] <= rows:
+        return function(img_array[np.newaxis])[0]
+
+    # service and tile workers may filter their first large images at the same time, only one pool is created
+    if band_executor is None and (os.cpu_count() or 1) > 1:
+        with band_executor_lock:
+            if band_executor is None:
+                band_executor = ThreadPoolExecutor(os.cpu_count())
+
+    new_array = None
+
+    def filter_band(start):
+        new_array[start:start + rows] = function(img_array[np.newaxis, start:start + rows])[0]
+
+    # shape of result is taken from the first band, the others are written into the same array by threads
+    first = function(img_array[np.newaxis, :rows])[0]
+    new_array = np.empty(img_array.shape[:2] + first.shape[2:], dtype=first.dtype)
+    new_array[:rows] = first
+    starts = range(rows, img_array.shape[0], rows)
+    if band_executor is None:
+        for start in starts:
+            filter_band(start)
+    else:
+        for future in [band_executor.submit(filter_band, start) for start in starts]:
+            future.result()
+    return new_array
+
+
 def bicubic_interpolation(img, color1, color2):
     "Converts image to 2-colored gamma, there will be quality loss in jpg, jpeg, jfif, and webp files"
 
-    img = np.array(img)
-    mask = img.mean(axis=-1) / 255
-    r1, g1, b1 = color1[0]
-    r2, g2, b2 = color2[0]
-    red = (1 - mask) * r1 + mask * r2
-    green = (1 - mask) * g1 + mask * g2
-    blue = (1 - mask) * b1 + mask * b2
-    img[:, :, 0] = red
-    img[:, :, 1] = green
-    img[:, :, 2] = blue
-
-    return Image.fromarray(img.astype('uint8'))
+    return Image.fromarray(map_bands(lambda band: get_backend().bicubic(band, color1, color2), np.asarray(img)))
 
 
 def RGB_filter(pil_object, array):
     "Adds sepia or red effects, no quality loss"
 
-    img_array = np.array(pil_object)
-
-    if img_array.shape[2] == 3:
-        # RGB case
-        converting_image = np.dot(img_array, array.T)
-        converting_image = np.clip(converting_image, 0, 255).astype(np.uint8)
-        return Image.fromarray(converting_image)
-    elif img_array.shape[2] == 4:
-        # RGBA case (consider alpha channel)
-        alpha_channel = img_array[:, :, 3]
-        converting_image = np.dot(img_array[:, :, :3], array.T)
-        converting_image = np.clip(converting_image, 0, 255).astype(np.uint8)
-        converting_image = np.dstack([converting_image, alpha_channel])
-        return Image.fromarray(converting_image)
-    else:
+    img_array = np.asarray(pil_object)
+    if img_array.ndim != 3 or img_array.shape[2] not in (3, 4):
         raise ValueError("Unsupported number of color channels. Expected 3 (RGB) or 4 (RGBA).")
 
+    return Image.fromarray(map_bands(lambda band: get_backend().matrix(band, array), img_array))
+
 
 def invert_colors_rgba(pil_object):
     "Since default PIL library can't invert colors without loss of transparency, this function does it"
 
-    img_array = np.array(pil_object)
+    img_array = np.asarray(pil_object)
+    if img_array.ndim != 3 or img_array.shape[2] != 4:
+        raise ValueError("Unsupported number of color channels. Expected 4 (RGBA).")
 
-    if img_array.shape[2] == 4:
-        # RGBA case (consider alpha channel)
-        alpha_channel = img_array[:, :, 3]
-        rgb_channels = img_array[:, :, :3]
+    def invert_band(band):
+        inverted_band = 255 - band
+        inverted_band[..., 3] = band[..., 3]
+        return inverted_band
 
-        inverted_rgb_channels = 255 - rgb_channels
-        inverted_image = np.dstack([inverted_rgb_channels, alpha_channel])
-
-        return Image.fromarray(inverted_image.astype(np.uint8))
-    else:
-        raise ValueError("Unsupported number of color channels. Expected 4 (RGBA).")
+    return Image.fromarray(map_bands(invert_band, img_array))
 
 
 def RGB_filter_custom_color(pil_object, rgb_color):
     "Tints image with RGB color, there will be quality loss in jpg, jpeg, jfif, and webp files"
 
-    img_array = np.array(pil_object)
-
-    if len(rgb_color) == 3:  # RGB color
-        scaling_factors = np.array(rgb_color) / 255.0
-        alpha_channel = 1.0
-    elif len(rgb_color) == 4:  # RGBA color
-        scaling_factors = np.array(rgb_color[:3]) / 255.0
-        alpha_channel = rgb_color[3] / 255.0
-    else:
+    if len(rgb_color) not in (3, 4):
         raise ValueError("Color must be RGB or RGBA format")
 
-    # Apply scaling factors to the RGB channels
-    converted_image = img_array[:, :, :3] * scaling_factors
-    converted_image = np.clip(converted_image, 0, 255).astype(np.uint8)
-
-    # Apply scaling factor to the alpha channel (if present)
-    if img_array.shape[2] == 4:
-        alpha_channel_array = img_array[:, :, 3] * alpha_channel
-        alpha_channel_array = np.clip(alpha_channel_array, 0, 255).astype(np.uint8)
-        converted_image = np.dstack((converted_image, alpha_channel_array))
-
-    return Image.fromarray(converted_image)
+    return Image.fromarray(map_bands(lambda band: RGB_filter_custom_color_batch(band, rgb_color),
+                                     np.asarray(pil_object)))
 
 
 def linear_interpolation(pil_object, color1, color2):
     "Converts image to 2-colored gamma, there will be quality loss in jpg, jpeg, jfif, and webp files"
 
     img_array = np.asarray(pil_object)
+    new_img_array = map_bands(lambda band: get_backend().linear(band, color1, color2), img_array)
+    return Image.fromarray(new_img_array, "RGBA" if img_array.shape[2] == 4 else "RGB")
+
+
+def check_batch(images):
+    "Checks that array is N x H x W x C stack of uint8 RGB or RGBA images"
 
-    has_alpha = len(img_array.shape) == 3 and img_array.shape[2] == 4
+    if images.ndim != 4 or images.dtype != np.uint8 or images.shape[3] not in (3, 4):
+        raise ValueError("Unsupported array. Expected N x H x W x 3 (RGB) or N x H x W x 4 (RGBA) uint8 array.")
+
+
+def batch_parts(images, pixels=1 << 18):
+    "Yields slices of images with about given number of pixels, so temporary float arrays of each part stay small"
+
+    step = max(1, pixels // (images.shape[1] * images.shape[2]))
+    for start in range(0, len(images), step):
+        yield slice(start, start + step)
+
+
+def bicubic_table(color1, color2, channels):
+    "Returns new colors with 4 bytes per color for all possible sums of channels of pixel"
+
+    # mean of channels is defined by their integer sum, so new colors are taken from table by sum
+    mask = np.arange(255 * channels + 1) / channels / 255
+    table = np.zeros((len(mask), 4), dtype=np.uint8)
+    for i in range(3):
+        table[:, i] = (1 - mask) * color1[0][i] + mask * color2[0][i]
+    return table
+
+
+def linear_table(color1, color2):
+    """Returns new colors with 4 bytes per color for all possible dot products of pixel and direction from color1
+    to color2, the direction, and the lowest product which is the first row of table"""
 
     rgb_1 = np.array(color1[0])
     rgb_2 = np.array(color2[0])
+    direction = rgb_2 - rgb_1
+
+    # all possible dot products of pixels and direction
+    low = int(np.minimum(direction, 0).sum()) * 255
+    high = int(np.maximum(direction, 0).sum()) * 255
+    products = np.arange(low, high + 1)
+
+    t_values = np.clip((products - np.dot(rgb_1, direction)) / np.dot(direction, direction), 0, 1)
+    table = np.zeros((len(products), 4), dtype=np.uint8)
+    for i in range(3):
+        table[:, i] = rgb_1[i] + t_values * direction[i]
+    return table, direction, low
+
+
+def bicubic_interpolation_batch(images, color1, color2):
+    """Batch version of bicubic_interpolation for N x H x W x C array, colors for all possible sums of channels
+    are found once"""
+
+    check_batch(images)
+    channels = images.shape[3]
+    table = bicubic_table(color1, color2, channels)
+
+    sums = images[:, :, :, 0].astype(np.uint16)
+    for i in range(1, channels):
+        sums += images[:, :, :, i]
+
+    return take_colors(table, sums, images)
 
-    if has_alpha:
-        alpha_channel = np.empty(img_array.shape[:2])
 
-    t_values = np.clip(np.dot(img_array[:, :, :3] - rgb_1, rgb_2 - rgb_1) / np.dot(rgb_2 - rgb_1, rgb_2 - rgb_1), 0, 1)
+def take_colors(table, indices, images):
+    "Takes new RGB colors from table with 4 bytes per color by indices, alpha channel is taken from images"
 
-    red = rgb_1[0] + t_values * (rgb_2[0] - rgb_1[0])
-    green = rgb_1[1] + t_values * (rgb_2[1] - rgb_1[1])
-    blue = rgb_1[2] + t_values * (rgb_2[2] - rgb_1[2])
+    # one 32-bit number is copied per pixel instead of 3 bytes
+    new_images = table.view("<u4")[:, 0][indices].view(np.uint8).reshape(indices.shape + (4,))
+    if images.shape[3] == 4:
+        new_images[:, :, :, 3] = images[:, :, :, 3]
+        return new_images
+    return np.ascontiguousarray(new_images[:, :, :, :3])
 
-    if has_alpha:
-        alpha_channel[:] = img_array[:, :, 3]
-        new_img_array = np.dstack([red, green, blue, alpha_channel]).astype(np.uint8)
+
+def RGB_filter_batch(images, array):
+    "Batch version of RGB_filter for N x H x W x C array"
+
+    check_batch(images)
+    new_images = np.empty_like(images)
+
+    for part in batch_parts(images):
+        # channels are summed one by one, matrix product may use other order and round differently on other CPUs
+        rgb = images[part, :, :, :3].astype(np.float64)
+        for j in range(3):
+            converting = rgb[..., 0] * array[j, 0] + rgb[..., 1] * array[j, 1] + rgb[..., 2] * array[j, 2]
+            np.clip(converting, 0, 255, out=converting)
+            new_images[part, :, :, j] = converting
+
+    if images.shape[3] == 4:
+        new_images[:, :, :, 3] = images[:, :, :, 3]
+    return new_images
+
+
+def RGB_filter_custom_color_batch(images, rgb_color):
+    "Batch version of RGB_filter_custom_color for N x H x W x C array, each channel is scaled by 256-value table"
+
+    check_batch(images)
+    if len(rgb_color) not in (3, 4):
+        raise ValueError("Color must be RGB or RGBA format")
+
+    # alpha channel is scaled only by RGBA color
+    channels = images.shape[3]
+    scaling_factors = np.array(tuple(rgb_color[:3]) + (rgb_color[3] if len(rgb_color) == 4 else 255,)) / 255.0
+    tables = np.clip(np.arange(256)[:, np.newaxis] * scaling_factors[:channels], 0, 255).astype(np.uint8)
+
+    # PIL applies tables of all channels by one pass, parts of stack are taken as tall images
+    new_images = np.empty_like(images)
+    mode = "RGBA" if channels == 4 else "RGB"
+    for part in batch_parts(images):
+        pil_object = Image.fromarray(images[part].reshape(-1, images.shape[2], channels), mode)
+        new_images[part] = np.asarray(pil_object.point(tables.T.ravel().tolist())).reshape(new_images[part].shape)
+    return new_images
+
+
+def linear_interpolation_batch(images, color1, color2):
+    """Batch version of linear_interpolation for N x H x W x C array. Projection of pixel on line between colors is
+    integer dot product, so new colors are taken from table by its value"""
+
+    check_batch(images)
+    table, direction, low = linear_table(color1, color2)
+
+    # float32 keeps integer products up to 3 * 255 * 255 exactly
+    indices = np.empty(images.shape[:3], dtype=np.int32)
+    for part in batch_parts(images):
+        indices[part] = images[part, :, :, :3].astype(np.float32) @ direction.astype(np.float32) - low
+
+    return take_colors(table, indices, images)
+
+
+class NumpyBackend:
+    """Reference backend, its kernels are the NumPy batch functions. Every kernel takes N x H x W x C uint8 array
+    of RGB or RGBA images and returns array of the same shape"""
+
+    name = "numpy"
+
+    def matrix(self, images, array):
+        return RGB_filter_batch(images, array)
+
+    def bicubic(self, images, color1, color2):
+        return bicubic_interpolation_batch(images, color1, color2)
+
+    def linear(self, images, color1, color2):
+        return linear_interpolation_batch(images, color1, color2)
+
+    def lut(self, lut, images):
+        return lut.apply_batch(images)
+
+
+def matrix_kernel(pixels, array, new_pixels):
+    "Multiplies RGB of each pixel by 3 x 3 matrix, channels are summed in the same order as by RGB_filter_batch"
+
+    for i in range(pixels.shape[0]):
+        for j in range(3):
+            value = pixels[i, 0] * array[j, 0] + pixels[i, 1] * array[j, 1] + pixels[i, 2] * array[j, 2]
+            new_pixels[i, j] = min(max(value, 0.0), 255.0)
+        if pixels.shape[1] == 4:
+            new_pixels[i, 3] = pixels[i, 3]
+
+
+def table_kernel(pixels, table, weights, low, new_pixels):
+    "Replaces each pixel by row of table, its index is weighted sum of channels minus low"
+
+    for i in range(pixels.shape[0]):
+        index = -low
+        for j in range(len(weights)):
+            index += pixels[i, j] * weights[j]
+        for j in range(3):
+            new_pixels[i, j] = table[index, j]
+        if pixels.shape[1] == 4:
+            new_pixels[i, 3] = pixels[i, 3]
+
+
+def lut_kernel(pixels, colors, bases, fractions, size, new_pixels):
+    """Tetrahedral interpolation of 3D LUT like CubeLUT.apply_batch, it's computed in float32 as well. Fractions and
+    steps of channels are kept in scalars, so the loop doesn't allocate anything"""
+
+    for i in range(pixels.shape[0]):
+        red, green, blue = pixels[i, 0], pixels[i, 1], pixels[i, 2]
+        corner0 = bases[red, 0] + bases[green, 1] * size + bases[blue, 2] * size * size
+        f0, f1, f2 = fractions[red, 0], fractions[green, 1], fractions[blue, 2]
+        step0, step1, step2 = 1, size, size * size
+
+        # tetrahedron is chosen by order of fractions, swaps keep equal fractions in order of channels
+        if f1 > f0:
+            f0, f1, step0, step1 = f1, f0, step1, step0
+        if f2 > f1:
+            f1, f2, step1, step2 = f2, f1, step2, step1
+        if f1 > f0:
+            f0, f1, step0, step1 = f1, f0, step1, step0
+
+        corner1 = corner0 + step0
+        corner2 = corner1 + step1
+        corner3 = corner0 + size * size + size + 1
+        for j in range(3):
+            value = (colors[corner0, j] * (np.float32(1) - f0) + colors[corner1, j] * (f0 - f1) +
+                     colors[corner2, j] * (f1 - f2) + colors[corner3, j] * f2)
+            new_pixels[i, j] = min(max(value * np.float32(255) + np.float32(0.5), 0.0), 255.0)
+        if pixels.shape[1] == 4:
+            new_pixels[i, 3] = pixels[i, 3]
+
+
+class NumbaBackend(NumpyBackend):
+    """Kernels compiled by Numba, each one reads pixel and writes its new color in one loop without temporary arrays.
+    They release GIL, so bands of image are filtered by all cores. Raises ImportError if Numba isn't installed"""
+
+    name = "numba"
+
+    def __init__(self):
+        import numba
+
+        # kernels are module-level functions, so compiled code is cached on disk and reused by next launches
+        compile_kernel = numba.njit(nogil=True, cache=True)
+        self.matrix_kernel = compile_kernel(matrix_kernel)
+        self.table_kernel = compile_kernel(table_kernel)
+        self.lut_kernel = compile_kernel(lut_kernel)
+
+    @staticmethod
+    def pixels(images):
+        "Returns images as contiguous list of pixels and empty array for new pixels"
+
+        check_batch(images)
+        pixels = np.ascontiguousarray(images).reshape(-1, images.shape[3])
+        return pixels, np.empty_like(pixels)
+
+    def matrix(self, images, array):
+        pixels, new_pixels = self.pixels(images)
+        self.matrix_kernel(pixels, np.asarray(array, dtype=np.float64), new_pixels)
+        return new_pixels.reshape(images.shape)
+
+    def bicubic(self, images, color1, color2):
+        pixels, new_pixels = self.pixels(images)
+        channels = images.shape[3]
+        self.table_kernel(pixels, bicubic_table(color1, color2, channels), np.ones(channels, dtype=np.int64), 0,
+                          new_pixels)
+        return new_pixels.reshape(images.shape)
+
+    def linear(self, images, color1, color2):
+        pixels, new_pixels = self.pixels(images)
+        table, direction, low = linear_table(color1, color2)
+        self.table_kernel(pixels, table, direction.astype(np.int64), low, new_pixels)
+        return new_pixels.reshape(images.shape)
+
+    def lut(self, lut, images):
+        pixels, new_pixels = self.pixels(images)
+        bases, fractions = lut.coordinates()
+        self.lut_kernel(pixels, lut.table.reshape(-1, 3), bases, fractions, lut.table.shape[0], new_pixels)
+        return new_pixels.reshape(images.shape)
+
+
+# backends in order of preference, the first one which works is chosen automatically
+BACKENDS = {"numba": NumbaBackend, "numpy": NumpyBackend}
+
+# backend which filters run on, it's created by get_backend on first use of filter
+backend = None
+backend_name = "auto"
+backend_lock = Lock()
+
+
+def same_results(result, expected, tolerance=0):
+    """Checks that kernel result differs from expected array by no more than tolerance levels, and only in a few
+    values if tolerance isn't 0"""
+
+    if result.shape != expected.shape:
+        return False
+    difference = np.abs(result.astype(np.int16) - expected)
+    if not tolerance:
+        return not difference.any()
+    return difference.max() <= tolerance and np.count_nonzero(difference) <= difference.size // 1000
+
+
+def check_backend(candidate):
+    """Compares kernels of backend with NumPy reference on random RGB and RGBA images, returns True if results are
+    the same. Kernels compute in the same order and precision as NumPy, but compiler may fuse multiplication and
+    addition of matrix kernel, so its levels may differ by 1 in a few pixels. Other kernels are compared exactly"""
+
+    reference = NumpyBackend()
+    rng = np.random.default_rng(0)
+    colors = (((0, 0, 0), "#000000"), ((255, 255, 255), "#ffffff"), ((20, 200, 90), "#14c85a"),
+              ((250, 30, 160), "#fa1ea0"))
+    lut = CubeLUT(rng.random((5, 5, 5, 3)))
+
+    for channels in (3, 4):
+        images = rng.integers(0, 256, (2, 16, 24, channels), dtype=np.uint8)
+        kernels = [(lambda b: b.matrix(images, SEPIA_MATRIX), 1), (lambda b: b.matrix(images, RED_MATRIX), 1),
+                   (lambda b: b.lut(lut, images), 0)]
+        kernels += [(lambda b, c1=color1, c2=color2, kernel=kernel: getattr(b, kernel)(images, c1, c2), 0)
+                    for kernel in ("bicubic", "linear") for color1 in colors for color2 in colors if color1 != color2]
+
+        for kernel, tolerance in kernels:
+            if not same_results(kernel(candidate), kernel(reference), tolerance):
+                return False
+    return True
+
+
+def select_backend(name="auto"):
+    """Sets name of backend, it's created and checked only on first use of filter, so launch isn't slowed down by
+    compiler. "auto" chooses the first backend of BACKENDS which can be created and gives the same results as NumPy"""
+
+    global backend, backend_name
+
+    with backend_lock:
+        backend_name = name
+        backend = None
+
+
+def create_backend(name):
+    "Returns backend by name, backend that isn't installed or differs from NumPy is replaced by NumPy"
+
+    for candidate_name in BACKENDS if name == "auto" else (name,):
+        try:
+            candidate = BACKENDS[candidate_name]()
+            if candidate_name == "numpy" or check_backend(candidate):
+                return candidate
+        except Exception:
+            # missing or broken compiler, unknown name
+            continue
+
+    return NumpyBackend()
+
+
+def get_backend():
+    "Returns current backend, it's created by name given to select_backend when it's needed first time"
+
+    global backend
+
+    with backend_lock:
+        if backend is None:
+            backend = create_backend(backend_name)
+        return backend
+
+
+# np matrix for red color filter
+RED_MATRIX = np.array([[1.6, 0, 0],
+                       [0, 1, 0],
+                       [0, 0, 1]])
+
+# np matrix for sepia filter
+SEPIA_MATRIX = np.array([[0.393, 0.769, 0.189],
+                         [0.349, 0.686, 0.168],
+                         [0.272, 0.534, 0.131]])
+
+# default color for overall tint RGB filter
+DEFAULT_TINT_COLOR = ((255, 128, 255), '#ff80ff')
+
+# default colors for two-colored RGB filters
+DEFAULT_RGB1 = ((0, 0, 0), '#000000')
+DEFAULT_RGB2 = ((0, 255, 255), '#00ffff')
+
+# filters of ImageFilter module, each of them needs only two neighbouring rows of pixels or less
+KERNEL_FILTERS = {"Blur": ImageFilter.BLUR,
+                  "Smooth": ImageFilter.SMOOTH,
+                  "Sharpen": ImageFilter.SHARPEN,
+                  "Detail": ImageFilter.DETAIL,
+                  "Edge Enhance": ImageFilter.EDGE_ENHANCE,
+                  "Emboss": ImageFilter.EMBOSS,
+                  "Contour #1": ImageFilter.CONTOUR}
+
+# filters that return grayscale image whatever color mode source image has
+GRAYSCALE_FILTERS = ("Black and White", "Contour #2")
+
+# extensions of files which are opened one by one by next and previous image commands, like in Open File dialog
+IMAGE_EXTENSIONS = (".gif", ".jpg", ".jpeg", ".png", ".bmp", ".jfif", ".tif", ".tiff", ".ico", ".webp", ".ppm", ".pgm",
+                    ".pbm", ".pcx", ".tga")
+
+# filters which change every pixel independently of other ones, so they can be applied to palette colors only
+COLOR_FILTERS = ("Black and White",
+                 "Sepia",
+                 "Red",
+                 "Overall Tint RGB Filter",
+                 "2-Colored RGB (Bicubic)",
+                 "2-Colored RGB (Linear)",
+                 "Invert",
+                 "Posterize 1 bit",
+                 "Posterize 2 bit",
+                 "Posterize 3 bit",
+                 "Posterize 4 bit",
+                 "3D LUT (.cube)")
+
+# color filters which make levels of neighbouring pixels jump, so preview is fitted after them like saved image is;
+# other color filters give the same preview when they're applied to fitted image
+STEP_FILTERS = ("Posterize 1 bit",
+                "Posterize 2 bit",
+                "Posterize 3 bit",
+                "Posterize 4 bit",
+                "3D LUT (.cube)")
+
+# filters which filter_batch can apply to stack of images
+BATCH_FILTERS = ("None",
+                 "Sepia",
+                 "Red",
+                 "Overall Tint RGB Filter",
+                 "2-Colored RGB (Bicubic)",
+                 "2-Colored RGB (Linear)")
+
+# color filters which make grayscale image colored
+COLORIZING_FILTERS = ("Sepia",
+                      "Red",
+                      "Overall Tint RGB Filter",
+                      "2-Colored RGB (Bicubic)",
+                      "2-Colored RGB (Linear)",
+                      "3D LUT (.cube)")
+
+# names of all filters which filter_image applies
+FILTERS = tuple(dict.fromkeys(("None", "Mirror", *KERNEL_FILTERS, *GRAYSCALE_FILTERS, *COLOR_FILTERS)))
+
+# images with no more unique colors than this number are filtered color by color, 0 turns this mode off
+UNIQUE_COLORS_LIMIT = 65536
+
+# color filters doing float math per pixel, so counting unique colors pays off; other color filters are native point
+# and convert operations of PIL, which are faster than getcolors alone
+UNIQUE_COLORS_FILTERS = ("Sepia",
+                         "Red",
+                         "2-Colored RGB (Bicubic)",
+                         "2-Colored RGB (Linear)",
+                         "3D LUT (.cube)")
+
+# duration of frames in milliseconds if animated image or image sequence doesn't have it
+DEFAULT_FRAME_DURATION = 100
+
+# color modes supported by file formats which can't save palette images
+SAVING_MODES = {".jpg": ("L", "RGB"),
+                ".jpeg": ("L", "RGB"),
+                ".jfif": ("L", "RGB"),
+                ".ppm": ("L", "RGB"),
+                ".pgm": ("L", "RGB"),
+                ".pbm": ("L", "RGB")}
+
+
+def filter_image(pil_object, filter, tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2,
+                 max_colors=UNIQUE_COLORS_LIMIT, lut=None, skip_transparent=True):
+    """Applies filter chosen by its name in combobox, colors are tuples like ((r, g, b), '#rrggbb'), lut is CubeLUT
+    for "3D LUT (.cube)" filter. RGB and RGBA images having no more than max_colors unique colors are filtered
+    color by color. Fully transparent pixels of RGBA images are skipped if it doesn't change visible pixels"""
+
+    if skip_transparent and pil_object.mode == "RGBA":
+        new_image = filter_opaque(pil_object, filter, tint_color, color1, color2, max_colors, lut)
+        if new_image is not None:
+            return new_image
+
+    # palette images and grayscale images getting colors are filtered by their palette only
+    if pil_object.mode == "P" and filter in COLOR_FILTERS or pil_object.mode == "L" and filter in COLORIZING_FILTERS:
+        return filter_palette(pil_object, filter, tint_color, color1, color2, lut)
+
+    if max_colors and filter in UNIQUE_COLORS_FILTERS and pil_object.mode in ("RGB", "RGBA"):
+        new_image = filter_unique_colors(pil_object, filter, tint_color, color1, color2, max_colors, lut)
+        if new_image is not None:
+            return new_image
+
+    # filters with kernels can't work with palette
+    if pil_object.mode == "P" and filter in KERNEL_FILTERS:
+        pil_object = pil_object.convert("RGBA" if has_transparency(pil_object) else "RGB")
+
+    if filter == "Black and White":
+        return ImageOps.grayscale(pil_object)
+
+    elif filter == "Sepia":
+        return RGB_filter(pil_object, SEPIA_MATRIX)
+
+    elif filter == "Red":
+        return RGB_filter(pil_object, RED_MATRIX)
+
+    elif filter == "Overall Tint RGB Filter":
+        return RGB_filter_custom_color(pil_object, tint_color[0])
+
+    elif filter == "2-Colored RGB (Bicubic)":
+        return bicubic_interpolation(pil_object, color1, color2)
+
+    elif filter == "2-Colored RGB (Linear)":
+        return linear_interpolation(pil_object, color1, color2)
+
+    elif filter in KERNEL_FILTERS:
+        return pil_object.filter(KERNEL_FILTERS[filter])
+
+    elif filter == "Contour #2":
+        return pil_object.convert("L").filter(ImageFilter.FIND_EDGES)
+
+    elif filter == "Mirror":
+        return ImageOps.mirror(pil_object)
+
+    elif filter == "Invert":
+        # only transparent images are kept in RGBA mode
+        if pil_object.mode == "RGBA":
+            return invert_colors_rgba(pil_object)
+        return ImageOps.invert(pil_object)
+
+    elif filter.startswith("Posterize"):
+        # "Posterize 3 bit" -> 3
+        return ImageOps.posterize(pil_object, int(filter.split()[1]))
+
+    elif filter == "3D LUT (.cube)" and lut is not None:
+        return lut.apply(pil_object)
+
+    return pil_object
+
+
+def filter_opaque(pil_object, filter, tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2,
+                  max_colors=UNIQUE_COLORS_LIMIT, lut=None):
+    """Filters only bounding box of not fully transparent pixels of RGBA image, color filters are applied only to
+    those pixels inside it when most of the box is transparent. Fully transparent pixels are skipped only if they all
+    have one color, it's filtered once, so their RGB is the same as pixel by pixel filtering gives and contrast counts
+    the same mean. Returns None if nothing can be skipped"""
+
+    # kernel filters spread opaque pixels by their radius, filters with offset make transparent pixels visible
+    if filter in KERNEL_FILTERS:
+        (width, height), scale, offset, kernel = KERNEL_FILTERS[filter].filterargs
+        if offset:
+            return None
+        margin = max(width, height) // 2
+    elif filter in COLOR_FILTERS and filter not in GRAYSCALE_FILTERS:
+        margin = 0
+    else:
+        return None
+
+    img_array = np.asarray(pil_object)
+    hidden = img_array[:, :, 3] == 0
+    hidden_colors = img_array.view("<u4")[:, :, 0][hidden]
+    if not hidden_colors.size or (hidden_colors != hidden_colors[0]).any():
+        return None
+
+    # new color of transparent pixel is taken from the middle of uniform image, away from its edges
+    hidden_color = tuple(int(v) for v in img_array[hidden][0])
+    side = 4 * margin + 1
+    new_color = filter_image(Image.new("RGBA", (side, side), hidden_color), filter, tint_color, color1, color2,
+                             max_colors, lut, False).convert("RGBA").getpixel((2 * margin, 2 * margin))
+
+    # kernel filter must keep uniform transparent area as it is, pixels outside the box aren't filtered
+    if margin and new_color != hidden_color:
+        return None
+
+    bbox = pil_object.getchannel("A").getbbox()
+    new_image = Image.new("RGBA", pil_object.size, new_color)
+    if bbox is None:
+        return new_image
+
+    # pixels within margin of box are found from pixels within double margin, which is cropped
+    def expand(box, size):
+        return (max(0, box[0] - size), max(0, box[1] - size),
+                min(pil_object.width, box[2] + size), min(pil_object.height, box[3] + size))
+
+    inner, outer = expand(bbox, margin), expand(bbox, 2 * margin)
+    if margin:
+        if outer == (0, 0, pil_object.width, pil_object.height):
+            return None
+        new_part = filter_image(pil_object.crop(outer), filter, tint_color, color1, color2, max_colors, lut, False)
+        new_image.paste(new_part.crop((inner[0] - outer[0], inner[1] - outer[1],
+                                       inner[2] - outer[0], inner[3] - outer[1])), inner[:2])
+        return new_image
+
+    box_array = img_array[bbox[1]:bbox[3], bbox[0]:bbox[2]]
+    visible = ~hidden[bbox[1]:bbox[3], bbox[0]:bbox[2]]
+    count = int(np.count_nonzero(visible))
+
+    if count * 2 > visible.size:
+        if bbox == (0, 0, pil_object.width, pil_object.height):
+            return None
+        new_part = filter_image(pil_object.crop(bbox), filter, tint_color, color1, color2, max_colors, lut, False)
     else:
-        new_img_array = np.dstack([red, green, blue]).astype(np.uint8)
+        # visible pixels are packed into rows of image, transparent pixels fill the last row
+        width = min(count, 1024)
+        pixels = np.zeros((-(-count // width) * width, 4), dtype=np.uint8)
+        pixels[:count] = box_array[visible]
+        new_pixels = filter_image(Image.fromarray(pixels.reshape(-1, width, 4), "RGBA"), filter,
+                                  tint_color, color1, color2, max_colors, lut, False)
+
+        new_array = np.empty_like(box_array)
+        new_array[:] = new_color
+        new_array[visible] = np.asarray(new_pixels).reshape(-1, 4)[:count]
+        new_part = Image.fromarray(new_array, "RGBA")
+
+    new_image.paste(new_part, bbox[:2])
+    return new_image
+
+
+def filter_batch(images, filter, tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2):
+    """Applies color filter to N x H x W x C uint8 array of same-size RGB or RGBA images by one vectorized call,
+    e.g. to many thumbnails. Returns array of the same shape"""
+
+    if filter == "Sepia":
+        return get_backend().matrix(images, SEPIA_MATRIX)
+
+    elif filter == "Red":
+        return get_backend().matrix(images, RED_MATRIX)
+
+    elif filter == "Overall Tint RGB Filter":
+        return RGB_filter_custom_color_batch(images, tint_color[0])
+
+    elif filter == "2-Colored RGB (Bicubic)":
+        return get_backend().bicubic(images, color1, color2)
+
+    elif filter == "2-Colored RGB (Linear)":
+        return get_backend().linear(images, color1, color2)
 
-    if has_alpha:
-        return Image.fromarray(new_img_array, 'RGBA')
+    elif filter == "None":
+        return images
+
+    raise ValueError(f"{filter} can't filter batch of images")
+
+
+def filter_variants(image, filter, colors):
+    """Applies color filter to H x W x C uint8 array of RGB or RGBA image with every (tint_color, color1, color2) of
+    colors, returns N x H x W x C array. Tables of all colors are stacked, so filter runs by one vectorized call
+    whatever number of colors it has"""
+
+    images = image[np.newaxis]
+    check_batch(images)
+    variants = np.broadcast_to(images, (len(colors),) + image.shape)
+    channels = image.shape[2]
+
+    if filter == "Overall Tint RGB Filter":
+        # 256 x N x C tables like RGB_filter_custom_color_batch has, each channel level is replaced by its table
+        factors = np.array([tuple(tint_color[0][:3]) + (255,) for tint_color, color1, color2 in colors]) / 255.0
+        tables = np.clip(np.arange(256)[:, np.newaxis, np.newaxis] * factors[:, :channels], 0, 255).astype(np.uint8)
+        return tables[images, np.arange(len(colors))[:, np.newaxis, np.newaxis, np.newaxis], np.arange(channels)]
+
+    elif filter == "2-Colored RGB (Bicubic)":
+        # sums of channels are counted once, each color pair has its own part of stacked table
+        table = np.concatenate([bicubic_table(color1, color2, channels) for tint_color, color1, color2 in colors])
+        sums = image.sum(axis=2, dtype=np.int64)
+        offsets = np.arange(len(colors)) * (255 * channels + 1)
+        return take_colors(table, sums + offsets[:, np.newaxis, np.newaxis], variants)
+
+    elif filter == "2-Colored RGB (Linear)":
+        # dot products with directions of all color pairs are counted by one matrix product, float32 keeps them exact
+        tables, directions, lows = zip(*[linear_table(color1, color2) for tint_color, color1, color2 in colors])
+        offsets = np.cumsum([0] + [len(table) for table in tables[:-1]]) - np.array(lows)
+        products = image[:, :, :3].astype(np.float32) @ np.array(directions, dtype=np.float32).T
+        indices = np.ascontiguousarray(np.moveaxis(products, 2, 0), dtype=np.int32)
+        indices += offsets[:, np.newaxis, np.newaxis].astype(np.int32)
+        return take_colors(np.concatenate(tables), indices, variants)
+
+    # other filters don't have colors
+    return np.broadcast_to(filter_batch(images, filter), variants.shape)
+
+
+def blend_batch(degenerate, images, rates):
+    """Image.blend of degenerate and each image of N x H x W x C array with its own rate, float32 math and truncation
+    are the same as PIL uses, so results are equal to ImageEnhance"""
+
+    rates = np.asarray(rates, dtype=np.float32)[:, np.newaxis, np.newaxis, np.newaxis]
+    degenerate = np.asarray(degenerate, dtype=np.float32)
+    return np.clip(degenerate + rates * (images.astype(np.float32) - degenerate), 0, 255).astype(np.uint8)
+
+
+def enhance_batch(images, brightness, contrast):
+    """Batch version of enhance_image for N x H x W x C array, brightness and contrast in percents are given for each
+    image. Contrast uses mean gray level of each image after brightness"""
+
+    check_batch(images)
+    new_images = images.copy()
+    new_images[..., :3] = blend_batch(0, images[..., :3], np.asarray(brightness) * 0.01)
+
+    # gray levels like convert("L") of PIL, mean is rounded like in ImageEnhance.Contrast
+    rgb = new_images[..., :3].astype(np.uint32)
+    gray = (rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000) >> 16
+    means = np.floor(gray.mean(axis=(1, 2)) + 0.5)[:, np.newaxis, np.newaxis, np.newaxis]
+
+    new_images[..., :3] = blend_batch(means, new_images[..., :3], np.asarray(contrast) * 0.01)
+    return new_images
+
+
+def filter_palette(pil_object, filter, tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2,
+                   lut=None):
+    "Applies color filter to 256 palette colors instead of all pixels, returns P image"
+
+    # grayscale image gets gray palette with the same indexes as its gray levels
+    if pil_object.mode == "L":
+        pil_object = pil_object.convert("P")
+
+    colors = filter_image(get_palette_image(pil_object), filter, tint_color, color1, color2, max_colors=0, lut=lut)
+    return set_palette_image(pil_object, colors)
+
+
+def filter_unique_colors(pil_object, filter, tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2,
+                         max_colors=UNIQUE_COLORS_LIMIT, lut=None):
+    """Applies color filter once per unique color of RGB or RGBA image and scatters new colors back to pixels with
+    lookup table. Returns None if image has more than max_colors colors, so it must be filtered pixel by pixel"""
+
+    # alpha channel of transparent image must not change its new colors
+    if pil_object.mode == "RGBA" and filter == "2-Colored RGB (Bicubic)":
+        return None
+
+    # PIL counts colors by hash table and gives up as soon as there are too many of them
+    colors = pil_object.getcolors(max_colors)
+    if colors is None:
+        return None
+
+    # each RGB color is packed into 24-bit number, red is the lowest byte
+    palette = np.unique(np.array([color[:3] for count, color in colors], dtype=np.uint8), axis=0)
+    keys = palette.astype(np.uint32) @ np.array([1, 256, 65536], dtype=np.uint32)
+    new_colors = filter_image(Image.fromarray(palette[np.newaxis]), filter, tint_color, color1, color2,
+                              max_colors=0, lut=lut)
+
+    values = np.asarray(new_colors.convert("RGB"))[0].astype(np.uint32) @ np.array([1, 256, 65536], dtype=np.uint32)
+
+    img_array = np.asarray(pil_object if pil_object.mode == "RGBA" else pil_object.convert("RGBA"))
+    pixels = img_array.view("<u4")[:, :, 0] & 0xFFFFFF
+    new_array = color_table.lookup(keys, values, pixels).view(np.uint8).reshape(img_array.shape)
+
+    if pil_object.mode == "RGBA":
+        new_array[:, :, 3] = img_array[:, :, 3]
+        return Image.fromarray(new_array, "RGBA")
+    return Image.fromarray(np.ascontiguousarray(new_array[:, :, :3]))
+
+
+class ColorTable:
+    """24-bit lookup table shared by all threads for filter_unique_colors. It's allocated only if it fits memory
+    budget and dropped when budget releases caches, then colors are found by binary search among keys instead"""
+
+    nbytes = 4 << 24
+
+    def __init__(self):
+        self.table = None
+        self.lock = Lock()
+        memory_budget.register(self.release)
+
+    def release(self):
+        with self.lock:
+            self.table = None
+
+    def lookup(self, keys, values, pixels):
+        "Returns values of keys which pixels have, keys are 24-bit colors"
+
+        with self.lock:
+            if self.table is None and memory_budget.fits(self.nbytes, release=False):
+                self.table = np.empty(1 << 24, dtype="<u4")
+
+            # only entries of colors found in image are written and read
+            if self.table is not None:
+                self.table[keys] = values
+                return self.table[pixels]
+
+        order = np.argsort(keys)
+        return values[order][np.searchsorted(keys[order], pixels)]
+
+
+def working_mode(image):
+    "Converts image to color mode which filters can work with, palette and grayscale images stay compact"
+
+    # PIL stores 1-bit images by bytes anyway, so L mode takes no more memory
+    if image.mode == "1":
+        return image.convert("L")
+
+    # other color modes such as RGBX, CMYK, LA, or I are converted to RGBA
+    elif image.mode not in ("P", "L", "RGB", "RGBA"):
+        return image.convert("RGBA")
+
+    return image
+
+
+def filtered_mode(mode, filter):
+    "Returns color mode of L, RGB, or RGBA image after filter_image, palette result is taken as RGB"
+
+    if filter in GRAYSCALE_FILTERS:
+        return "L"
+    if mode == "L" and filter in COLORIZING_FILTERS:
+        return "RGB"
+    return mode
+
+
+def convert_for_saving(pil_object, filename):
+    "Converts palette image to RGB if chosen file format can't save it"
+
+    modes = SAVING_MODES.get(os.path.splitext(filename)[1].lower())
+    if modes is not None and pil_object.mode not in modes:
+        return pil_object.convert("RGB")
+    return pil_object
+
+
+def enhance_image(pil_object, brightness, contrast, mean=None):
+    """Changes brightness and contrast given in percents. Contrast uses mean gray level of the whole image,
+    so it can be passed when image is processed by parts"""
+
+    # palette image is enhanced by its palette colors
+    if pil_object.mode == "P" and (brightness != 100 or contrast != 100):
+        colors = enhance_image(get_palette_image(pil_object), brightness, 100)
+        if mean is None:
+            # mean gray level of palette colors weighted by number of pixels with them
+            levels = np.asarray(colors.convert("L")).ravel()
+            counts = pil_object.histogram()[:len(levels)]
+            mean = int(np.dot(counts, levels) / (pil_object.width * pil_object.height) + 0.5)
+        colors = enhance_image(colors, 100, contrast, mean)
+        return set_palette_image(pil_object, colors)
+
+    brightness_rate = brightness * 0.01
+    contrast_rate = contrast * 0.01
+
+    if brightness_rate != 1:
+        pil_object = ImageEnhance.Brightness(pil_object).enhance(brightness_rate)
+
+    if contrast_rate != 1:
+        if mean is None:
+            pil_object = ImageEnhance.Contrast(pil_object).enhance(contrast_rate)
+        else:
+            # the same gray image as ImageEnhance.Contrast makes, but with given mean
+            degenerate = Image.new("L", pil_object.size, mean).convert(pil_object.mode)
+            if "A" in pil_object.getbands():
+                degenerate.putalpha(pil_object.getchannel("A"))
+            pil_object = Image.blend(degenerate, pil_object, contrast_rate)
+
+    return pil_object
+
+
+class RawImage:
+    """Pixel data of uncompressed bmp, ppm, pgm, tga, and tif files mapped to memory with np.memmap.
+    PIL reads only file header, pixels are read or written band by band and OS pages them in and out"""
+
+    # PIL raw modes which can be mapped: raw mode -> (color mode, order of channels, bytes per pixel)
+    raw_modes = {"L": ("L", None, 1),
+                 "RGB": ("RGB", None, 3),
+                 "BGR": ("RGB", [2, 1, 0], 3),
+                 "RGBX": ("RGB", [0, 1, 2], 4),
+                 "BGRX": ("RGB", [2, 1, 0], 4),
+                 "RGBA": ("RGBA", None, 4),
+                 "BGRA": ("RGBA", [2, 1, 0, 3], 4)}
+
+    # file formats which can be created by RawImage.create and their color modes
+    writable = {".ppm": ("L", "RGB"),
+                ".pgm": ("L", "RGB"),
+                ".bmp": ("L", "RGB"),
+                ".tga": ("L", "RGB", "RGBA")}
+
+    def __init__(self, filename, access="r"):
+        self.filename = filename
+        self.access = access
+        self.data = None
+
+        # raises PIL.UnidentifiedImageError or OSError for damaged files
+        with Image.open(filename) as image:
+            tiles = image.tile
+            self.mode = image.mode
+            self.size = image.size
+
+        if not tiles or any(t[0] != "raw" for t in tiles):
+            raise ValueError("Image is compressed")
+
+        # ppm plugin gives only raw mode instead of tuple
+        args = tiles[0][3] if isinstance(tiles[0][3], tuple) else (tiles[0][3], 0, 1)
+        raw_mode, stride, orientation = args[0], args[1], args[2] if len(args) > 2 else 1
+
+        if raw_mode not in self.raw_modes or self.raw_modes[raw_mode][0] != self.mode:
+            raise ValueError(f"Raw mode {raw_mode} can't be mapped")
+
+        width, height = self.size
+        self.channels, self.pixel_size = self.raw_modes[raw_mode][1:]
+        self.stride = stride or width * self.pixel_size
+        self.offset = tiles[0][2]
+        self.bottom_up = orientation < 0
+
+        # tif strips must follow each other without gaps
+        for t in tiles:
+            x0, y0, x1, y1 = t[1]
+            if (x0, x1) != (0, width) or t[2] != self.offset + y0 * self.stride or t[3] != tiles[0][3]:
+                raise ValueError("Image data isn't continuous")
+
+    def open(self):
+        "Maps pixel data to memory"
+
+        if self.data is None:
+            self.data = np.memmap(self.filename,
+                                  dtype=np.uint8,
+                                  mode=self.access,
+                                  offset=self.offset,
+                                  shape=(self.size[1], self.stride))
+        return self
+
+    def close(self):
+        "Writes changes to disk and releases the file so that it could be overwritten or deleted"
+
+        if self.data is not None:
+            if self.access != "r":
+                self.data.flush()
+            self.data = None
+
+    def rows(self, y0, y1):
+        "Returns file rows of image rows from y0 to y1 as a view, bottom-up files are read backwards"
+
+        height = self.size[1]
+        if self.bottom_up:
+            return self.data[height - y1:height - y0][::-1]
+        return self.data[y0:y1]
+
+    def band(self, y0, y1):
+        "Returns image rows from y0 to y1 as a numpy array for Image.fromarray"
+
+        width = self.size[0]
+        pixels = self.rows(y0, y1)[:, :width * self.pixel_size].reshape(y1 - y0, width, self.pixel_size)
+
+        if self.channels is not None:
+            pixels = pixels[:, :, self.channels]
+        if self.mode == "L":
+            pixels = pixels[:, :, 0]
+        return np.ascontiguousarray(pixels)
+
+    def write_band(self, y0, array):
+        "Writes numpy array of image rows starting from y0"
+
+        width = self.size[0]
+        if array.ndim == 2:
+            array = array[:, :, np.newaxis]
+        if self.channels is not None:
+            # inverse order of channels, e.g. RGB -> BGR
+            array = array[:, :, np.argsort(self.channels)]
+
+        pixels = self.rows(y0, y0 + array.shape[0])[:, :width * self.pixel_size]
+        pixels[:] = array.reshape(array.shape[0], width * self.pixel_size)
+
+    @staticmethod
+    def create(filename, size, mode):
+        "Writes header of new uncompressed image and reserves disk space for its pixels"
+
+        width, height = size
+        extension = os.path.splitext(filename)[1].lower()
+        if mode not in RawImage.writable.get(extension, ()):
+            raise ValueError(f"Can't write {mode} image as {extension}")
+
+        bands = len(mode)
+
+        if extension in (".ppm", ".pgm"):
+            header = f"{'P5' if mode == 'L' else 'P6'}\n{width} {height}\n255\n".encode()
+            data_size = width * bands * height
+
+        elif extension == ".bmp":
+            # rows of bmp are aligned to 4 bytes, 8-bit images need grayscale palette
+            stride = (width * bands + 3) & ~3
+            palette = bytes(b for i in range(256) for b in (i, i, i, 0)) if mode == "L" else b""
+            offset = 14 + 40 + len(palette)
+            data_size = stride * height
+            header = (b"BM" + (offset + data_size).to_bytes(4, "little") + bytes(4) +
+                      offset.to_bytes(4, "little") + (40).to_bytes(4, "little") +
+                      width.to_bytes(4, "little") + height.to_bytes(4, "little") + (1).to_bytes(2, "little") +
+                      (bands * 8).to_bytes(2, "little") + bytes(4) + data_size.to_bytes(4, "little") +
+                      (2835).to_bytes(4, "little") * 2 + (256 if mode == "L" else 0).to_bytes(4, "little") +
+                      bytes(4) + palette)
+
+        else:
+            # tga: image type 3 is grayscale, 2 is true color; descriptor sets top-left origin and alpha bits
+            descriptor = 0x20 | (8 if mode == "RGBA" else 0)
+            header = (bytes([0, 0, 3 if mode == "L" else 2]) + bytes(9) + width.to_bytes(2, "little") +
+                      height.to_bytes(2, "little") + bytes([bands * 8, descriptor]))
+            data_size = width * bands * height
+
+        with open(filename, "wb") as file:
+            file.write(header)
+            file.truncate(len(header) + data_size)
+
+        return RawImage(filename, access="r+")
+
+
+class ImageBands:
+    "Rows of image in memory with the same methods as RawImage has, so it can be processed band by band too"
+
+    def __init__(self, image, mode=None):
+        self.image = image
+        self.size = image.size
+        # palette bands are converted, filters with kernels can't work with palette
+        self.mode = mode or image.mode
+
+    def band(self, y0, y1):
+        "Returns image rows from y0 to y1 as a numpy array for Image.fromarray"
+
+        band = self.image.crop((0, y0, self.size[0], y1))
+        return np.asarray(band if band.mode == self.mode else band.convert(self.mode))
+
+    def write_band(self, y0, array):
+        "Writes numpy array of image rows starting from y0"
+
+        self.image.paste(Image.fromarray(array), (0, y0))
+
+
+def band_halo(filter):
+    """Returns number of rows added above and below each band, filters with kernels get two more rows, so edges of
+    bands are the same as in whole image"""
+
+    return 2 if filter in KERNEL_FILTERS or filter == "Contour #2" else 0
+
+
+def render_bands(source, target, filter, tint_color, color1, color2, brightness, contrast, lut=None, mean=None,
+                 band_height=512):
+    """Applies filter, brightness and contrast to source band by band and writes bands to target, they are RawImage
+    or ImageBands. Only one band of temporary arrays is kept in memory. Mean gray level for contrast is counted from
+    all bands if it isn't given"""
+
+    width, height = source.size
+    mode = filtered_mode(source.mode, filter)
+    halo = band_halo(filter)
+    histogram = np.zeros(256)
+
+    for y0 in range(0, height, band_height):
+        y1 = min(y0 + band_height, height)
+        top, bottom = max(0, y0 - halo), min(height, y1 + halo)
+
+        band = filter_image(Image.fromarray(source.band(top, bottom)), filter, tint_color, color1, color2, lut=lut)
+        band = band.crop((0, y0 - top, width, y1 - top)).convert(mode)
+        band = enhance_image(band, brightness, 100 if mean is None else contrast, mean)
+        target.write_band(y0, np.asarray(band))
+
+        # contrast needs mean gray level of the whole image, so it's applied by the second pass
+        if contrast != 100 and mean is None:
+            histogram += band.convert("L").histogram()
+
+    if contrast != 100 and mean is None:
+        mean = int(np.dot(histogram, np.arange(256)) / (width * height) + 0.5)
+        for y0 in range(0, height, band_height):
+            y1 = min(y0 + band_height, height)
+            band = enhance_image(Image.fromarray(target.band(y0, y1)), 100, contrast, mean)
+            target.write_band(y0, np.asarray(band))
+
+
+def render_raw(raw_image, new_image_name, filter, tint_color, color1, color2, brightness, contrast, lut=None,
+               band_height=512):
+    """Applies filter, brightness and contrast to memory-mapped image band by band and writes result to
+    memory-mapped file, so huge images are never decoded to memory as a whole"""
+
+    # new image is mapped to file, so only bands are kept in memory
+    band_height = memory_budget.plan(raw_image.size, raw_image.mode, filter, brightness, contrast, band_height,
+                                     mapped=True)
+    if band_height is None:
+        raise MemoryError(f"bands of {raw_image.size[0]} pixels wide image don't fit memory budget")
+
+    mode = filtered_mode(raw_image.mode, filter)
+    new_image = RawImage.create(new_image_name, raw_image.size, mode).open()
+    raw_image.open()
+
+    metrics.count("banded_renders")
+    try:
+        with metrics.stage("filter"):
+            render_bands(raw_image, new_image, filter, tint_color, color1, color2, brightness, contrast, lut,
+                         band_height=band_height)
+    finally:
+        raw_image.close()
+        new_image.close()
+
+
+def reduce_raw(raw_image, factor, band_height=512):
+    """Returns memory-mapped image made factor times smaller, it's reduced band by band by Image.reduce, so only one
+    band of the full image is read to memory at once"""
+
+    width, height = raw_image.size
+    new_image = Image.new(raw_image.mode, (-(-width // factor), -(-height // factor)))
+
+    # bands start at multiples of factor, so boxes of reduce are the same as in the whole image
+    step = max(1, band_height // factor) * factor
+    for y0 in range(0, height, step):
+        y1 = min(y0 + step, height)
+        new_image.paste(Image.fromarray(raw_image.band(y0, y1)).reduce(factor), (0, y0 // factor))
+    return new_image
+
+
+def render_full(image, filter, tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2,
+                brightness=100, contrast=100, lut=None, mean=None, band_height=512):
+    """Applies filter, brightness and contrast to the whole image, or band by band if temporary arrays of the whole
+    image don't fit memory budget, bands are lowered from band_height until they fit. Raises MemoryError if even
+    new image doesn't fit it"""
+
+    plan = memory_budget.plan(image.size, image.mode, filter, brightness, contrast, band_height)
+    if plan is None:
+        raise MemoryError(f"{image.width}x{image.height} image doesn't fit memory budget")
+
+    if plan == "whole":
+        with metrics.stage("filter"):
+            new_image = filter_image(image, filter, tint_color, color1, color2, lut=lut)
+        with metrics.stage("enhance"):
+            return enhance_image(new_image, brightness, contrast, mean)
+
+    metrics.count("banded_renders")
+    source = ImageBands(image, ("RGBA" if has_transparency(image) else "RGB") if image.mode == "P" else None)
+    target = ImageBands(Image.new(filtered_mode(source.mode, filter), image.size))
+    with metrics.stage("filter"):
+        render_bands(source, target, filter, tint_color, color1, color2, brightness, contrast, lut, mean, plan)
+    return target.image
+
+
+class CubeLUT:
+    """3D color lookup table which can be saved to and loaded from .cube files. Any color filter with its colors,
+    brightness and contrast can be baked into it, and applying it costs the same whatever filter it was made of"""
+
+    def __init__(self, table, title="", domain_min=(0, 0, 0), domain_max=(1, 1, 1)):
+        # table of new colors from 0 to 1 with shape (size, size, size, 3), it's indexed by blue, green, and red
+        self.table = np.asarray(table, dtype=np.float32)
+        self.title = title
+        self.domain_min = np.array(domain_min, dtype=np.float32)
+        self.domain_max = np.array(domain_max, dtype=np.float32)
+
+        # path of .cube file if LUT is loaded from file
+        self.filename = None
+
+    @staticmethod
+    def bake(filter, tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2,
+             brightness=100, contrast=100, mean=128, size=33, lut=None):
+        """Applies color filter, brightness and contrast to lattice colors of new LUT. Contrast depends on mean
+        gray level of image, so it must be taken from image the LUT is made for"""
+
+        levels = np.round(np.linspace(0, 255, size)).astype(np.uint8)
+        blue, green, red = np.meshgrid(levels, levels, levels, indexing="ij")
+        lattice = Image.fromarray(np.stack([red, green, blue], axis=-1).reshape(size * size, size, 3))
+
+        lattice = filter_image(lattice, filter, tint_color, color1, color2, max_colors=0, lut=lut)
+        lattice = enhance_image(lattice, brightness, contrast, mean)
+
+        table = np.asarray(lattice.convert("RGB")).reshape(size, size, size, 3) / 255
+        return CubeLUT(table, title=f"DualTone {filter}")
+
+    @staticmethod
+    def load(filename):
+        "Reads .cube file, raises ValueError if it's wrong or it contains 1D LUT"
+
+        size = None
+        domain_min, domain_max = (0, 0, 0), (1, 1, 1)
+        title = ""
+        rows = []
+
+        with open(filename) as file:
+            for line in file:
+                words = line.split()
+                if not words or words[0].startswith("#"):
+                    continue
+                elif words[0] == "TITLE":
+                    title = line.strip()[5:].strip().strip('"')
+                elif words[0] == "LUT_3D_SIZE":
+                    size = int(words[1])
+                elif words[0] == "LUT_1D_SIZE":
+                    raise ValueError("1D LUT isn't supported")
+                elif words[0] == "DOMAIN_MIN":
+                    domain_min = [float(w) for w in words[1:4]]
+                elif words[0] == "DOMAIN_MAX":
+                    domain_max = [float(w) for w in words[1:4]]
+                elif words[0] == "LUT_3D_INPUT_RANGE":
+                    domain_min, domain_max = [float(words[1])] * 3, [float(words[2])] * 3
+                elif words[0][0].isalpha():
+                    # skips other keywords
+                    continue
+                else:
+                    rows.append([float(w) for w in words[:3]])
+
+        if size is None or size < 2 or len(rows) != size ** 3:
+            raise ValueError("Wrong .cube file")
+
+        # colors are scaled by width of domain
+        if len(domain_min) != 3 or len(domain_max) != 3 or any(a >= b for a, b in zip(domain_min, domain_max)):
+            raise ValueError("DOMAIN_MIN must be less than DOMAIN_MAX")
+
+        # red changes fastest in .cube files, so rows are reshaped to table indexed by blue, green, and red
+        lut = CubeLUT(np.array(rows).reshape(size, size, size, 3), title, domain_min, domain_max)
+        lut.filename = os.path.abspath(filename)
+        return lut
+
+    def save(self, filename):
+        "Writes LUT to .cube file"
+
+        with open(filename, "w") as file:
+            file.write(f'TITLE "{self.title}"\n'
+                       f'# Created by DualTone\n'
+                       f'LUT_3D_SIZE {self.table.shape[0]}\n'
+                       f'DOMAIN_MIN {" ".join(str(v) for v in self.domain_min)}\n'
+                       f'DOMAIN_MAX {" ".join(str(v) for v in self.domain_max)}\n')
+            np.savetxt(file, self.table.reshape(-1, 3), fmt="%.6f")
+
+    def coordinates(self):
+        """Returns lattice coordinates of all 256 levels of each channel split into integer and fractional parts,
+        both are 256 x 3 arrays"""
+
+        size = self.table.shape[0]
+        coordinates = np.clip((np.arange(256, dtype=np.float32)[:, np.newaxis] / 255 - self.domain_min) /
+                              (self.domain_max - self.domain_min) * (size - 1), 0, size - 1)
+        bases = np.minimum(coordinates.astype(np.intp), size - 2)
+        fractions = (coordinates - bases).astype(np.float32)
+        return bases, fractions
+
+    def apply(self, pil_object):
+        "Applies LUT to RGB or RGBA image by current backend"
+
+        img_array = np.asarray(pil_object)
+        return Image.fromarray(map_bands(lambda band: get_backend().lut(self, band), img_array),
+                               "RGBA" if img_array.shape[2] == 4 else "RGB")
+
+    def apply_batch(self, images, chunk=1 << 20):
+        """Applies LUT to N x H x W x C array of RGB or RGBA images with vectorized tetrahedral interpolation,
+        pixels are processed by chunks"""
+
+        rgb = images[..., :3].reshape(-1, 3)
+        size = self.table.shape[0]
+        colors = self.table.reshape(-1, 3)
+        bases, fractions = self.coordinates()
+
+        # steps in flattened table for red, green, and blue
+        steps = np.array([1, size, size * size])
+        new_rgb = np.empty(rgb.shape, dtype=np.uint8)
+        channels = np.arange(3)
+
+        for start in range(0, len(rgb), chunk):
+            pixels = rgb[start:start + chunk]
+            base = bases[pixels, channels]
+            fraction = fractions[pixels, channels]
+
+            # tetrahedron is chosen by order of fractions: path from lower corner goes along the largest one first
+            order = np.argsort(-fraction, axis=1)
+            fraction = np.take_along_axis(fraction, order, axis=1)
+
+            corner0 = base @ steps
+            corner1 = corner0 + steps[order[:, 0]]
+            corner2 = corner1 + steps[order[:, 1]]
+            corner3 = corner0 + steps.sum()
+
+            new_colors = (colors[corner0] * (1 - fraction[:, 0:1]) +
+                          colors[corner1] * (fraction[:, 0:1] - fraction[:, 1:2]) +
+                          colors[corner2] * (fraction[:, 1:2] - fraction[:, 2:3]) +
+                          colors[corner3] * fraction[:, 2:3])
+            new_rgb[start:start + chunk] = np.clip(new_colors * 255 + 0.5, 0, 255)
+
+        new_rgb = new_rgb.reshape(images.shape[:-1] + (3,))
+        if images.shape[-1] == 4:
+            return np.concatenate([new_rgb, images[..., 3:]], axis=-1)
+        return new_rgb
+
+
+def map_frames(function, frames, workers=None, window=None):
+    """Applies function to frames by thread pool and yields results in the same order. No more than window frames
+    are read and processed at once, so memory doesn't depend on number of frames"""
+
+    workers = workers or os.cpu_count() or 1
+    window = window or 2 * workers
+    pending = deque()
+
+    with ThreadPoolExecutor(workers) as executor:
+        for frame in frames:
+            pending.append(executor.submit(function, frame))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+class FrameSequence:
+    """Frames of animated gif, webp, or png file, or of numbered image files like shot_0001.png, shot_0002.png.
+    Frames are read lazily one by one and filtered in parallel"""
+
+    # file formats which can store animation
+    animated_extensions = (".gif", ".webp", ".png")
+
+    def __init__(self, filenames):
+        self.filenames = filenames
+
+        with Image.open(filenames[0]) as image:
+            self.loop = image.info.get("loop", 0)
+            self.length = getattr(image, "n_frames", 1) if len(filenames) == 1 else len(filenames)
+
+    def __len__(self):
+        return self.length
+
+    @staticmethod
+    def numbered(filename):
+        "Returns sorted paths of all numbered files of the same sequence as filename"
+
+        folder, name = os.path.split(filename)
+        match = re.fullmatch(r"(.*?)(\d+)(\.\w+)", name)
+        if match is None:
+            return [filename]
+
+        prefix, digits, extension = match.groups()
+        pattern = re.compile(re.escape(prefix) + r"(\d{%d})" % len(digits) + re.escape(extension), re.IGNORECASE)
+        names = [n for n in os.listdir(folder or ".") if pattern.fullmatch(n)]
+        names.sort(key=lambda n: int(pattern.fullmatch(n).group(1)))
+        return [os.path.join(folder, n) for n in names]
+
+    def frames(self):
+        "Yields copies of frames with their durations one by one"
+
+        for filename in self.filenames:
+            with Image.open(filename) as image:
+                for frame in ImageSequence.Iterator(image):
+                    yield working_mode(frame.copy()), frame.info.get("duration", DEFAULT_FRAME_DURATION)
+
+    def durations(self):
+        "Returns durations of all frames of animated file, encoders need them before frames are rendered"
+
+        durations = []
+        with Image.open(self.filenames[0]) as image:
+            for frame in ImageSequence.Iterator(image):
+                # webp plugin reads duration when frame is decoded, frames are decoded one by one
+                if image.format == "WEBP":
+                    frame.load()
+                durations.append(frame.info.get("duration", DEFAULT_FRAME_DURATION))
+        return durations
+
+    def save(self, new_image_name, filter, tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2,
+             brightness=100, contrast=100, lut=None, workers=None, window=None):
+        """Filters all frames and saves them as animated file, or as numbered files if sequence is made of files.
+        Returns name of the first saved file"""
+
+        frames = self.frames()
+        first, first_duration = next(frames)
+
+        # the same contrast mean of the first frame is used for all frames, so that frames don't flicker. The first
+        # frame is filtered once, its contrast is changed when the mean is found
+        lit = render_full(first, filter, tint_color, color1, color2, brightness, 100, lut)
+        mean = int(ImageStat.Stat(lit.convert("L")).mean[0] + 0.5)
+
+        # png and webp encoders can't mix palette frames with true color ones
+        true_color = len(self.filenames) == 1 and not new_image_name.lower().endswith(".gif")
+
+        def finish(frame):
+            metrics.count_image(frame)
+            if true_color and frame.mode in ("P", "L"):
+                frame = frame.convert("RGBA" if has_transparency(frame) else "RGB")
+            return frame
+
+        def render(item):
+            frame, duration = item
+            frame = render_full(frame, filter, tint_color, color1, color2, brightness, contrast, lut, mean)
+            return finish(frame), duration
+
+        first_frame = finish(enhance_image(lit, 100, contrast, mean))
+        rendered = map_frames(render, frames, workers, window)
+
+        # numbered files get numbers of source files: result.png -> result_0001.png, result_0002.png...
+        if len(self.filenames) > 1:
+            def all_frames():
+                yield first_frame, first_duration
+                yield from rendered
+
+            root, extension = os.path.splitext(new_image_name)
+            names = []
+            for filename, (frame, duration) in zip(self.filenames, all_frames()):
+                number = re.search(r"(\d+)\.\w+$", filename).group(1)
+                names.append(f"{root}_{number}{extension}")
+                convert_for_saving(frame, names[-1]).save(names[-1])
+            return names[0]
+
+        # gif encoder takes frames one by one
+        if new_image_name.lower().endswith(".gif"):
+            first_frame.save(new_image_name, save_all=True, append_images=(frame for frame, duration in rendered),
+                             duration=self.durations(), loop=self.loop)
+            return new_image_name
+
+        # webp and png encoders make list of frames, so rendered frames are written to temporary file mapped to
+        # memory and the list holds only views of it, OS pages them in and out. Png encoder still copies every frame
+        # to find its changed box, that can't be avoided
+        with tempfile.TemporaryFile() as file:
+            append_images = []
+            if self.length > 1:
+                spill = np.memmap(file, dtype=np.uint8, mode="w+",
+                                  shape=(self.length - 1, first_frame.height, first_frame.width, 4))
+                for i, (frame, duration) in enumerate(rendered):
+                    # RGB frame is viewed as RGBX, so encoders don't add alpha channel to it
+                    mode = "RGBA" if frame.mode == "RGBA" else "RGBX"
+                    spill[i] = np.asarray(frame.convert("RGBA"))
+                    append_images.append(Image.frombuffer(mode, frame.size, spill[i], "raw", mode, 0, 1))
+
+            first_frame.save(new_image_name, save_all=True, append_images=append_images, duration=self.durations(),
+                             loop=self.loop)
+        return new_image_name
+
+
+def process_memory_counters():
+    "Returns PROCESS_MEMORY_COUNTERS of process on Windows, or None if they can't be found"
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong)] + \
+                   [(name, ctypes.c_size_t) for name in ("PeakWorkingSetSize", "WorkingSetSize",
+                                                         "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                                                         "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+                                                         "PagefileUsage", "PeakPagefileUsage")]
+
+    counters = ProcessMemoryCounters(cb=ctypes.sizeof(ProcessMemoryCounters))
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return counters
+    return None
+
+
+def peak_rss():
+    "Returns peak resident memory of process in bytes, or None if it can't be found"
+
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS gives bytes, Linux gives kilobytes
+        return rss if sys.platform == "darwin" else rss * 1024
+
+    if sys.platform == "win32":
+        counters = process_memory_counters()
+        if counters is not None:
+            return counters.PeakWorkingSetSize
+
+    return None
+
+
+def resident_memory():
+    "Returns current resident memory of process in bytes, or None if it can't be found"
+
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    if sys.platform == "win32":
+        counters = process_memory_counters()
+        if counters is not None:
+            return counters.WorkingSetSize
+
+    return None
+
+
+def available_memory():
+    "Returns physical memory which can be allocated without swapping in bytes, or None if it can't be found"
+
+    # Linux counts page cache, which is dropped when memory is needed, as available
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+
+    if sys.platform == "win32":
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong)] + \
+                       [(name, ctypes.c_ulonglong) for name in ("ullTotalPhys", "ullAvailPhys", "ullTotalPageFile",
+                                                                "ullAvailPageFile", "ullTotalVirtual",
+                                                                "ullAvailVirtual", "ullAvailExtendedVirtual")]
+
+        status = MemoryStatus(dwLength=ctypes.sizeof(MemoryStatus))
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+        return None
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class Metrics:
+    """Counters and latency histograms of stages of rendering images (decode, resize, filter, enhance, encode),
+    they are exported as Prometheus text or JSON lines. Disabled metrics cost only a check of one attribute"""
+
+    # upper bounds of latency histogram buckets in seconds
+    buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.enabled = False
+        self.filename = None
+        self.lock = Lock()
+        self.started = time.time()
+        self.counters = {}
+        # stage -> counts of buckets with +Inf bucket in the end, sum of latencies
+        self.latencies = {}
+
+    def enable(self, filename=None, interval=10):
+        """Starts collecting metrics. If filename is given, they're written to it every interval seconds and on exit,
+        .prom file is rewritten with Prometheus text, other files get one JSON line each time"""
+
+        self.enabled = True
+        self.started = time.time()
+        self.filename = filename
+
+        if filename:
+            def write_periodically():
+                while True:
+                    time.sleep(interval)
+                    self.export()
+
+            Thread(target=write_periodically, daemon=True).start()
+            atexit.register(self.export)
+
+    def stage(self, name):
+        "Returns context manager which measures latency of stage, it does nothing if metrics are disabled"
+
+        return self.timer(name) if self.enabled else contextlib.nullcontext()
+
+    def call(self, name, function, *args, **kwargs):
+        "Calls function measuring its latency as stage, arguments are evaluated before it"
+
+        with self.stage(name):
+            return function(*args, **kwargs)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            counts, total = self.latencies.get(name) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.latencies[name] = (counts, total + seconds)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_image(self, image):
+        "Counts rendered image and its megapixels, image is PIL image or RawImage"
+
+        width, height = image.size
+        self.count("images")
+        self.count("megapixels", width * height / 1e6)
+
+    def snapshot(self):
+        "Returns all metrics with rates and cache hit ratio as dictionary"
+
+        with self.lock:
+            counters = dict(self.counters)
+            latencies = {name: (list(counts), total) for name, (counts, total) in self.latencies.items()}
+
+        uptime = time.time() - self.started
+        lookups = counters.get("cache_hits", 0) + counters.get("cache_misses", 0)
+        return {"time": time.time(),
+                "uptime_seconds": uptime,
+                "counters": counters,
+                "images_per_second": counters.get("images", 0) / uptime,
+                "megapixels_per_second": counters.get("megapixels", 0) / uptime,
+                "cache_hit_ratio": counters.get("cache_hits", 0) / lookups if lookups else None,
+                "peak_rss_bytes": peak_rss(),
+                "stages": {name: {"count": sum(counts), "sum_seconds": total,
+                                  "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], counts))}
+                           for name, (counts, total) in latencies.items()}}
+
+    def prometheus(self):
+        "Returns metrics in Prometheus text format"
+
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            lines += [f"# TYPE dualtone_{name}_total counter", f"dualtone_{name}_total {value}"]
+
+        for name in ("uptime_seconds", "images_per_second", "megapixels_per_second", "cache_hit_ratio",
+                     "peak_rss_bytes"):
+            if snapshot[name] is not None:
+                lines += [f"# TYPE dualtone_{name} gauge", f"dualtone_{name} {snapshot[name]}"]
+
+        lines.append("# TYPE dualtone_stage_seconds histogram")
+        for name, stage in sorted(snapshot["stages"].items()):
+            cumulative = 0
+            for bound, count in stage["buckets"].items():
+                cumulative += count
+                lines.append(f'dualtone_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines += [f'dualtone_stage_seconds_sum{{stage="{name}"}} {stage["sum_seconds"]}',
+                      f'dualtone_stage_seconds_count{{stage="{name}"}} {stage["count"]}']
+
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        "Writes metrics to file given to enable method"
+
+        try:
+            if self.filename.endswith(".prom"):
+                # Prometheus node exporter mustn't read half-written file
+                with open(self.filename + ".part", "w") as file:
+                    file.write(self.prometheus())
+                os.replace(self.filename + ".part", self.filename)
+            else:
+                with open(self.filename, "a") as file:
+                    file.write(json.dumps(self.snapshot()) + "\n")
+        except OSError:
+            pass
+
+
+# metrics of the whole process, they're enabled by --metrics argument
+metrics = Metrics()
+
+
+def keeps_palette(mode, filter):
+    "Checks if filter_image filters only palette of P or L image, such image needs no bands"
+
+    return (mode == "P" and (filter in COLOR_FILTERS or filter in ("None", "Mirror")) or
+            mode == "L" and filter in COLORIZING_FILTERS)
+
+
+def footprint(mode, filter, brightness=100, contrast=100):
+    """Estimates bytes per pixel which filter_image and enhance_image take for image of mode: bytes of new image
+    and bytes of temporary copies and arrays, which are released when they return"""
+
+    temporary = 0
+
+    if keeps_palette(mode, filter):
+        # only 256 colors are filtered, new image has the same indexes
+        new = 0 if filter == "None" else 1
     else:
-        return Image.fromarray(new_img_array, 'RGB')
+        # other filters convert palette first, it's taken as transparent, transparency isn't known here
+        if mode == "P":
+            mode, temporary = "RGBA", 4
+
+        channels = len(mode)
+        new = 0 if filter == "None" else len(filtered_mode(mode, filter))
+        if filter in COLOR_FILTERS or filter == "Invert" and mode == "RGBA":
+            # copy of pixels for numpy and its bytes, new array and its copy for PIL, 32-bit colors of unique colors
+            temporary += 2 * channels + new + 12
+
+        # transparent pixels are skipped by copies of bounding box
+        if mode == "RGBA" and filter != "None":
+            temporary += 3 * channels
+
+    # enhancers make gray image of the same size and blend it with image into new one, contrast counts gray levels
+    if brightness != 100 or contrast != 100:
+        new = new or len(mode)
+        temporary += 2 * new + (contrast != 100)
+
+    return new, temporary
+
+
+class MemoryBudget:
+    """Memory which processing of an image may take, it's limit minus memory taken by process, or available RAM if
+    limit isn't set. Footprint of filter, brightness and contrast is estimated before they're applied, and when it's
+    over budget, image is processed band by band, caches of registered objects are dropped, and previews are filtered
+    at window size instead of the whole image"""
+
+    # part of available RAM which may be taken, the rest is left for OS and other apps
+    share = 0.8
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.releasers = []
+        self.lock = Lock()
+
+    def register(self, release):
+        "Registers bound method which drops caches of its object, budget doesn't keep object alive"
+
+        with self.lock:
+            self.releasers = [releaser for releaser in self.releasers if releaser() is not None]
+            self.releasers.append(weakref.WeakMethod(release))
+
+    def release(self):
+        "Drops caches of all registered objects"
+
+        with self.lock:
+            releasers = [releaser() for releaser in self.releasers]
+        for release in releasers:
+            if release is not None:
+                release()
+        metrics.count("cache_drops")
+
+    def free(self):
+        "Returns bytes which new operation may take, or None if they can't be found"
+
+        available = available_memory()
+        if available is not None:
+            available = int(available * self.share)
+        if self.limit is None:
+            return available
+
+        free = self.limit - (resident_memory() or 0)
+        return free if available is None else min(free, available)
+
+    def fits(self, nbytes, release=True):
+        "Checks if nbytes fit budget, caches are dropped if they don't fit and release is True"
+
+        free = self.free()
+        if free is None or nbytes <= free:
+            return True
+        if not release:
+            return False
+
+        self.release()
+        free = self.free()
+        return free is None or nbytes <= free
+
+    def plan(self, size, mode, filter, brightness=100, contrast=100, band_height=512, release=True, mapped=False):
+        """Returns "whole" if image of size and mode can be processed as a whole, height of bands if it can be
+        processed only band by band, or None if even new image with bands of one row doesn't fit budget. Bands are
+        band_height rows high at most, they're lowered until they fit the rest of budget. Mapped new image is written
+        to file, so it isn't counted and image is always processed by bands. Caches are dropped only if bands don't
+        fit and release is True, so checks which don't start work pass False"""
+
+        new, temporary = footprint(mode, filter, brightness, contrast)
+        pixels = size[0] * size[1]
+        whole = pixels * (new + temporary)
+
+        if not mapped and self.fits(whole, release=False):
+            return "whole"
+
+        # palette filters change only palette, image keeps its mode only if it's processed as a whole
+        if not mapped and keeps_palette(mode, filter):
+            return "whole" if self.fits(whole, release) else None
+
+        # bands of palette image are converted, each band is read with halo rows
+        channels = 4 if mode == "P" else len(mode)
+        image = 0 if mapped else pixels * new
+        row = size[0] * (new + temporary + 2 * channels)
+        halo = 2 * band_halo(filter)
+        if not self.fits(image + (1 + halo) * row, release):
+            return None
+
+        # rows which the rest of budget takes, it's the same as lowering bands until they fit
+        rows = min(band_height, size[1])
+        free = self.free()
+        if free is not None:
+            rows = min(rows, (free - image) // row - halo)
+        return max(1, rows)
+
+
+memory_budget = MemoryBudget()
+color_table = ColorTable()
+
+
+def parse_color(value):
+    "Converts hex color like 'ff80ff' or '#ff80ff' into tuple ((r, g, b), '#rrggbb') which filters take"
+
+    value = value.lstrip("#").lower()
+    if not re.fullmatch(r"[0-9a-f]{6}", value):
+        raise ValueError(f"wrong color: {value}")
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4)), "#" + value
+
+
+def load_image(image, size=None):
+    "Decodes opened image, converts it to working color mode and fits it into size x size thumbnail if size is given"
+
+    # jpeg decoder can scale image down while decoding, it's much faster than resizing it later
+    with metrics.stage("decode"):
+        if size:
+            image.draft("RGB", (size, size))
+        image.load()
+
+    with metrics.stage("resize"):
+        image = working_mode(image)
+        if size:
+            image.thumbnail((size, size))
+    return image
+
+
+def render_image(image, filter="None", tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2,
+                 brightness=100, contrast=100, size=None, lut=None):
+    "Fits opened image into size x size thumbnail if size is given, applies filter, brightness, and contrast"
+
+    return render_full(load_image(image, size), filter, tint_color, color1, color2, brightness, contrast, lut)
+
+
+def render_bytes(data, filter="None", tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2,
+                 brightness=100, contrast=100, size=None, format="PNG"):
+    """Opens encoded image, fits it into size x size thumbnail if size is given, applies filter, brightness, and
+    contrast and returns image encoded in format"""
+
+    new_image = render_image(Image.open(io.BytesIO(data)), filter, tint_color, color1, color2,
+                             brightness, contrast, size)
+    return encode_image(new_image, format)
+
+
+def encode_image(new_image, format="PNG"):
+    "Returns rendered image encoded in format, its mode is converted if format can't save it"
+
+    buffer = io.BytesIO()
+    extension = {"JPEG": ".jpg", "WEBP": ".webp", "GIF": ".gif"}.get(format, ".png")
+    with metrics.stage("encode"):
+        convert_for_saving(new_image, "out" + extension).save(buffer, format)
+    metrics.count_image(new_image)
+    return buffer.getvalue()
+
+
+class LRUCache:
+    "Least recently used items limited by their total size in bytes, it isn't thread-safe, so one thread uses it"
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = OrderedDict()
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        self.items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, value, size=None):
+        "Puts value with its size in bytes, size of bytes objects is their length"
+
+        size = len(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        if key in self.items:
+            self.size -= self.items.pop(key)[1]
+        self.items[key] = (value, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            self.size -= self.items.popitem(last=False)[1][1]
+
+    def pop(self, key):
+        "Removes item and returns its value, or None if there's no such item"
+
+        item = self.items.pop(key, None)
+        if item is None:
+            return None
+        self.size -= item[1]
+        return item[0]
+
+    def clear(self):
+        self.items.clear()
+        self.size = 0
+
+
+class RenderService:
+    """Local HTTP service rendering images by DualTone filters, e.g. for thumbnails of web store:
+
+        POST /render?filter=2-Colored+RGB+(Linear)&rgb1=000000&rgb2=00ffff&brightness=110&size=256&format=webp
+
+    Request body is encoded image. Results are kept in LRU cache and served by event loop without touching workers.
+    New requests wait in bounded queue, which is drained in batches by worker threads, if it's full, service answers
+    503, so latency of accepted requests doesn't grow with load. Images of batch with the same filter, colors and
+    size are filtered by one vectorized call. Identical requests being rendered are rendered once"""
+
+    formats = {"png": "PNG", "jpg": "JPEG", "jpeg": "JPEG", "webp": "WEBP", "gif": "GIF"}
+
+    # 3D LUT can't be loaded by service
+    filters = set(FILTERS) - {"3D LUT (.cube)"}
+
+    reasons = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+    def __init__(self, host="127.0.0.1", port=8000, workers=None, queue_size=256, batch_size=8,
+                 cache_bytes=256 << 20, max_body=32 << 20):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.max_body = max_body
+        self.cache = LRUCache(cache_bytes)
+
+        # futures of requests being rendered by their keys
+        self.rendering = {}
+        self.stats = {"requests": 0, "cache_hits": 0, "rendered": 0, "rejected": 0}
+
+    def run(self):
+        "Serves until process is interrupted"
+
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self):
+        self.queue = asyncio.Queue(self.queue_size)
+        executor = ThreadPoolExecutor(self.workers)
+
+        # every batcher keeps one worker thread busy
+        batchers = [asyncio.create_task(self.batcher(executor)) for _ in range(self.workers)]
+
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        # port 0 lets OS choose free port, e.g. in tests
+        self.port = server.sockets[0].getsockname()[1]
+        print(f"DualTone service is running on http://{self.host}:{self.port}/render", file=sys.stderr, flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for batcher in batchers:
+                batcher.cancel()
+            executor.shutdown(cancel_futures=True)
+
+    async def batcher(self, executor):
+        "Takes all waiting requests up to batch_size and renders them by one worker call"
+
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            try:
+                results = await loop.run_in_executor(executor, self.render_batch, [args for args, future in batch])
+            except Exception as error:
+                results = [RuntimeError(f"rendering failed: {error!r}")] * len(batch)
+            for (args, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    @staticmethod
+    def render_batch(batch):
+        """Renders batch of requests in worker thread, errors are returned instead of results. RGB and RGBA images
+        which have the same filter, colors, mode and size after decoding are stacked and filtered and enhanced by one
+        call of filter_batch and enhance_batch, the other ones are rendered one by one"""
+
+        results = [None] * len(batch)
+        groups = {}
+
+        def failed(error):
+            if isinstance(error, (OSError, ValueError, SyntaxError, Image.DecompressionBombError)):
+                return ValueError(f"can't render image: {error}")
+            # image which doesn't fit memory budget now may be rendered later, when other requests are done
+            if isinstance(error, MemoryError):
+                return error
+            # any other error fails only its own request, batcher must resolve futures of the whole batch
+            return RuntimeError(f"rendering failed: {error!r}")
+
+        for i, (data, filter, tint_color, color1, color2, brightness, contrast, size, format) in enumerate(batch):
+            try:
+                image = load_image(Image.open(io.BytesIO(data)), size)
+                if (filter in BATCH_FILTERS and image.mode in ("RGB", "RGBA") and
+                        memory_budget.plan(image.size, image.mode, filter, brightness, contrast, release=False) ==
+                        "whole"):
+                    groups.setdefault((filter, tint_color, color1, color2, image.mode, image.size), []).append(
+                        (i, image))
+                else:
+                    new_image = render_full(image, filter, tint_color, color1, color2, brightness, contrast)
+                    results[i] = encode_image(new_image, format)
+            except Exception as error:
+                results[i] = failed(error)
+
+        for (filter, tint_color, color1, color2, mode, size), items in groups.items():
+            try:
+                images = np.stack([np.asarray(image) for i, image in items])
+                with metrics.stage("filter"):
+                    new_images = filter_batch(images, filter, tint_color, color1, color2)
+                levels = [batch[i][5:7] for i, image in items]
+                if any(levels != (100, 100) for levels in levels):
+                    with metrics.stage("enhance"):
+                        new_images = enhance_batch(new_images, *zip(*levels))
+            except Exception as error:
+                for i, image in items:
+                    results[i] = failed(error)
+                continue
+
+            for (i, image), new_array in zip(items, new_images):
+                try:
+                    results[i] = encode_image(Image.fromarray(new_array, mode), batch[i][-1])
+                except Exception as error:
+                    results[i] = failed(error)
+        return results
+
+    async def render(self, key, args):
+        "Returns rendered image from cache or renders it, raises OverflowError if queue is full"
+
+        result = self.cache.get(key)
+        if result is not None:
+            self.stats["cache_hits"] += 1
+            metrics.count("cache_hits")
+            return result
+        metrics.count("cache_misses")
+
+        future = self.rendering.get(key)
+        if future is None:
+            if self.queue.full():
+                self.stats["rejected"] += 1
+                metrics.count("rejected")
+                raise OverflowError("too many requests")
+
+            future = asyncio.get_running_loop().create_future()
+            future.add_done_callback(lambda future: self.rendered(key, future))
+            self.rendering[key] = future
+            self.queue.put_nowait((args, future))
+
+        # result is cached even if client which asked first disconnects
+        return await asyncio.shield(future)
+
+    def rendered(self, key, future):
+        "Puts rendered image into cache"
+
+        del self.rendering[key]
+        if not future.cancelled() and future.exception() is None:
+            self.stats["rendered"] += 1
+            self.cache.put(key, future.result())
+
+    def parse_args(self, query, data):
+        "Converts query parameters into arguments of render_bytes and cache key"
+
+        params = dict(urllib.parse.parse_qsl(query))
+        filter = params.get("filter", "None")
+        if filter not in self.filters:
+            raise ValueError(f"unknown filter: {filter}")
+
+        format = self.formats.get(params.get("format", "png").lower())
+        if format is None:
+            raise ValueError("format must be png, jpg, webp, or gif")
+
+        brightness = int(params.get("brightness", 100))
+        contrast = int(params.get("contrast", 100))
+        size = int(params.get("size", 0)) or None
+        if not 0 <= brightness <= 999 or not -999 <= contrast <= 999 or size is not None and not 0 < size <= 8192:
+            raise ValueError("brightness, contrast, or size is out of range")
+
+        args = (data, filter,
+                parse_color(params.get("tint", DEFAULT_TINT_COLOR[1])),
+                parse_color(params.get("rgb1", DEFAULT_RGB1[1])),
+                parse_color(params.get("rgb2", DEFAULT_RGB2[1])),
+                brightness, contrast, size, format)
+
+        key = hashlib.blake2b(data, digest_size=16)
+        key.update(repr(args[1:]).encode())
+        return args, key.hexdigest()
+
+    async def handle(self, reader, writer):
+        "Serves requests of one keep-alive connection"
+
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                method, target, version = request_line.split(" ", 2)
+                headers = {}
+                for line in header_lines:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                length = int(headers.get("content-length", 0))
+                if length > self.max_body:
+                    await self.respond(writer, 413, b"image is too large\n", keep_alive=False)
+                    break
+                data = await reader.readexactly(length)
+
+                status, body, extra = await self.dispatch(method, target, headers, data)
+                await self.respond(writer, status, body, keep_alive, extra)
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.LimitOverrunError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, headers, data):
+        "Returns status, body, and extra headers of response"
+
+        path, _, query = target.partition("?")
+        if path == "/metrics" and method == "GET":
+            return 200, metrics.prometheus().encode(), {"Content-Type": "text/plain; version=0.0.4"}
+
+        if path == "/stats" and method == "GET":
+            stats = dict(self.stats, queued=self.queue.qsize(), cached=len(self.cache.items),
+                         cache_bytes=self.cache.size)
+            return 200, json.dumps(stats).encode() + b"\n", {"Content-Type": "application/json"}
+
+        if path != "/render":
+            return 404, b"not found\n", {}
+        if method != "POST":
+            return 405, b"use POST with image in body\n", {"Allow": "POST"}
+
+        self.stats["requests"] += 1
+        try:
+            # request body is hashed by thread, so large images don't block event loop
+            args, key = await asyncio.get_running_loop().run_in_executor(None, self.parse_args, query, data)
+            etag = f'"{key}"'
+            if headers.get("if-none-match") == etag:
+                return 304, b"", {"ETag": etag}
+            result = await self.render(key, args)
+        except OverflowError:
+            return 503, b"service is busy\n", {"Retry-After": "1"}
+        except MemoryError:
+            return 503, b"image doesn't fit free memory now\n", {"Retry-After": "1"}
+        except ValueError as error:
+            return 400, f"{error}\n".encode(), {}
+        except RuntimeError as error:
+            return 500, f"{error}\n".encode(), {}
+
+        return 200, result, {"Content-Type": Image.MIME[args[-1]], "ETag": etag}
+
+    async def respond(self, writer, status, body, keep_alive=True, extra=None):
+        lines = [f"HTTP/1.1 {status} {self.reasons[status]}",
+                 f"Content-Length: {len(body)}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines += [f"{name}: {value}" for name, value in (extra or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+
+class ImageStatistics:
+    """Gray levels of image gathered once: their histogram, mean, low and high percentiles, and mean colors of the
+    darkest and the brightest pixels. Brightness, contrast, and colors for 2-colored filters are suggested by them
+    without reading pixels again"""
+
+    def __init__(self, image, clip=0.5):
+        "Clip is percentage of the darkest and the brightest pixels which may be clipped to black and white"
+
+        if image.mode == "P":
+            image = image.convert("RGBA" if has_transparency(image) else "RGB")
+        gray = image.convert("L")
+        self.histogram = np.array(gray.histogram())
+
+        total = self.histogram.sum()
+        cumulative = np.cumsum(self.histogram)
+        self.mean = float(np.dot(self.histogram, np.arange(256)) / total)
+        self.low = int(np.searchsorted(cumulative, total * clip / 100))
+        self.high = int(np.searchsorted(cumulative, total * (1 - clip / 100)))
+
+        # colors of shadows and highlights
+        levels = np.asarray(gray).ravel()
+        colors = np.asarray(image.convert("RGB")).reshape(-1, 3)
+        self.shadows = tuple(int(v + 0.5) for v in colors[levels <= self.low].mean(axis=0))
+        self.highlights = tuple(int(v + 0.5) for v in colors[levels >= self.high].mean(axis=0))
+
+    def levels(self):
+        """Returns brightness and contrast in percents which stretch levels from low to high percentile to 0...255.
+        Brightness multiplies levels, and contrast stretches them around their mean gray level"""
+
+        if self.high <= self.low or self.mean <= self.low:
+            return 100, 100
+
+        brightness = 255 * (self.mean - self.low) / ((self.high - self.low) * self.mean)
+        contrast = 255 / ((self.high - self.low) * brightness)
+        return min(max(round(brightness * 100), 0), 280), min(max(round(contrast * 100), -300), 300)
+
+    def endpoints(self):
+        "Returns colors of shadows and highlights as colors for 2-colored filters"
+
+        return tuple((color, "#%02x%02x%02x" % color) for color in (self.shadows, self.highlights))
+
+
+class Recipe:
+    """Filter, its colors, brightness, contrast, path to 3D LUT, and size of thumbnails saved as small JSON file,
+    so that the same edit can be repeated on other images or at other resolution"""
+
+    def __init__(self, filter="None", tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2,
+                 brightness=100, contrast=100, lut=None, size=None, auto_levels=False, auto_colors=False):
+        self.filter = filter
+        self.tint_color = tint_color
+        self.color1 = color1
+        self.color2 = color2
+        self.brightness = brightness
+        self.contrast = contrast
+        self.lut = lut
+        self.size = size
+
+        # brightness and contrast, or colors of 2-colored filters are suggested by ImageStatistics for each image
+        self.auto_levels = auto_levels
+        self.auto_colors = auto_colors
+
+    def to_dict(self):
+        return {"filter": self.filter,
+                "tint": self.tint_color[1],
+                "rgb1": self.color1[1],
+                "rgb2": self.color2[1],
+                "brightness": self.brightness,
+                "contrast": self.contrast,
+                "lut": self.lut,
+                "size": self.size,
+                "auto_levels": self.auto_levels,
+                "auto_colors": self.auto_colors}
+
+    def hash(self):
+        "Returns hash of all parameters, contents of 3D LUT file are hashed instead of its path"
+
+        params = self.to_dict()
+        if self.lut is not None:
+            with open(self.lut, "rb") as file:
+                params["lut"] = hashlib.sha256(file.read()).hexdigest()
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+    def save(self, filename):
+        "Writes recipe to JSON file, path of 3D LUT is written relative to it, so they can be moved together"
+
+        params = self.to_dict()
+        if self.lut is not None:
+            try:
+                params["lut"] = os.path.relpath(os.path.abspath(self.lut), os.path.dirname(os.path.abspath(filename)))
+            except ValueError:
+                # LUT is on another drive on Windows
+                params["lut"] = os.path.abspath(self.lut)
+
+        with open(filename, "w") as file:
+            json.dump(params, file, indent=4)
+
+    @staticmethod
+    def load(filename):
+        "Reads recipe from JSON file, raises ValueError if it's wrong, path of 3D LUT is relative to recipe file"
+
+        with open(filename) as file:
+            params = json.load(file)
+
+        try:
+            lut = params.get("lut")
+            if lut is not None:
+                lut = os.path.join(os.path.dirname(os.path.abspath(filename)), lut)
+            recipe = Recipe(str(params.get("filter", "None")),
+                            parse_color(params.get("tint", DEFAULT_TINT_COLOR[1])),
+                            parse_color(params.get("rgb1", DEFAULT_RGB1[1])),
+                            parse_color(params.get("rgb2", DEFAULT_RGB2[1])),
+                            int(params.get("brightness", 100)),
+                            int(params.get("contrast", 100)),
+                            lut,
+                            int(params["size"]) if params.get("size") else None,
+                            bool(params.get("auto_levels", False)),
+                            bool(params.get("auto_colors", False)))
+        except (AttributeError, TypeError) as error:
+            raise ValueError(f"wrong recipe: {error}")
+
+        if recipe.filter not in FILTERS:
+            raise ValueError(f"wrong filter: {recipe.filter}")
+        if recipe.filter == "3D LUT (.cube)" and lut is None:
+            raise ValueError("wrong recipe: 3D LUT filter needs path of .cube file")
+        return recipe
+
+    def render(self, image, lut=None):
+        """Applies recipe to PIL image, lut is loaded CubeLUT of recipe. Image is decoded and fitted to size once,
+        automatic colors and levels are suggested by statistics of the same pixels which are filtered"""
+
+        image = load_image(image, self.size)
+        color1, color2 = self.color1, self.color2
+        if self.auto_colors:
+            color1, color2 = ImageStatistics(image).endpoints()
+
+        if not self.auto_levels:
+            return render_full(image, self.filter, self.tint_color, color1, color2, self.brightness, self.contrast,
+                               lut)
+
+        filtered = render_full(image, self.filter, self.tint_color, color1, color2, lut=lut)
+        return enhance_image(filtered, *ImageStatistics(filtered).levels())
+
+
+def run_recipe(recipe, filenames, output_folder, extension=None, workers=None, source_folder=None):
+    """Renders files by recipe into output folder with the same names, extension can be changed. Files whose
+    source and recipe haven't changed since the last run are skipped by hashes kept in manifest file of output folder,
+    they're keyed by path of source file relative to source folder, or by absolute path if it isn't given.
+    Returns numbers of rendered and skipped files and list of (file, error) of files which can't be rendered"""
+
+    manifest_name = os.path.join(output_folder, "dualtone_manifest.json")
+    try:
+        with open(manifest_name) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        manifest = {}
+
+    recipe_hash = recipe.hash()
+    lut = CubeLUT.load(recipe.lut) if recipe.lut is not None else None
+    os.makedirs(output_folder, exist_ok=True)
+
+    def render(filename):
+        root, source_extension = os.path.splitext(os.path.basename(filename))
+        name = root + (extension or source_extension)
+        target = os.path.join(output_folder, name)
+        # sources differing only by extension have different keys even if they're rendered to the same name
+        key = os.path.relpath(filename, source_folder) if source_folder else os.path.abspath(filename)
+
+        try:
+            with open(filename, "rb") as file:
+                data = file.read()
+        except OSError as error:
+            return key, None, error
+        hashes = {"source": hashlib.sha256(data).hexdigest()[:16], "recipe": recipe_hash}
+        if manifest.get(key) == hashes and os.path.exists(target):
+            return key, hashes, False
+
+        # damaged, half-copied, or too large file doesn't stop other files or watching, it isn't written to
+        # manifest to be tried again
+        try:
+            image = recipe.render(Image.open(io.BytesIO(data)), lut)
+
+            # new file replaces old one only when it's completely written
+            new_image = convert_for_saving(image, target)
+            with metrics.stage("encode"):
+                new_image.save(target + ".part", Image.registered_extensions()[os.path.splitext(target)[1].lower()])
+            os.replace(target + ".part", target)
+        except Exception as error:
+            with contextlib.suppress(OSError):
+                os.remove(target + ".part")
+            return key, None, error
+
+        metrics.count_image(new_image)
+        return key, hashes, True
+
+    rendered = skipped = 0
+    failed = []
+    try:
+        for key, hashes, is_rendered in map_frames(render, filenames, workers):
+            if hashes is None:
+                failed.append((key, is_rendered))
+                continue
+            manifest[key] = hashes
+            rendered += is_rendered
+            skipped += not is_rendered
+    finally:
+        with open(manifest_name + ".part", "w") as file:
+            json.dump(manifest, file, indent=1)
+        os.replace(manifest_name + ".part", manifest_name)
+
+    return rendered, skipped, failed
+
+
+# inotify events: file is written and closed, moved into folder, created, or changed
+IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE = 0x2, 0x8, 0x80, 0x100
+
+
+def inotify_watch(folder):
+    "Returns nonblocking file descriptor of Linux inotify watching files of folder, or None if it can't be used"
+
+    if not sys.platform.startswith("linux"):
+        return None
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+
+    if libc.inotify_add_watch(fd, os.fsencode(folder), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def inotify_events(fd):
+    "Reads all waiting events of inotify as (mask, file name) list"
+
+    data = b""
+    while True:
+        try:
+            chunk = os.read(fd, 65536)
+        except BlockingIOError:
+            break
+        if not chunk:
+            break
+        data += chunk
+
+    events = []
+    offset = 0
+    # struct inotify_event: watch descriptor, mask, cookie, length of name padded with zeros, name
+    while offset + 16 <= len(data):
+        wd, mask, cookie, length = struct.unpack_from("iIII", data, offset)
+        name = data[offset + 16:offset + 16 + length].rstrip(b"\0")
+        events.append((mask, os.fsdecode(name)))
+        offset += 16 + length
+    return events
+
+
+class WatchFolder:
+    """Renders images dropped into folder by recipe as soon as they're completely written. On Linux inotify wakes
+    watcher at once, and files closed after writing or moved into folder are ready at once. Folder is also polled,
+    inotify doesn't work on other systems and doesn't see files written to network share by other computers, such
+    file is ready when its size and time of modification haven't changed for settle seconds. Manifest of run_recipe
+    is the journal, so files rendered before restart are skipped and files dropped while nothing was watching are
+    rendered"""
+
+    def __init__(self, recipe, folder, output_folder, extension=None, workers=None, interval=0.2, settle=0.4,
+                 idle=1.0, use_inotify=True):
+        if os.path.abspath(folder) == os.path.abspath(output_folder):
+            raise ValueError("output folder must differ from watched folder")
+
+        self.recipe = recipe
+        self.folder = folder
+        self.output_folder = output_folder
+        self.extension = extension
+        self.workers = workers
+        self.interval = interval
+        self.settle = settle
+        # folder is polled this often when inotify is used and no file is being written
+        self.idle = idle
+        self.use_inotify = use_inotify
+        self.stopped = False
+        # paths of files which inotify saw closed after writing or moved into folder
+        self.closed = set()
+        # path -> (size, mtime) of files which are rendered or can't be rendered until they change
+        self.done = {}
+        # path -> (size, mtime), time when it was seen first
+        self.changes = {}
+
+    def scan(self):
+        "Returns files which haven't changed for settle seconds since they were created or changed"
+
+        now = time.monotonic()
+        extensions = Image.registered_extensions()
+        ready = []
+        present = set()
+
+        for entry in os.scandir(self.folder):
+            if not entry.is_file() or os.path.splitext(entry.name)[1].lower() not in extensions:
+                continue
+
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            state = (stat.st_size, stat.st_mtime_ns)
+            present.add(entry.path)
+            if self.done.get(entry.path) == state:
+                self.closed.discard(entry.path)
+                continue
+
+            if entry.path in self.closed:
+                self.closed.discard(entry.path)
+                self.changes[entry.path] = (state, now)
+                ready.append(entry.path)
+            elif entry.path not in self.changes or self.changes[entry.path][0] != state:
+                self.changes[entry.path] = (state, now)
+            elif now - self.changes[entry.path][1] >= self.settle:
+                ready.append(entry.path)
+
+        # forgets deleted files
+        for path in set(self.done).union(self.changes, self.closed) - present:
+            self.done.pop(path, None)
+            self.changes.pop(path, None)
+            self.closed.discard(path)
+
+        return sorted(ready)
+
+    def render(self, filenames):
+        "Renders ready files and returns numbers of rendered and skipped files and files which can't be read"
+
+        result = run_recipe(self.recipe, filenames, self.output_folder, self.extension, self.workers, self.folder)
+        for filename in filenames:
+            self.done[filename] = self.changes.pop(filename)[0]
+        return result
+
+    def wait(self, fd):
+        "Waits for inotify events or for next poll of folder"
+
+        if fd is None:
+            time.sleep(self.interval)
+            return
+
+        select.select([fd], [], [], self.interval if self.changes else self.idle)
+        for mask, name in inotify_events(fd):
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and name:
+                self.closed.add(os.path.join(self.folder, name))
+
+    def run(self, log=print):
+        "Watches folder until stop method is called"
+
+        fd = inotify_watch(self.folder) if self.use_inotify else None
+        try:
+            while not self.stopped:
+                ready = self.scan()
+                if ready:
+                    rendered, skipped, failed = self.render(ready)
+                    log(f"{rendered} files rendered, {skipped} files skipped")
+                    for filename, error in failed:
+                        log(f"Can't render {filename} ({error}), it will be tried again when it changes")
+                self.wait(fd)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def stop(self):
+        self.stopped = True
+
+
+def fit_image(image, size, box=None):
+    """Resizes box of image (the whole image by default) so that it fits size, small images aren't enlarged.
+    Palette images are converted, LANCZOS doesn't work with palette"""
+
+    if image.mode == "P":
+        image = image.convert("RGBA" if has_transparency(image) else "RGB")
+
+    box = box or (0, 0, image.width, image.height)
+    box_w, box_h = box[2] - box[0], box[3] - box[1]
+    if box_w <= size[0] and box_h <= size[1]:
+        return image.crop(box) if box != (0, 0, image.width, image.height) else image
+
+    ratio = min(size[0] / box_w, size[1] / box_h)
+    return image.resize((max(1, int(box_w * ratio)), max(1, int(box_h * ratio))), Resampling.LANCZOS, box=box)
+
+
+# files exported by "Export Derivatives": suffix of file name, the longest side (None for full size), extension
+DERIVATIVES = (("", None, ".png"),
+               ("_2048", 2048, ".jpg"),
+               ("_thumb", 512, ".webp"),
+               ("_icon", 256, ".ico"))
+
+
+def export_derivatives(image, derivatives, workers=None):
+    """Saves one filtered image in several sizes and formats, derivatives are (filename, size) pairs where size is the
+    longest side or None for full size. Image is halved again and again once, and every size is resized from the
+    smallest half which is at least twice larger than it. Files are encoded in parallel, each of them appears only
+    when it's completely written. Returns filenames which can't be saved"""
+
+    if image.mode == "P":
+        image = image.convert("RGBA" if has_transparency(image) else "RGB")
+
+    # pyramid of halved copies is made down to the smallest requested size
+    sizes = [size for filename, size in derivatives if size]
+    pyramid = [image]
+    while sizes and max(pyramid[-1].size) >= 4 * min(sizes):
+        pyramid.append(pyramid[-1].reduce(2))
+
+    def save(derivative):
+        filename, size = derivative
+        new_image = image
+        if size:
+            source = min((level for level in pyramid if max(level.size) >= 2 * size), key=lambda level: level.width,
+                         default=image)
+            new_image = fit_image(source, (size, size))
+
+        # icons are square, image is centered on transparent square so that icon has its full size
+        if filename.lower().endswith(".ico") and new_image.width != new_image.height:
+            square = Image.new("RGBA", (max(new_image.size),) * 2)
+            square.paste(new_image.convert("RGBA"), ((square.width - new_image.width) // 2,
+                                                     (square.height - new_image.height) // 2))
+            new_image = square
+
+        try:
+            with metrics.stage("encode"):
+                convert_for_saving(new_image, filename).save(
+                    filename + ".part", Image.registered_extensions()[os.path.splitext(filename)[1].lower()])
+            os.replace(filename + ".part", filename)
+        except (OSError, KeyError, ValueError):
+            return filename
+        metrics.count_image(new_image)
+
+    with ThreadPoolExecutor(workers or min(len(derivatives), os.cpu_count() or 1)) as executor:
+        return [filename for filename in executor.map(save, derivatives) if filename is not None]
+
+
+# color pairs which contact sheet shows with 2-colored filter besides current colors
+TWO_TONE_PAIRS = ((((0, 0, 0), '#000000'), ((255, 255, 255), '#ffffff')),
+                  (((0, 0, 128), '#000080'), ((255, 160, 0), '#ffa000')),
+                  (((64, 0, 64), '#400040'), ((255, 200, 120), '#ffc878')),
+                  (((0, 64, 0), '#004000'), ((220, 255, 160), '#dcffa0')),
+                  (((128, 0, 0), '#800000'), ((255, 255, 200), '#ffffc8')),
+                  (((0, 0, 0), '#000000'), ((255, 0, 255), '#ff00ff')))
+
+
+def contact_sheet(image, recipes, size=160, lut=None):
+    """Renders size x size thumbnails of image for list of recipes, the image is downscaled once for all of them.
+    Color filters of BATCH_FILTERS get all their colors by one filter_variants call, and brightness and contrast of
+    all thumbnails are changed by one enhance_batch call"""
+
+    thumbnail = fit_image(working_mode(image), (size, size))
+    mode = "RGBA" if thumbnail.mode == "RGBA" else "RGB"
+    thumbnail = thumbnail.convert(mode)
+
+    # thumbnails with filters, recipes which differ only by brightness and contrast share them
+    keys = list(dict.fromkeys((recipe.filter, recipe.tint_color, recipe.color1, recipe.color2) for recipe in recipes))
+    filtered = {}
+    for filter in dict.fromkeys(key[0] for key in keys):
+        variants = [key for key in keys if key[0] == filter]
+        if filter in BATCH_FILTERS:
+            filtered.update(zip(variants, filter_variants(np.asarray(thumbnail), filter,
+                                                          [key[1:] for key in variants])))
+        else:
+            for key in variants:
+                filtered[key] = np.asarray(filter_image(thumbnail, *key, lut=lut).convert(mode))
+
+    stack = np.stack([filtered[recipe.filter, recipe.tint_color, recipe.color1, recipe.color2] for recipe in recipes])
+    stack = enhance_batch(stack, [recipe.brightness for recipe in recipes], [recipe.contrast for recipe in recipes])
+    return [Image.fromarray(new_array) for new_array in stack]
+
+
+class PreviewPipeline:
+    """Stages of displayed image: fitting to window, filter, brightness and contrast. Every stage keeps its result
+    with parameters it was made with, so when a parameter changes only its stage and the next ones are recomputed.
+    Color filters work pixel by pixel, so they are applied only to visible pixels of fitted image, other filters
+    and STEP_FILTERS are applied to the whole image once.
+    Preview worker, tile workers and Tk thread share stages, so results are read and written under lock and stages
+    are computed outside it. Tk thread asks only for cached stages, they're None until a worker makes them"""
+
+    def __init__(self, image):
+        self.image = image
+        # stage name -> (parameters of stage and previous stages, result)
+        self.results = {}
+        self.lock = Lock()
+        # the whole image is filtered once even if tiles ask for it from several threads
+        self.whole_lock = Lock()
+        memory_budget.register(self.release)
+
+    def release(self):
+        "Drops the whole image with filter, it's as large as image"
+
+        with self.lock:
+            self.results.pop("whole", None)
+
+    def nbytes(self):
+        "Returns bytes taken by image and images kept by stages"
+
+        with self.lock:
+            values = [value for key, value in self.results.values()]
+        images = [self.image] + [value for value in values if isinstance(value, Image.Image)]
+        return sum(image.width * image.height * len(image.getbands()) for image in images)
+
+    def result(self, name):
+        "Returns (parameters, result) of stage, or (None, None) if it isn't made yet"
+
+        with self.lock:
+            return self.results.get(name, (None, None))
+
+    def stage(self, name, key, function, cached=False):
+        """Returns result of stage if it was made with the same parameters, otherwise recomputes it, or returns None
+        if only cached result is asked for"""
+
+        result_key, value = self.result(name)
+        if value is not None and result_key == key:
+            return value
+        if cached:
+            return None
+
+        value = function()
+        with self.lock:
+            self.results[name] = (key, value)
+        return value
+
+    def fit(self, size, box=None, cached=False):
+        return self.stage("fit", (size, box), lambda: fit_image(self.image, size, box), cached)
+
+    def filtered(self, size, filter, tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2,
+                 lut=None, box=None, cached=False):
+        "Returns visible box of image fitted to size with filter, or None if it isn't made yet and cached is True"
+
+        params = (filter, tint_color, color1, color2, lut)
+        if cached:
+            return self.stage("filtered", (params, size, box), None, cached)
+
+        # other filters are applied to fitted image too when the whole image doesn't fit memory budget, edges of
+        # filters with kernels look sharper then. 3D LUT is a key itself, so it isn't freed while results are kept
+        if (filter in COLOR_FILTERS and filter not in STEP_FILTERS or filter == "None" or
+                not self.can_filter_whole(filter, tint_color, color1, color2, lut)):
+            return self.stage("filtered", (params, size, box),
+                              lambda: metrics.call("filter", filter_image, self.fit(size, box), filter, tint_color,
+                                                   color1, color2, lut=lut))
+
+        whole = self.whole(filter, tint_color, color1, color2, lut)
+        return self.stage("filtered", (params, size, box), lambda: fit_image(whole, size, box))
+
+    def whole(self, filter, tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2, lut=None):
+        "Returns the whole image with filter"
+
+        with self.whole_lock:
+            return self.stage("whole", (filter, tint_color, color1, color2, lut),
+                              lambda: render_full(self.image, filter, tint_color, color1, color2, lut=lut))
+
+    def can_filter_whole(self, filter, tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2,
+                         lut=None):
+        "Checks if the whole image with filter is made already or fits memory budget"
+
+        if self.result("whole")[0] == (filter, tint_color, color1, color2, lut):
+            return True
+        # it's asked for every tile and preview, so caches are dropped only when the whole image is filtered
+        return memory_budget.plan(self.image.size, self.image.mode, filter, release=False) is not None
+
+    def proxy(self, size, factor):
+        "Returns image fitted to size and made factor times smaller, it's reduced fast for coarse previews"
+
+        def reduce():
+            image = self.image
+            if image.mode == "P":
+                image = image.convert("RGBA" if has_transparency(image) else "RGB")
+            scale = min(1, size[0] / image.width, size[1] / image.height) / factor
+            new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            return image.resize(new_size, Resampling.BILINEAR, reducing_gap=2)
+
+        return self.stage(f"proxy {factor}", size, reduce)
+
+    def coarse(self, size, factor, filter, tint_color=DEFAULT_TINT_COLOR, color1=DEFAULT_RGB1, color2=DEFAULT_RGB2,
+               lut=None, brightness=100, contrast=100):
+        """Returns coarse preview factor times smaller than image fitted to size with filter, brightness and contrast.
+        It doesn't change stages of the full preview"""
+
+        new_image = filter_image(self.proxy(size, factor), filter, tint_color, color1, color2, lut=lut)
+        return enhance_image(new_image, brightness, contrast)
+
+    def statistics(self):
+        """Returns ImageStatistics of image without filter, they're gathered once from the whole image fitted to
+        window, so pixels aren't resampled again. Image is fitted to 512x512 only if it hasn't been fitted yet"""
+
+        def gather():
+            key, fitted = self.result("fit")
+            if fitted is not None and key[1] is None:
+                return ImageStatistics(fitted)
+            return ImageStatistics(fit_image(self.image, (512, 512)))
+
+        return self.stage("statistics", None, gather)
+
+    def filtered_statistics(self, cached=False):
+        """Returns ImageStatistics of filtered displayed image, filters which don't change colors reuse statistics
+        gathered when image was prepared. Returns None if image isn't filtered yet, or if statistics aren't gathered
+        yet and cached is True"""
+
+        key, filtered = self.result("filtered")
+        if filtered is None:
+            return None
+        if key[0][0] in ("None", "Mirror"):
+            return self.statistics()
+        return self.stage("filtered_statistics", key, lambda: ImageStatistics(filtered), cached)
+
+    # stages below are made from the latest filtered stage, they return None if it isn't made yet, or if their result
+    # isn't made yet and cached is True
+
+    def brightened(self, brightness, cached=False):
+        "Returns filtered image with brightness, contrast is changed after it, so it doesn't recompute brightness"
+
+        key, filtered = self.result("filtered")
+        if filtered is None:
+            return None
+        return self.stage("brightened", (key, brightness),
+                          lambda: metrics.call("enhance", enhance_image, filtered, brightness, 100), cached)
+
+    def mean(self, brightness, cached=False):
+        "Returns mean gray level of filtered image with brightness, contrast is changed relative to it"
+
+        brightened = self.brightened(brightness, cached)
+        if brightened is None:
+            return None
+        return self.stage("mean", (self.result("filtered")[0], brightness),
+                          lambda: int(ImageStat.Stat(brightened.convert("L")).mean[0] + 0.5), cached)
+
+    def enhanced(self, brightness, contrast, cached=False):
+        "Returns filtered image with brightness and contrast"
+
+        brightened = self.brightened(brightness, cached)
+        mean = self.mean(brightness, cached)
+        if brightened is None or mean is None:
+            return None
+        return self.stage("enhanced", ((self.result("filtered")[0], brightness), contrast),
+                          lambda: metrics.call("enhance", enhance_image, brightened, 100, contrast, mean), cached)
+
+    def histograms(self, brightness, contrast, cached=False):
+        """Returns histograms of R, G, and B channels (or of L channel) of filtered image with brightness and contrast.
+        Histogram of filtered image is counted once, brightness and contrast change every level of channel to another
+        one, so its bins are only moved to new levels"""
+
+        def count():
+            # pixels of palette image are counted by their palette colors
+            if filtered.mode == "P":
+                colors = np.asarray(get_palette_image(filtered))[0]
+                counts = filtered.histogram()[:len(colors)]
+                return np.array([np.bincount(colors[:, i], weights=counts, minlength=256) for i in range(3)])
+            return np.array(filtered.histogram(), dtype=np.float64).reshape(-1, 256)[:3]
+
+        key, filtered = self.result("filtered")
+        if filtered is None:
+            return None
+        histograms = self.stage("histograms", key, count, cached)
+        mean = self.mean(brightness, cached) if contrast != 100 else None
+        if histograms is None or contrast != 100 and mean is None:
+            return None
+
+        # new levels of 0...255 are found by the same function as pixels have
+        levels = Image.fromarray(np.arange(256, dtype=np.uint8)[np.newaxis])
+        new_levels = np.asarray(enhance_image(levels, brightness, contrast, mean))[0]
+        return np.array([np.bincount(new_levels, weights=histogram, minlength=256) for histogram in histograms])
+
+
+class TileRenderer:
+    """Renders square tiles of zoomed image by thread pool. Only tiles intersecting visible box are rendered, and
+    rendered tiles are kept in LRU cache, so panning and zooming back don't render them again"""
+
+    tile_size = 256
+
+    def __init__(self, pipeline, workers=None, cache_bytes=256 << 20):
+        self.pipeline = pipeline
+        self.executor = ThreadPoolExecutor(workers or os.cpu_count() or 1)
+        self.cache = LRUCache(cache_bytes)
+        # budget may drop tiles from worker thread while Tk thread reads them
+        self.cache_lock = Lock()
+
+        # futures of tiles being rendered, rendered tiles are passed from worker threads to Tk thread by deque
+        self.pending = {}
+        self.finished = deque()
+        # key -> error of tiles which can't be rendered, they aren't rendered again and placeholders are shown
+        self.failed = OrderedDict()
+        memory_budget.register(self.release)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def release(self):
+        "Drops rendered tiles at once, so budget sees memory freed by them"
+
+        with self.cache_lock:
+            self.cache.clear()
+
+    def visible(self, scale, box):
+        "Returns indexes of tiles of image zoomed by scale which intersect box of zoomed image"
+
+        t = self.tile_size
+        columns = -(-math.ceil(self.pipeline.image.width * scale) // t)
+        rows = -(-math.ceil(self.pipeline.image.height * scale) // t)
+        x0, y0 = max(0, int(box[0] // t)), max(0, int(box[1] // t))
+        x1, y1 = min(columns, -(-int(box[2]) // t)), min(rows, -(-int(box[3]) // t))
+        return [(x, y) for y in range(y0, y1) for x in range(x0, x1)]
+
+    def tiles(self, params, scale, box, fast=False):
+        """Returns rendered tiles intersecting box as {(x, y): (key, image)} and starts rendering of the others.
+        Params are filter, its colors, 3D LUT, brightness, contrast, and mean gray level of the whole image.
+        Fast tiles are resampled by BILINEAR instead of LANCZOS, they are shown until LANCZOS tiles are rendered"""
+
+        ready = {}
+        keys = set()
+        for index in self.visible(scale, box):
+            key = (params, scale, fast, index)
+            keys.add(key)
+            with self.cache_lock:
+                tile = self.cache.get(key)
+            if tile is not None:
+                ready[index] = (key, tile)
+                continue
+
+            if key in self.failed:
+                ready[index] = (key, Image.new("RGB", self.tile_box(scale, *index)[0], "#808080"))
+                continue
+
+            if key not in self.pending:
+                self.pending[key] = self.executor.submit(self.render, key)
+            draft_key = (params, scale, True, index)
+            with self.cache_lock:
+                draft = self.cache.get(draft_key)
+            if draft is not None:
+                ready[index] = (draft_key, draft)
+
+        # tiles which aren't visible anymore aren't rendered if workers haven't started them yet
+        for key in [key for key in self.pending if key not in keys]:
+            if self.pending[key].cancel():
+                del self.pending[key]
+
+        return ready
+
+    def collect(self):
+        """Moves tiles rendered by workers into cache, returns True if there are new tiles or new failed tiles.
+        Errors of failed tiles are printed once"""
+
+        new_tiles = False
+        while self.finished:
+            key, tile = self.finished.popleft()
+            self.pending.pop(key, None)
+            if isinstance(tile, Exception):
+                self.failed[key] = tile
+                if len(self.failed) > 4096:
+                    self.failed.popitem(last=False)
+                metrics.count("tile_errors")
+                print(f"Can't render tile {key[3]} at zoom {key[1]:.3g}: {tile!r}", file=sys.stderr)
+                new_tiles = True
+            elif tile is not None:
+                with self.cache_lock:
+                    self.cache.put(key, tile, tile.width * tile.height * len(tile.getbands()))
+                new_tiles = True
+        return new_tiles
+
+    def tile_box(self, scale, x, y):
+        "Returns size of tile and its box in source image"
+
+        image = self.pipeline.image
+        t = self.tile_size
+        x1 = min((x + 1) * t, math.ceil(image.width * scale))
+        y1 = min((y + 1) * t, math.ceil(image.height * scale))
+        return (x1 - x * t, y1 - y * t), (x * t / scale, y * t / scale,
+                                          min(x1 / scale, image.width), min(y1 / scale, image.height))
+
+    def render(self, key):
+        params, scale, fast, (x, y) = key
+        filter, tint_color, color1, color2, lut, brightness, contrast, mean = params
+        image = self.pipeline.image
+        tile = None
+
+        try:
+            # size of tile in zoomed image and its box in source image
+            size, box = self.tile_box(scale, x, y)
+
+            # color filters are applied to tile pixels only, other filters and STEP_FILTERS to the whole image once
+            # if it fits memory budget
+            whole = ((filter not in COLOR_FILTERS or filter in STEP_FILTERS) and
+                     self.pipeline.can_filter_whole(filter, tint_color, color1, color2, lut))
+            if whole:
+                image = self.pipeline.whole(filter, tint_color, color1, color2, lut)
+
+            # palette is converted for part of image around tile, resampling doesn't work with palette
+            if image.mode == "P":
+                margin = math.ceil(3 / scale) + 1
+                left, top = max(0, int(box[0]) - margin), max(0, int(box[1]) - margin)
+                part = image.crop((left, top, min(image.width, math.ceil(box[2]) + margin),
+                                   min(image.height, math.ceil(box[3]) + margin)))
+                image = part.convert("RGBA" if has_transparency(part) else "RGB")
+                box = (box[0] - left, box[1] - top, box[2] - left, box[3] - top)
+
+            # pixels are shown as squares when image is zoomed in
+            if scale >= 1:
+                tile = image.resize(size, Resampling.NEAREST, box=box)
+            elif fast:
+                tile = image.resize(size, Resampling.BILINEAR, box=box, reducing_gap=2)
+            else:
+                tile = image.resize(size, Resampling.LANCZOS, box=box)
+
+            if not whole:
+                tile = filter_image(tile, filter, tint_color, color1, color2, lut=lut)
+            tile = enhance_image(tile, brightness, contrast, mean)
+
+        # error is passed to Tk thread instead of tile, so the tile isn't rendered again and again
+        except Exception as error:
+            tile = error
+        finally:
+            self.finished.append((key, tile))
+
+
+def prepare_image(image, size=None):
+    """Prepares opened image like window shows it: loads it, converts it to working color mode, checks transparency,
+    fits it to size, and makes its small copies for coarse previews. Returns original color mode, image, True if it's
+    transparent, and its PreviewPipeline. It doesn't touch widgets, so worker threads can prepare images"""
+
+    mode = image.mode
+    with metrics.stage("decode"):
+        image.load()
+
+    with metrics.stage("resize"):
+        image = working_mode(image)
+        transparent = has_transparency(image)
+        if not transparent and image.mode == "RGBA":
+            image = image.convert("RGB")
+
+        # reserve copy of animated image keeps its first frame, while file is read again for other frames
+        pipeline = PreviewPipeline(image.copy() if getattr(image, "n_frames", 1) > 1 else image)
+        if size:
+            pipeline.fit(size)
+            for factor in (8, 2):
+                pipeline.proxy(size, factor)
+        pipeline.statistics()
+    return mode, image, transparent, pipeline
+
+
+def open_for_preview(filename, size):
+    """Opens image and prepares it by prepare_image. Returns None for animated images, they are opened with their
+    frames, and for images which don't fit memory budget with their converted copy"""
+
+    image = Image.open(filename)
+    if getattr(image, "n_frames", 1) > 1:
+        return None
+    if not memory_budget.fits(2 * image.width * image.height * len(image.getbands()), release=False):
+        return None
+    return prepare_image(image, size)
+
+
+def open_reduced(filename, nbytes):
+    """Opens image made smaller by power of two so that it and its converted copy take no more than nbytes, jpeg
+    decoder scales it down while decoding, uncompressed files are mapped to memory and reduced band by band.
+    Returns image and the factor, or None if file can't be decoded reduced"""
+
+    image = Image.open(filename)
+    pixel_bytes = 2 * len(image.getbands())
+    factor = 1
+    while image.width * image.height * pixel_bytes > nbytes * factor * factor:
+        factor *= 2
+
+    if image.format == "JPEG" and factor <= 8:
+        image.draft(image.mode, (-(-image.width // factor), -(-image.height // factor)))
+        image.load()
+        return image, factor
+
+    try:
+        raw_image = RawImage(filename).open()
+    except (ValueError, OSError):
+        return None
+    try:
+        return reduce_raw(raw_image, factor), factor
+    finally:
+        raw_image.close()
+
+
+def prepare_within_budget(filename, image, size):
+    """Prepares opened image by prepare_image if it fits memory budget, caches are dropped if it's needed. Otherwise
+    image is reduced by open_reduced for preview instead of swapping. Returns result of prepare_image and reduction
+    factor, or None if image can't fit memory"""
+
+    if memory_budget.fits(2 * image.width * image.height * len(image.getbands())):
+        return prepare_image(image, size), 1
+
+    with metrics.stage("decode"):
+        reduced = open_reduced(filename, memory_budget.free())
+    if reduced is None:
+        return None
+    metrics.count("reduced_previews")
+    return prepare_image(reduced[0], size), reduced[1]
+
+
+class Prefetcher:
+    """Opens neighbouring images of folder by thread pool with open_for_preview, so they're displayed at once.
+    Opened images are kept in LRU cache limited by bytes of images and their pipelines, images which aren't neighbours
+    anymore aren't opened. Image is taken out of cache when window gets it, its pipeline grows while it's shown.
+    Cache takes no more than cache_bytes and no more than budget_share of free memory budget"""
+
+    budget_share = 0.25
+
+    def __init__(self, workers=2, cache_bytes=1 << 30):
+        self.executor = ThreadPoolExecutor(workers)
+        self.cache_bytes = cache_bytes
+        self.cache = LRUCache(cache_bytes)
+        self.pending = {}
+        self.lock = Lock()
+        memory_budget.register(self.release)
+
+    def release(self):
+        "Drops opened images, they're opened again when they're needed"
+
+        with self.lock:
+            self.cache.clear()
+
+    def limit(self):
+        "Returns bytes which opened images may take, images already kept in cache are a part of used memory"
+
+        free = memory_budget.free()
+        if free is None:
+            return self.cache_bytes
+        return min(self.cache_bytes, self.cache.size + int(free * self.budget_share))
+
+    @staticmethod
+    def key(filename):
+        "Returns key of file which changes when file is changed"
+
+        stat = os.stat(filename)
+        return os.path.normcase(os.path.abspath(filename)), stat.st_mtime_ns, stat.st_size
+
+    def prefetch(self, filenames, size):
+        "Starts opening files which aren't opened yet and cancels opening of other files"
+
+        keys = set()
+        with self.lock:
+            for filename in filenames:
+                try:
+                    key = self.key(filename)
+                except OSError:
+                    continue
+                keys.add(key)
+                if self.cache.get(key) is None and key not in self.pending:
+                    self.pending[key] = self.executor.submit(self.open, key, filename, size)
+
+            for key in [key for key in self.pending if key not in keys]:
+                if self.pending[key].cancel():
+                    del self.pending[key]
+
+    def open(self, key, filename, size):
+        try:
+            result = open_for_preview(filename, size)
+        except Exception:
+            # damaged file shows its error when window opens it
+            result = None
+
+        with self.lock:
+            self.pending.pop(key, None)
+            if result is not None:
+                self.cache.max_bytes = self.limit()
+                self.cache.put(key, result, result[3].nbytes())
+        return result
+
+    def get(self, filename, timeout=None):
+        """Returns prefetched image of file, or None if it isn't opened. Opening which hasn't started yet is
+        cancelled, opening which is running is waited for up to timeout seconds, so file isn't decoded twice"""
+
+        try:
+            key = self.key(filename)
+        except OSError:
+            return None
+
+        with self.lock:
+            result = self.cache.pop(key)
+            future = self.pending.get(key) if result is None else None
+        if future is not None:
+            if future.cancel():
+                return None
+            try:
+                result = future.result(timeout)
+            except (CancelledError, FutureTimeoutError):
+                return None
+            with self.lock:
+                self.cache.pop(key)
+        return result
+
+    def opening(self, filename):
+        "Checks if worker is opening file now"
+
+        try:
+            key = self.key(filename)
+        except OSError:
+            return False
+
+        with self.lock:
+            future = self.pending.get(key)
+        return future is not None and future.running()
 
 
 class BrightnessSpinbox(Spinbox):
@@ -217,6 +3331,19 @@ class ColorFrame(Frame):
         self.bind("<Button-1>", function)
 
 
+# Tk isn't thread-safe, so worker threads pass functions changing widgets to Tk thread by this deque
+ui_calls = deque()
+
+
+def call_in_ui(function, *args):
+    "Calls function by Tk thread: at once if it's called from Tk thread, otherwise soon without waiting for it"
+
+    if current_thread() is main_thread():
+        function(*args)
+    else:
+        ui_calls.append((function, args))
+
+
 class ProgressbarFrame(Frame):
     """Little Frame with Progressbar working while a file is being opened if image resolution is 1920x1200 or more,
     needs main window name, parallel flow, and text"""
@@ -250,14 +3377,14 @@ class ProgressbarFrame(Frame):
 
     def run_thread(self):
 
-        # exception when user closes this app while image is being opened
+        # parallel flow changes widgets only by call_in_ui, so window is closed by Tk thread after its changes.
+        # Unexpected errors are shown instead of being lost in 2nd thread
         try:
             self.parallel_flow()
-        except RuntimeError:
-            sys.exit(0)
-
-        # closes window
-        self.after(0, self.close_window)
+        except Exception as error:
+            call_in_ui(mb.showerror, "Error!", f"Something went wrong:\n{error}")
+        finally:
+            call_in_ui(self.close_window)
 
     def close_window(self):
         self.destroy()
@@ -281,22 +3408,50 @@ class DualTone:
         # 100% default value for brightness and contrast
         self.default_spinbox_val = 100
 
-        # np matrix for red color filter
-        self.red = np.array([[1.6, 0, 0],
-                             [0, 1, 0],
-                             [0, 0, 1]])
-
-        # np matrix for sepia filter
-        self.sepia = np.array([[0.393, 0.769, 0.189],
-                               [0.349, 0.686, 0.168],
-                               [0.272, 0.534, 0.131]])
+        # np matrices for red and sepia color filters
+        self.red = RED_MATRIX
+        self.sepia = SEPIA_MATRIX
 
         # default color for overall tint RGB filter
-        self.tint_color_tuple = ((255, 128, 255), '#ff80ff')
+        self.tint_color_tuple = DEFAULT_TINT_COLOR
 
         # default colors for two-colored RGB filters
-        self.rgb1_tuple = ((0, 0, 0), '#000000')
-        self.rgb2_tuple = ((0, 255, 255), '#00ffff')
+        self.rgb1_tuple = DEFAULT_RGB1
+        self.rgb2_tuple = DEFAULT_RGB2
+
+        # memory-mapped pixels of opened image if it's uncompressed, otherwise None
+        self.raw_image = None
+        # image which doesn't fit memory is shown reduced by this factor
+        self.reduction = 1
+
+        # CubeLUT for "3D LUT (.cube)" filter, it's loaded from file when user choses this filter
+        self.lut = None
+
+        # FrameSequence of animated image or numbered image files, None for single image
+        self.sequence = None
+
+        # scale of zoomed image and its point shown in top left corner of canvas, None if image is fitted to window
+        self.zoom = None
+        self.view_x, self.view_y = 0, 0
+        self.tiles = None
+
+        # neighbouring images of folder which are opened in advance, and how many of them on each side
+        self.prefetcher = Prefetcher()
+        self.prefetch_count = 2
+
+        # position of divider of before/after view as a part of image width
+        self.split = 0.5
+
+        # True while user resizes window or scrubs spinboxes, images are resampled fast until input stops
+        self.interactive = False
+        # redraw method -> id of its call planned after input stops
+        self.settling = {}
+
+        # number of the latest preview, older coarse and full previews aren't shown; full previews are made one by one
+        self.preview_generation = 0
+        self.preview_lock = Lock()
+        # True while brightness, contrast and histograms of preview are made by 2nd thread
+        self.levels_pending = False
 
         # tuple of all color filters for RGB
         self.RGB_filters = ("None",
@@ -318,7 +3473,8 @@ class DualTone:
                             "Posterize 1 bit",
                             "Posterize 2 bit",
                             "Posterize 3 bit",
-                            "Posterize 4 bit")
+                            "Posterize 4 bit",
+                            "3D LUT (.cube)")
 
         # tuple of all color filters for RGBA
         self.RGBA_filters = ("None",
@@ -333,14 +3489,33 @@ class DualTone:
                              "Sharpen",
                              "Detail",
                              "Edge Enhance",
-                             "Invert")
+                             "Invert",
+                             "3D LUT (.cube)")
 
         # UI initialization
         self.initUI()
 
+        self.drainUI()
         self.root.mainloop()
 
 
+    def drainUI(self):
+        "Calls functions which worker threads passed to change widgets, Tk loop repeats it"
+
+        try:
+            while ui_calls:
+                function, args = ui_calls.popleft()
+                try:
+                    function(*args)
+                except _tkinter.TclError as error:
+                    # widget was destroyed before its queued update came, the rest of the queue still runs
+                    print(f"Queued update of widget failed: {error}", file=sys.stderr)
+                except Exception as error:
+                    mb.showerror("Error!", f"Something went wrong:\n{error}")
+        finally:
+            self.root.after(15, self.drainUI)
+
+
     def initUI(self):
         # standard Tkinter window
         self.root = Tk()
@@ -451,7 +3626,7 @@ class DualTone:
                                                 from_=0,
                                                 to=280,
                                                 increment=1,
-                                                command=self.getBrightnessAndContrast,
+                                                command=self.scrubLevels,
                                                 state="disabled")
         self.bright_spinbox.pack(side="left")
         self.bright_spinbox.bind("<Return>", self.brightnessFromKeyboard)
@@ -466,7 +3641,7 @@ class DualTone:
                                                 from_=-300,
                                                 to=300,
                                                 increment=1,
-                                                command=self.getBrightnessAndContrast,
+                                                command=self.scrubLevels,
                                                 state="disabled")
         self.contrast_spinbox.pack(side="left")
         self.contrast_spinbox.bind("<Return>", self.contrastFromKeyboard)
@@ -507,6 +3682,13 @@ class DualTone:
         self.rgb2_frame.pack(side="left", pady=2)
         Hovertip(self.rgb2_frame, ' Click here to set 2nd RGB color \n for 2-Colored RGB filters".')
 
+        # histogram of displayed image and percentage of pixels clipped to black and white
+        self.histogram_canvas = Canvas(self.toolbar, width=128, height=28, bg="white", highlightthickness=0)
+        self.histogram_canvas.pack(side="left", padx=5, pady=2)
+        self.clipping_lbl = Label(self.toolbar, font=("Helvetica", 10))
+        self.clipping_lbl.pack(side="left")
+        Hovertip(self.clipping_lbl, " Pixels clipped to black and to white \n by brightness and contrast. ")
+
         self.canv = Canvas(self.root,
                            bg="#ffff7e",
                            highlightthickness=0,
@@ -515,6 +3697,14 @@ class DualTone:
         self.canv.bind("<Button-3>", self.showMenu)
         self.canv.bind("<Configure>", self.onResize)
 
+        # zoom by mouse wheel, pan by dragging, double click switches between 100% and fitting to window
+        self.canv.bind("<MouseWheel>", self.zoomImage)
+        self.canv.bind("<Button-4>", self.zoomImage)
+        self.canv.bind("<Button-5>", self.zoomImage)
+        self.canv.bind("<ButtonPress-1>", self.startPan)
+        self.canv.bind("<B1-Motion>", self.panImage)
+        self.canv.bind("<Double-Button-1>", self.switchZoom)
+
         # Statusbar:
         self.statusbar = Label(self.canv,
                                relief="groove",
@@ -527,20 +3717,53 @@ class DualTone:
         self.root.protocol("WM_DELETE_WINDOW", self.saveBeforeClose)
 
         # hot keys working in any language, not only in English unlike tkinter "bind" method
-        keyboard.add_hotkey('ctrl+o', self.checkBeforeOpen)
-        keyboard.add_hotkey('ctrl+s', self.saveFile)
-        keyboard.add_hotkey('ctrl+shift+s', self.saveCMYK)
+        # keyboard calls them from its listener thread, so they are passed to Tk thread
+        keyboard.add_hotkey('ctrl+o', lambda: call_in_ui(self.checkBeforeOpen))
+        keyboard.add_hotkey('ctrl+s', lambda: call_in_ui(self.saveFile))
+        keyboard.add_hotkey('ctrl+shift+s', lambda: call_in_ui(self.saveCMYK))
 
         # binding with default tkinter method
         self.root.bind("<F1>", self.info)
+        self.root.bind("<Right>", lambda event: self.navigate(event, 1))
+        self.root.bind("<Left>", lambda event: self.navigate(event, -1))
 
         # Menu bound on Mouse 2 button
         self.menu_var = StringVar()
         self.menu_var.set("None")
         self.menu = Menu(self.toolbar, tearoff=False)
         self.menu.add_command(label="Open Image (Ctrl+O)", command=self.checkBeforeOpen)
+        self.menu.add_command(label="Open Image Sequence", command=lambda: self.checkBeforeOpen(sequence=True))
+        self.menu.add_command(label="Next Image (Right)", command=lambda: self.checkBeforeOpen(step=1),
+                              state="disabled")
+        self.menu.add_command(label="Previous Image (Left)", command=lambda: self.checkBeforeOpen(step=-1),
+                              state="disabled")
         self.menu.add_command(label="Save Image (Ctrl+S)", command=self.saveFile, state="disabled")
         self.menu.add_command(label="Convert to CMYK (Ctrl+Shift+S)", command=self.saveCMYK, state="disabled")
+        self.menu.add_command(label="Export Derivatives", command=self.exportDerivatives, state="disabled")
+        self.menu.add_separator()
+
+        # 3D LUT can be loaded from .cube file, current color filter can be exported as .cube file
+        self.menu.add_command(label="Load 3D LUT (.cube)", command=self.loadLUT, state="disabled")
+        self.lut_menu = Menu(self.menu, tearoff=False)
+        for size in (17, 33, 65):
+            self.lut_menu.add_command(label=f"{size}-point LUT", command=lambda size=size: self.exportLUT(size))
+        self.menu.add_cascade(label="Export 3D LUT (.cube)", menu=self.lut_menu, state="disabled")
+        self.menu.add_separator()
+
+        # original image is shown to the left of draggable divider, filtered image to the right of it
+        self.split_var = IntVar()
+        self.menu.add_checkbutton(label="Before/After View", variable=self.split_var, command=self.resizeToFit,
+                                  state="disabled")
+        self.menu.add_command(label="Contact Sheet", command=self.contactSheet, state="disabled")
+
+        # brightness and contrast, or colors of 2-colored filters are suggested by levels of image
+        self.menu.add_command(label="Auto Levels", command=self.autoLevels, state="disabled")
+        self.menu.add_command(label="Auto 2-Colored RGB", command=self.autoColors, state="disabled")
+        self.menu.add_separator()
+
+        # recipe keeps filter, colors, brightness and contrast to repeat them later or by batch rendering
+        self.menu.add_command(label="Save Recipe", command=self.saveRecipe, state="disabled")
+        self.menu.add_command(label="Load Recipe", command=self.loadRecipe, state="disabled")
         self.menu.add_separator()
 
         # radiobuttons to duplicate filters combobox
@@ -589,10 +3812,17 @@ class DualTone:
             self.getBrightnessAndContrast()
 
 
-    def checkBeforeOpen(self, *args):
+    def checkBeforeOpen(self, *args, sequence=False, step=0):
         """Checks first if any filter is applied and/or brightness and contrast aren't equal 100.
         If nothing is changed, program just opens another picture. If current picture is
-        changed, it suggests save new file with mb.askyesnocancel method. """
+        changed, it suggests save new file with mb.askyesnocancel method. If step is given,
+        next (1) or previous (-1) image of the same folder is opened instead of Open File dialog"""
+
+        def open_file():
+            if step:
+                self.openNeighbor(step)
+            else:
+                self.openFile(sequence)
 
         # gets filter and values of brightness and contrast
         filter = self.filters_combobox.get()
@@ -606,7 +3836,7 @@ class DualTone:
 
             # won't ask to save file if nothing is changed, suggests open another picture
             elif filter == "None" and int(brightness) == 100 and int(contrast) == 100:
-                self.openFile()
+                open_file()
 
             # asks if user wants to save file if something is changed
             else:
@@ -616,11 +3846,11 @@ class DualTone:
                 # if users click "Yes"
                 if question is True:
                     self.saveFile()
-                    self.openFile()
+                    open_file()
 
                 # if user clicks "No"
                 elif question is False:
-                    self.openFile()
+                    open_file()
 
                 # if user clicks "Cancel", just closes question window
                 else:
@@ -628,14 +3858,72 @@ class DualTone:
 
         # continues to open file if there's no displayed image
         except AttributeError:
-            self.openFile()
+            open_file()
+
+
+    def navigate(self, event, step):
+        "Opens next or previous image by arrow keys unless they move cursor in spinbox or combobox"
+
+        if not isinstance(event.widget, (Spinbox, ttk.Combobox)):
+            self.checkBeforeOpen(step=step)
+
+
+    def folderFiles(self):
+        "Returns paths of images in folder of opened file sorted by lowercase names"
+
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        return [os.path.join(folder, name) for name in sorted(os.listdir(folder), key=str.lower)
+                if name.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+    def openNeighbor(self, step):
+        "Opens image which is step files after opened one in its folder"
+
+        try:
+            filenames = self.folderFiles()
+        except (AttributeError, OSError):    # no image is open or folder is deleted
+            return
+
+        paths = [os.path.normcase(filename) for filename in filenames]
+        current = os.path.normcase(os.path.abspath(self.filename))
+        if current in paths:
+            index = paths.index(current)
+        else:
+            # deleted file is found by its place among other files, it's searched by the same key they're sorted by
+            names = [os.path.basename(filename).lower() for filename in filenames]
+            index = bisect.bisect_left(names, os.path.basename(self.filename).lower()) - (step > 0)
+        if 0 <= index + step < len(filenames):
+            self.filename = filenames[index + step]
+            self.displayImage()
 
 
-    def openFile(self):
-        "Continues to open file"
+    def prefetchNeighbors(self):
+        "Starts opening images next to opened one in its folder"
+
+        try:
+            filenames = self.folderFiles()
+        except OSError:
+            return
+
+        paths = [os.path.normcase(filename) for filename in filenames]
+        current = os.path.normcase(os.path.abspath(self.filename))
+        if current not in paths:
+            return
+        index = paths.index(current)
+
+        # the next images are opened first, usually user goes forward
+        neighbors = []
+        for distance in range(1, self.prefetch_count + 1):
+            neighbors += [filenames[i] for i in (index + distance, index - distance) if 0 <= i < len(filenames)]
+        self.prefetcher.prefetch(neighbors, (self.viewer_w, self.viewer_h))
+
+
+    def openFile(self, sequence=False):
+        "Continues to open file, if sequence is True, opens all numbered files of the same sequence as chosen one"
 
         ftypes = [
             ("All files", "*"),
+            ("GIF files", "*.gif"),
             ("JPG files", "*.jpg"),
             ("JPEG files", "*.jpeg"),
             ("PNG files", "*.png"),
@@ -660,8 +3948,8 @@ class DualTone:
             i = i[1][1:]
             extensions.append(i)
 
-        # converts "extensions" list into a tuple: ('.jpg', '.jpeg', '.png', '.bmp', '.jfif', '.tif', '.tiff', '.ico',
-        # '.webp', '.ppm', '.pgm', '.pbm', '.pcx', '.tga')
+        # converts "extensions" list into a tuple: ('.gif', '.jpg', '.jpeg', '.png', '.bmp', '.jfif', '.tif', '.tiff',
+        # '.ico', '.webp', '.ppm', '.pgm', '.pbm', '.pcx', '.tga')
         extensions = tuple(extensions)
 
         # gets filename
@@ -675,219 +3963,567 @@ class DualTone:
             self.filename = filename
         # also checks file extension, if it isn't supported, image won't be open and this method will be stopped
         else:
-            if filename.lower().endswith(".gif"):
-                # informs that GIF images aren't supported
-                mb.showerror("Error", "GIF files aren't supported!")
+            mb.showerror("Error", "Can't open this file!")
+            return
+
+        # the first file of numbered sequence is displayed, all of them are saved
+        if sequence:
+            filenames = FrameSequence.numbered(filename)
+            if len(filenames) < 2:
+                mb.showerror("Error", "Can't find other numbered\n"
+                                      "images of this sequence!")
                 return
-            else:
-                mb.showerror("Error", "Can't open this file!")
+            self.filename = filenames[0]
+            self.displayImage(sequence=FrameSequence(filenames))
+            return
+
+        self.displayImage()
+
+    def displayImage(self, progress_message="Displaying your image...", sequence=None):
+        "Begins to display image, the first frame is displayed for animated images and image sequences"
+
+        # neighbouring images of folder are opened in advance with their previews, image which is being opened
+        # now is waited for with progress bar instead of being decoded twice
+        prefetched = self.prefetcher.get(self.filename, timeout=0) if sequence is None else None
+        prefetching = sequence is None and not prefetched and self.prefetcher.opening(self.filename)
+
+        # Exception that won't try to open damaged image
+        try:
+            image = prefetched[1] if prefetched else Image.open(self.filename)
+        except PIL.UnidentifiedImageError:
+            mb.showerror("Error", "Can't open this file. Perhaps\n"
+                                  "this file is damaged")
+            return
+
+        # won't open image with any another error
+        except:
+            mb.showerror("Error", "Can't open this file!")
+            return
+
+        # widgets are read by Tk thread before 2nd thread is started
+        filename = self.filename
+        size = self.viewerSize()
+
+        def displaying_flow():
+            "Internal function to open file as 2nd thread while progressbar is displayed"
+
+            opened = self.prefetcher.get(filename) if prefetching else None
+            if opened:
+                call_in_ui(self.showOriginalImage, filename, opened[1], opened, 1, sequence)
+                return
+
+            # converts image to color mode which filters can work with and fits it to window size. Caches of other
+            # images are dropped if image doesn't fit memory budget, and if it still doesn't fit, it's reduced
+            try:
+                result = (prefetched, 1) if prefetched else prepare_within_budget(filename, image, size)
+            except Exception:
+                # damaged pixel data is found only when image is decoded
+                call_in_ui(mb.showerror, "Error", "Can't open this file!")
+                return
+            if result is None:
+                call_in_ui(mb.showerror, "Error", "There isn't enough memory to open this image!")
                 return
+            call_in_ui(self.showOriginalImage, filename, image, *result, sequence)
+
+        # doesn't show progressbar picture resolution is less than 1920x1200 or if it's already opened
+        if prefetched or not prefetching and image.width <= 1920 and image.height < 1200:
+            displaying_flow()
+        else:    # shows progressbar if picture resolution is more than 1920x1200
+            ProgressbarFrame(self.root, displaying_flow, progress_message)
+
+
+    def showOriginalImage(self, filename, image, prepared, reduction=1, sequence=None):
+        """Shows image prepared by prepare_image with default filter, brightness and contrast, and activates widgets.
+        Image is the opened file, its frames are read for animated images. Reduction is more than 1 if image was
+        reduced because it doesn't fit memory, then it can't be saved at full resolution"""
+
+        self.filename = filename
+        self.original_image = image
+        self.resolution = image.size
+        self.reduction = reduction
+
+        # uncompressed files are also mapped to memory to be saved band by band
+        self.mapRawImage()
+        self.setSequence(sequence)
+        self.prepareOriginalImage(prepared)
+
+        # previews of filters of previous image aren't shown anymore
+        self.preview_generation += 1
+
+        # shows file info in statusbar
+        self.configStatusbar()
+        # sets default brightness and contrast values
+        self.menu_var.set("None")
+        self.filters_combobox.set("None")
+        self.bright_var.set(self.default_spinbox_val)
+        self.contrast_var.set(self.default_spinbox_val)
+
+        # activates all disabled widgets
+        self.save_file_button.config(state="active")
+        self.cmyk_button.config(state="active")
+        self.filters_combobox.config(state="active")
+        self.menu.entryconfig("Save Image (Ctrl+S)", state="active")
+        self.menu.entryconfig("Convert to CMYK (Ctrl+Shift+S)", state="active")
+        self.menu.entryconfig("Export Derivatives", state="active")
+        self.menu.entryconfig("Next Image (Right)", state="active")
+        self.menu.entryconfig("Previous Image (Left)", state="active")
+        self.menu.entryconfig("Load 3D LUT (.cube)", state="active")
+        self.menu.entryconfig("Export 3D LUT (.cube)", state="active")
+        self.menu.entryconfig("Save Recipe", state="active")
+        self.menu.entryconfig("Before/After View", state="active")
+        self.menu.entryconfig("Contact Sheet", state="active")
+        self.menu.entryconfig("Auto Levels", state="active")
+        self.menu.entryconfig("Auto 2-Colored RGB", state="active")
+        self.menu.entryconfig("Load Recipe", state="active")
+        self.contrast_spinbox.config(state="normal")
+        self.bright_spinbox.config(state="normal")
+
+        # continues displaying by fitting image to window size, it's fitted by prepare_image already
+        self.resizeToFit()
+
+        self.prefetchNeighbors()
+
+
+    def prepareOriginalImage(self, prepared):
+        """Takes image converted to color mode which filters can work with by prepare_image, activates filters
+        available for it, and gets its reserve copy. Palette and grayscale images aren't converted to RGB,
+        they are filtered by palette"""
+
+        self.original_clr_mode, self.original_image, transparent, pipeline = prepared
+
+        # activates only filters available for RGBA
+        if transparent:
+            self.filters_combobox.configure(values=self.RGBA_filters)
+            for e in self.RGB_filters:
+                if e in self.RGBA_filters:
+                    self.menu.entryconfig(e, state="active")
+                else:
+                    self.menu.entryconfig(e, state="disabled")
+
+        # activates all filters for RGB
+        else:
+            self.filters_combobox.configure(values=self.RGB_filters)
+            for e in self.RGB_filters:
+                self.menu.entryconfig(e, state="active")
+
+        # gets reserve copy of image for next operations, with it file can be saved even if it's deleted from PC.
+        # Image is loaded into memory already and nothing changes it, so it's copied only for animated images
+        self.reserve_copy = pipeline.image
+        self.setPipeline(pipeline)
+
+
+    def setPipeline(self, pipeline=None):
+        """Makes displayed image of reserve copy by stages which keep their results, new image is fitted to window.
+        Pipeline of prepared image is taken with its stages"""
+
+        self.pipeline = pipeline or PreviewPipeline(self.reserve_copy)
+
+        if self.tiles is not None:
+            self.tiles.close()
+        self.tiles = TileRenderer(self.pipeline)
+        self.zoom = None
+
+
+    def setSequence(self, sequence=None):
+        "Sets sequence of frames of animated image if other sequence isn't given"
+
+        if sequence is None and getattr(self.original_image, "n_frames", 1) > 1:
+            sequence = FrameSequence([self.filename])
+        self.sequence = sequence
+
+
+    def mapRawImage(self):
+        "Maps pixels of opened file to memory if it's uncompressed, otherwise sets None"
+
+        try:
+            self.raw_image = RawImage(self.filename)
+        except (ValueError, OSError):
+            self.raw_image = None
+
+
+    def canRenderRaw(self, filter, new_image_name):
+        "Checks if image can be saved band by band from one memory-mapped file to another one"
+
+        extension = os.path.splitext(new_image_name)[1].lower()
+        mode = filtered_mode(self.reserve_copy.mode, filter)
+
+        # source file mustn't be overwritten while it's being read
+        if os.path.abspath(new_image_name) == os.path.abspath(self.raw_image.filename):
+            return False
+
+        return self.raw_image.mode == self.reserve_copy.mode and mode in RawImage.writable.get(extension, ())
+
+
+    def resizeToFit(self, generation=None):
+        """Resizes images so that they will fit to window size if they are larger than window size. If generation
+        of progressive preview is given, image isn't shown when a newer preview has been started"""
+
+        if generation is not None and generation != self.preview_generation:
+            return
+
+        # Get the canvas width and height
+        self.viewer_w, self.viewer_h = self.viewerSize()
+
+        try:    # handles NameError and AttributeError if image isn't open
+            # fits image to window size if its weight or height are more than window ones, color filters are
+            # applied after fitting, so only displayed pixels are filtered
+            filtered = self.pipeline.filtered((self.viewer_w, self.viewer_h),
+                                              self.filters_combobox.get(),
+                                              self.tint_color_tuple,
+                                              self.rgb1_tuple,
+                                              self.rgb2_tuple,
+                                              self.lut,
+                                              cached=True)
+        except (NameError, AttributeError):
+            return
+
+        # Tk thread doesn't filter, preview of new size or filter is made by 2nd thread which calls this method again
+        if filtered is None:
+            self.startPreview()
+            return
 
-        self.displayImage()
+        self.displayed_image_copy = filtered
+        self.getBrightnessAndContrast()
 
-    def displayImage(self, progress_message="Displaying your image..."):
-        "Begins to display image"
 
-        # Exception that won't try to open damaged image
-        try:
-            self.original_image = Image.open(self.filename)
-        except PIL.UnidentifiedImageError:
-            mb.showerror("Error", "Can't open this file. Perhaps\n"
-                                  "this file is damaged")
-            return
+    def renderSettings(self):
+        """Returns filter, its colors, brightness, contrast and 3D LUT chosen by widgets. Saving flows get them read by
+        Tk thread before they're started, so they don't see widgets changed meanwhile and change widgets only by
+        call_in_ui"""
 
-        # won't open image with any another error
-        except:
-            mb.showerror("Error", "Can't open this file!")
-            return
+        return (self.filters_combobox.get(), (self.tint_color_tuple, self.rgb1_tuple, self.rgb2_tuple),
+                int(self.bright_spinbox.get()), int(self.contrast_spinbox.get()), self.lut)
 
-        def displaying_flow():
-            "Internal function to open file as 2nd thread while progressbar is displayed"
 
-            self.original_clr_mode = copy.deepcopy(self.original_image.mode)
+    def viewerSize(self):
+        "Returns width and height of canvas where image is shown, statusbar covers bottom of canvas"
 
-            # if opening image has P or RGBX color modes, it will be converted to RGBA
-            if self.original_image.mode == "P" or "RGBX":
-                self.original_image = self.original_image.convert("RGBA")
+        return self.canv.winfo_width(), self.canv.winfo_height() - self.statusbar.winfo_height()
 
-            # activates only filters available for RGBA
-            if has_transparency(self.original_image):
-                self.filters_combobox.configure(values=self.RGBA_filters)
-                for e in self.RGB_filters:
-                    if e in self.RGBA_filters:
-                        self.menu.entryconfig(e, state="active")
-                    else:
-                        self.menu.entryconfig(e, state="disabled")
-
-            # activates all filters for RGB
-            elif not has_transparency(self.original_image):
-                if self.original_image.mode != "RGB":
-                    self.original_image = self.original_image.convert("RGB")
-                self.filters_combobox.configure(values=self.RGB_filters)
-                for e in self.RGB_filters:
-                    self.menu.entryconfig(e, state="active")
 
-            # gets reserve copy of image for next operations, with it file can be saved even if it's deleted from PC
-            self.reserve_copy = deepcopy(self.original_image)
+    def progressivePreview(self):
+        """Returns flow for 2nd thread which shows image with filter at 1/8 and 1/2 of preview resolution and then
+        at full resolution. Every preview replaces the previous one, and all of them are skipped when filter or its
+        colors are changed again. Parameters are read from widgets here, flow passes previews to Tk thread"""
 
-            # converts reserve copy to numpy array for optimization
-            a = np.asarray(self.reserve_copy)
-            self.reserve_copy = Image.fromarray(a)
+        self.preview_generation += 1
+        generation = self.preview_generation
+        pipeline = self.pipeline
+        size = self.viewerSize()
+        params = (self.filters_combobox.get(), self.tint_color_tuple, self.rgb1_tuple, self.rgb2_tuple, self.lut)
+        levels = (int(self.bright_spinbox.get()), int(self.contrast_spinbox.get()))
+        split = self.split_var.get()
 
-            # shows file info in statusbar
-            self.configStatusbar()
-            # sets default brightness and contrast values
-            self.menu_var.set("None")
-            self.filters_combobox.set("None")
-            self.bright_var.set(self.default_spinbox_val)
-            self.contrast_var.set(self.default_spinbox_val)
+        # coarse previews aren't needed for small images, and zoomed images are shown by tiles
+        coarse = self.zoom is None and self.reserve_copy.width * self.reserve_copy.height > 1 << 20
+        scale = min(1, size[0] / self.reserve_copy.width, size[1] / self.reserve_copy.height)
+        fitted_size = (max(1, int(self.reserve_copy.width * scale)), max(1, int(self.reserve_copy.height * scale)))
 
-            # activates all disabled widgets
-            self.save_file_button.config(state="active")
-            self.cmyk_button.config(state="active")
-            self.filters_combobox.config(state="active")
-            self.menu.entryconfig("Save Image (Ctrl+S)", state="active")
-            self.menu.entryconfig("Convert to CMYK (Ctrl+Shift+S)", state="active")
-            self.contrast_spinbox.config(state="normal")
-            self.bright_spinbox.config(state="normal")
+        def preview_flow():
+            for factor in (8, 2) if coarse else ():
+                preview = pipeline.coarse(size, factor, *params, *levels)
+                if generation != self.preview_generation:
+                    return
+                call_in_ui(self.showCoarsePreview, generation, preview.resize(fitted_size, Resampling.BILINEAR))
 
-            # continues displaying by fitting image to window size
-            self.resizeToFit()
+            # full previews are made one by one, so stages of pipeline belong to the same parameters. Stages which
+            # Tk thread shows with the preview are made here too
+            with self.preview_lock:
+                if generation == self.preview_generation:
+                    pipeline.filtered(size, *params)
+                    pipeline.enhanced(*levels)
+                    pipeline.histograms(*levels)
+                    if split:
+                        pipeline.fit(size)
 
-        # doesn't show progressbar picture resolution is less than 1920x1200
-        if self.original_image.width <= 1920 and self.original_image.height < 1200:
-            displaying_flow()
-        else:    # shows progressbar if picture resolution is more than 1920x1200
-            ProgressbarFrame(self.root, displaying_flow, progress_message)
+            # image filtered by pipeline is shown by Tk thread
+            call_in_ui(self.resizeToFit, generation)
 
+        return preview_flow
 
-    def resizeToFit(self):
-        "Resizes images so that they will fit to window size if they are larger than window size"
 
-        # Get the canvas width and height
-        self.viewer_w = self.canv.winfo_width()
-        self.viewer_h = self.canv.winfo_height() - self.statusbar.winfo_height()
+    def showCoarsePreview(self, generation, preview):
+        "Shows coarse preview made by 2nd thread unless a newer preview has been started"
 
-        try:    # handles NameError and AttributeError if image isn't open
-            original_w, original_h = self.original_image.width, self.original_image.height
-            # fits image to window size if its weight or height are more than window ones
-            if original_w <= self.viewer_w and original_h <= self.viewer_h:
-                self.displayed_image = self.original_image
-            else:
-                ratio = min(self.viewer_w / original_w, self.viewer_h / original_h)
+        if generation != self.preview_generation:
+            return
 
-                self.displayed_image = self.original_image.resize((int(original_w * ratio), int(original_h * ratio)),
-                                                                  Resampling.LANCZOS)
+        self.displayed_image_2 = ImageTk.PhotoImage(preview)
+        self.canv.delete("divider")
+        self.canv.create_image(self.viewer_w // 2, self.viewer_h // 2, image=self.displayed_image_2, anchor="center",
+                               tag="image")
 
-            # copy is needed for changing brightness and contrast, they won't work properly without this copy
-            self.displayed_image_copy = copy.deepcopy(self.displayed_image)
-            self.getBrightnessAndContrast()
 
-        except (NameError, AttributeError):
-            pass
+    def scrubLevels(self):
+        "Shows brightness and contrast changed by spinbox arrows, zoomed image is resampled fast while they're clicked"
+
+        self.interact(self.getBrightnessAndContrast)
+        self.getBrightnessAndContrast()
 
 
     def getBrightnessAndContrast(self):
         "Gets brightness and contrast values from spinboxes, also this method is binded to spinboxes for optimization"
 
-        # sets brightness; user enters its percentage, program converts it to float values
-        brightness_rate = int(self.bright_spinbox.get()) * 0.01
-        brightness_enhancer = ImageEnhance.Brightness(self.displayed_image_copy)   # won't work without copy
-        self.displayed_image = brightness_enhancer.enhance(brightness_rate)
+        # user enters percentage of brightness and contrast, filtered image is taken from pipeline without filtering.
+        # Tk thread shows only stages which are made already, the other ones are made by 2nd thread
+        brightness, contrast = int(self.bright_spinbox.get()), int(self.contrast_spinbox.get())
+        displayed_image = self.pipeline.enhanced(brightness, contrast, cached=True)
+        histograms = self.pipeline.histograms(brightness, contrast, cached=True)
+        before = self.pipeline.fit((self.viewer_w, self.viewer_h), cached=True) if self.split_var.get() else True
+        if displayed_image is None or histograms is None or before is None:
+            self.startLevels()
+            return
+
+        self.displayed_image = displayed_image
+        self.drawHistogram(histograms)
 
-        # sets contrast; user enters its percentage, program converts it to float values
-        contrast_rate = int(self.contrast_spinbox.get()) * 0.01
-        contrast_enhancer = ImageEnhance.Contrast(self.displayed_image)
-        self.displayed_image = contrast_enhancer.enhance(contrast_rate)
 
+        # zoomed image is displayed by tiles
+        if self.zoom is not None:
+            self.drawTiles()
+            return
 
         # eventually displays image in canvas with its filter and rightness and contrast values
         self.displayed_image_2 = ImageTk.PhotoImage(self.displayed_image)
 
+        self.canv.delete("tile")
+        self.canv.delete("divider")
         self.canv.create_image(self.viewer_w // 2,
                                 self.viewer_h // 2,
                                 image=self.displayed_image_2,
                                 anchor="center",
                                 tag="image")
 
+        if self.split_var.get():
+            self.drawSplit()
 
-    def applyFilter(self, filter):
-        "Applies a filter to image"
 
-        def apply_filter_flow():
-            if filter == "None":
-                self.original_image = self.reserve_copy
+    def fitScale(self):
+        "Returns scale of image fitted to window, small images aren't enlarged"
+
+        return min(1, self.viewer_w / self.reserve_copy.width, self.viewer_h / self.reserve_copy.height)
+
+
+    def zoomImage(self, event):
+        "Zooms image in or out by mouse wheel keeping the point under cursor in place"
+
+        try:
+            scale = self.zoom or self.fitScale()
+        except AttributeError:    # no image is open
+            return
 
-            elif filter == "Black and White":
-                self.original_image = ImageOps.grayscale(self.reserve_copy)
+        zoom_in = event.num == 4 or event.delta > 0
+        self.setZoom(scale * 1.25 if zoom_in else scale / 1.25, event.x, event.y)
 
-            elif filter == "Sepia":
-                self.original_image = RGB_filter(self.reserve_copy, self.sepia)
 
-            elif filter == "Red":
-                self.original_image = RGB_filter(self.reserve_copy, self.red)
+    def switchZoom(self, event):
+        "Switches between 100% zoom at the point under cursor and fitting image to window"
 
-            elif filter == "Overall Tint RGB Filter":
-                self.original_image = RGB_filter_custom_color(self.reserve_copy, self.tint_color_tuple[0])
+        try:
+            self.setZoom(1 if self.zoom is None else 0, event.x, event.y)
+        except AttributeError:    # no image is open
+            pass
 
-            elif filter == "2-Colored RGB (Bicubic)":
-                self.original_image = bicubic_interpolation(self.reserve_copy, self.rgb1_tuple, self.rgb2_tuple)
 
-            elif filter == "2-Colored RGB (Linear)":
-                self.original_image = linear_interpolation(self.reserve_copy, self.rgb1_tuple, self.rgb2_tuple)
-                # informing user that two similar colors mustn't be set
-                if self.rgb1_tuple == self.rgb2_tuple:
-                    mb.showinfo("Info", "You will get completely black image\n"
-                                        "if you set two absolutely similar RGB\n"
-                                        "colors with Linear interpolation filter!\n")
+    def setZoom(self, scale, x, y):
+        "Sets zoom and keeps point x, y of canvas in place, image is fitted to window if it gets smaller than window"
 
-            elif filter == "Emboss":
-                self.original_image = self.reserve_copy.filter(ImageFilter.EMBOSS)
+        old_scale = self.zoom or self.fitScale()
+        scale = min(scale, 16)
 
-            elif filter == "Blur":
-                self.original_image = self.reserve_copy.filter(ImageFilter.BLUR)
+        if scale <= self.fitScale():
+            self.zoom = None
+            self.resizeToFit()
+            return
 
-            elif filter == "Sharpen":
-                self.original_image = self.reserve_copy.filter(ImageFilter.SHARPEN)
+        # point of fitted image is counted from its top left corner, the image is centered
+        if self.zoom is None:
+            self.view_x = -(self.viewer_w - self.reserve_copy.width * old_scale) / 2
+            self.view_y = -(self.viewer_h - self.reserve_copy.height * old_scale) / 2
 
-            elif filter == "Smooth":
-                self.original_image = self.reserve_copy.filter(ImageFilter.SMOOTH)
+        self.view_x = (self.view_x + x) * scale / old_scale - x
+        self.view_y = (self.view_y + y) * scale / old_scale - y
+        self.zoom = scale
+        self.drawTiles()
 
-            elif filter == "Mirror":
-                self.original_image = ImageOps.mirror(self.reserve_copy)
 
-            elif filter == "Invert":
-                if not has_transparency(self.original_image):
-                    self.original_image = ImageOps.invert(self.reserve_copy)
-                if has_transparency(self.original_image):
-                    self.original_image = invert_colors_rgba(self.reserve_copy)
+    def startPan(self, event):
+        self.pan_start = (event.x, event.y, self.view_x, self.view_y)
 
-            elif filter == "Detail":
-                self.original_image = self.reserve_copy.filter(ImageFilter.DETAIL)
+        # divider of before/after view jumps to clicked point
+        if self.zoom is None:
+            self.panImage(event)
 
-            elif filter == "Edge Enhance":
-                self.original_image = self.reserve_copy.filter(ImageFilter.EDGE_ENHANCE)
 
-            elif filter == "Contour #1":
-                self.original_image = self.reserve_copy.filter(ImageFilter.CONTOUR)
+    def panImage(self, event):
+        "Moves zoomed image by dragging it, or moves divider of before/after view if image is fitted to window"
 
-            elif filter == "Contour #2":
-                self.original_image = self.reserve_copy.convert("L").filter(ImageFilter.FIND_EDGES)
+        if self.zoom is None:
+            if self.split_var.get() and hasattr(self, "split_photo"):
+                self.moveDivider(event.x - self.viewer_w // 2 + self.displayed_image.width // 2)
+            return
 
-            elif filter == "Posterize 1 bit":
-                self.original_image = ImageOps.posterize(self.reserve_copy, 1)
+        x, y, view_x, view_y = self.pan_start
+        self.view_x = view_x + x - event.x
+        self.view_y = view_y + y - event.y
+        self.drawTiles()
 
-            elif filter == "Posterize 2 bit":
-                self.original_image = ImageOps.posterize(self.reserve_copy, 2)
 
-            elif filter == "Posterize 3 bit":
-                self.original_image = ImageOps.posterize(self.reserve_copy, 3)
+    def drawSplit(self):
+        """Displays before/after view: composite image is made of original and filtered images fitted to window,
+        both of them are taken from pipeline without filtering"""
 
-            elif filter == "Posterize 4 bit":
-                self.original_image = ImageOps.posterize(self.reserve_copy, 4)
+        self.before_photo = ImageTk.PhotoImage(self.pipeline.fit((self.viewer_w, self.viewer_h), cached=True))
+        self.split_photo = ImageTk.PhotoImage(self.displayed_image)
 
-            # fits image to window size
-            self.resizeToFit()
+        # composite image is filtered one at first, it has no columns of original image yet
+        self.split_x = 0
+        self.canv.delete("image")
+        self.canv.delete("divider")
+        self.canv.create_image(self.viewer_w // 2,
+                               self.viewer_h // 2,
+                               image=self.split_photo,
+                               anchor="center",
+                               tag="image")
+        self.canv.create_line(0, 0, 0, 0, fill="#ffff7e", width=2, tag="divider")
+        self.moveDivider(self.split * self.displayed_image.width)
+
+
+    def moveDivider(self, x):
+        "Moves divider to column x of image, only columns between old and new position of divider are copied"
+
+        width, height = self.displayed_image.width, self.displayed_image.height
+        x = min(max(int(x), 0), width)
+
+        # columns to the left of divider are copied from original image, to the right of it from filtered one
+        if x != self.split_x:
+            source = self.before_photo if x > self.split_x else self.displayed_image_2
+            x0, x1 = min(x, self.split_x), max(x, self.split_x)
+            self.root.tk.call(str(self.split_photo), "copy", str(source), "-from", x0, 0, x1, height, "-to", x0, 0)
+            self.split_x = x
+
+        self.split = x / width
+        left = self.viewer_w // 2 - width // 2
+        top = self.viewer_h // 2 - height // 2
+        self.canv.coords("divider", left + x, top, left + x, top + height)
+
+
+    def drawTiles(self):
+        "Displays visible tiles of zoomed image, tiles which aren't rendered yet are displayed when they're ready"
+
+        # zoomed image is centered if it's smaller than window, otherwise it can't be moved out of window
+        width = self.reserve_copy.width * self.zoom
+        height = self.reserve_copy.height * self.zoom
+        for view, size, viewer in (("view_x", width, self.viewer_w), ("view_y", height, self.viewer_h)):
+            if size <= viewer:
+                setattr(self, view, -(viewer - size) / 2)
+            else:
+                setattr(self, view, min(max(getattr(self, view), 0), size - viewer))
+
+        # contrast of tiles uses mean gray level of the whole image
+        brightness = int(self.bright_spinbox.get())
+        contrast = int(self.contrast_spinbox.get())
+        mean = self.pipeline.mean(brightness, cached=True) if contrast != 100 else None
+        if contrast != 100 and mean is None:
+            self.startLevels()
+            return
+
+        params = (self.filters_combobox.get(), self.tint_color_tuple, self.rgb1_tuple, self.rgb2_tuple, self.lut,
+                  brightness, contrast, mean)
+        box = (self.view_x, self.view_y, self.view_x + self.viewer_w, self.view_y + self.viewer_h)
+        tiles = self.tiles.tiles(params, self.zoom, box, self.interactive)
+
+        # PhotoImages are made only for visible tiles and kept while they're displayed
+        tile_size = TileRenderer.tile_size
+        photos = getattr(self, "tile_photos", {})
+        self.tile_photos = {}
+        self.canv.delete("image")
+        self.canv.delete("divider")
+        self.canv.delete("tile")
+        for (x, y), (key, tile) in tiles.items():
+            photo = photos.get(key) or ImageTk.PhotoImage(tile)
+            self.tile_photos[key] = photo
+            self.canv.create_image(x * tile_size - self.view_x,
+                                   y * tile_size - self.view_y,
+                                   image=photo,
+                                   anchor="nw",
+                                   tag="tile")
+
+        # checks if other tiles are rendered
+        if hasattr(self, "_tiles_after_id"):
+            self.root.after_cancel(self._tiles_after_id)
+        if self.tiles.pending:
+            self._tiles_after_id = self.root.after(30, self.checkTiles)
+
+
+    def checkTiles(self):
+        "Displays tiles rendered by workers"
+
+        del self._tiles_after_id
+        if self.zoom is None:
+            return
+        if self.tiles.collect():
+            self.drawTiles()
+        elif self.tiles.pending:
+            self._tiles_after_id = self.root.after(30, self.checkTiles)
+
+
+    def drawHistogram(self, histograms):
+        "Draws histograms of displayed image and shows how many pixels are clipped to black and to white"
+
+        width, height = 128, 28
+
+        # two levels per column, the highest column except black and white ones fills the whole height
+        columns = histograms.reshape(len(histograms), width, 2).sum(axis=2)
+        top = max(columns[:, 1:-1].max(), 1)
+        colors = ("#e00000", "#00a000", "#0000e0") if len(histograms) == 3 else ("#404040",)
+
+        self.histogram_canvas.delete("all")
+        for column, color in zip(columns, colors):
+            points = []
+            for x, count in enumerate(column):
+                points += [x, height - min(count / top, 1) * height]
+            self.histogram_canvas.create_line(*points, fill=color)
+
+        total = histograms[0].sum()
+        shadows = histograms[:, 0].max() / total * 100
+        highlights = histograms[:, 255].max() / total * 100
+        self.clipping_lbl.config(text=f"{shadows:.1f}% | {highlights:.1f}%",
+                                 fg="red" if max(shadows, highlights) >= 1 else "black")
+
+
+    def applyFilter(self, filter):
+        "Applies a filter to image"
+
+        # asks for .cube file first if no 3D LUT is loaded
+        if filter == "3D LUT (.cube)" and self.lut is None:
+            self.loadLUT()
+            return
+
+        # informing user that two similar colors mustn't be set
+        if filter == "2-Colored RGB (Linear)" and self.rgb1_tuple == self.rgb2_tuple:
+            mb.showinfo("Info", "You will get completely black image\n"
+                                "if you set two absolutely similar RGB\n"
+                                "colors with Linear interpolation filter!\n")
+
+        self.startPreview()
+
+        # duplicates setting of filter in menu
+        self.menu_var.set(filter)
+
+
+    def startPreview(self):
+        "Makes preview with current filter by 2nd thread, resizeToFit shows it when it's made"
+
+        preview_flow = self.progressivePreview()
+
+        def apply_filter_flow():
+            # filter is applied by pipeline while image is fitted to window, full image is filtered when it's saved.
+            # Image is fitted to window size showing coarse previews first, pipeline measures its filter stage
+            try:
+                preview_flow()
+            except Exception as error:
+                call_in_ui(mb.showerror, "Error!", f"Can't apply this filter:\n{error}")
 
 
         def watch_cursor(root, parallel_flow):
@@ -908,8 +4544,43 @@ class DualTone:
 
         watch_cursor(self.root, apply_filter_flow)
 
-        # duplicates setting of filter in menu
-        self.menu_var.set(filter)
+
+    def startLevels(self):
+        """Makes brightness, contrast and histograms of filtered preview by 2nd thread, and shows them when they're
+        made. Only one thread makes them, levels changed meanwhile are made after it"""
+
+        if self.levels_pending:
+            return
+        self.levels_pending = True
+
+        pipeline = self.pipeline
+        size = (self.viewer_w, self.viewer_h)
+        levels = (int(self.bright_spinbox.get()), int(self.contrast_spinbox.get()))
+        split = self.split_var.get()
+
+        def levels_flow():
+            made = False
+            try:
+                with self.preview_lock:
+                    # nothing is made if image isn't filtered yet, its preview flow shows it
+                    made = pipeline.enhanced(*levels) is not None and pipeline.histograms(*levels) is not None
+                    if made and split:
+                        pipeline.fit(size)
+            except Exception as error:
+                made = False
+                call_in_ui(mb.showerror, "Error!", f"Can't change brightness and contrast:\n{error}")
+            finally:
+                call_in_ui(self.levelsMade, made)
+
+        Thread(target=levels_flow, daemon=True).start()
+
+
+    def levelsMade(self, made):
+        "Shows levels made by 2nd thread, or makes levels changed while they were being made"
+
+        self.levels_pending = False
+        if made:
+            self.getBrightnessAndContrast()
 
 
     # functionality for tint RGB filter
@@ -927,7 +4598,6 @@ class DualTone:
         self.rgb_tint_color_frame.configure(bg=self.tint_color_tuple[1])
         # applies the same filter with new (if user sets it) or old color (if user clicks "Cancel")
         if self.filters_combobox.get() == "Overall Tint RGB Filter":
-            self.original_image = RGB_filter_custom_color(self.reserve_copy, self.tint_color_tuple[0])
             self.applyFilter(filter="Overall Tint RGB Filter")
 
 
@@ -946,11 +4616,9 @@ class DualTone:
             self.rgb1_frame.configure(bg=self.rgb1_tuple[1])
             # applies selected or current color for 2-colored RGB filters
             if self.filters_combobox.get() == "2-Colored RGB (Bicubic)":
-                self.original_image = bicubic_interpolation(self.reserve_copy, self.rgb1_tuple, self.rgb2_tuple)
                 self.applyFilter(filter="2-Colored RGB (Bicubic)")
 
             elif self.filters_combobox.get() == "2-Colored RGB (Linear)":
-                self.original_image = linear_interpolation(self.reserve_copy, self.rgb1_tuple, self.rgb2_tuple)
                 self.applyFilter(filter="2-Colored RGB (Linear)")
 
         except TypeError:
@@ -968,11 +4636,9 @@ class DualTone:
             self.rgb2_frame.configure(bg=self.rgb2_tuple[1])
 
             if self.filters_combobox.get() == "2-Colored RGB (Bicubic)":
-                self.original_image = bicubic_interpolation(self.reserve_copy, self.rgb1_tuple, self.rgb2_tuple)
                 self.applyFilter(filter="2-Colored RGB (Bicubic)")
 
             elif self.filters_combobox.get() == "2-Colored RGB (Linear)":
-                self.original_image = linear_interpolation(self.reserve_copy, self.rgb1_tuple, self.rgb2_tuple)
                 self.applyFilter(filter="2-Colored RGB (Linear)")
 
         except TypeError:
@@ -994,6 +4660,196 @@ class DualTone:
             self.applyFilter(self.filters_combobox.get())
 
 
+    def loadLUT(self, *args):
+        "Loads 3D LUT from .cube file and applies it as a filter"
+
+        filename = askopenfilename(filetypes=[("Cube LUT files", "*.cube")], title="Load 3D LUT")
+
+        try:
+            self.lut = CubeLUT.load(filename) if filename else self.lut
+        except (OSError, ValueError):
+            mb.showerror("Error", "Can't open this 3D LUT file!")
+
+        # returns no filter if user clicks "Cancel" having not loaded any LUT before
+        filter = "3D LUT (.cube)" if self.lut is not None else "None"
+        self.filters_combobox.set(filter)
+        self.applyFilter(filter)
+
+
+    def exportLUT(self, size):
+        "Bakes current color filter, its colors, brightness and contrast into 3D LUT and saves it as .cube file"
+
+        filter = self.filters_combobox.get()
+        if filter != "None" and filter not in COLOR_FILTERS:
+            mb.showerror("Error", "Only color filters can be\n"
+                                  "exported as 3D LUT!")
+            return
+
+        filename = asksaveasfilename(filetypes=[("Cube LUT files", "*.cube")],
+                                     title="Export 3D LUT",
+                                     defaultextension=".cube")
+        if not filename:
+            return
+
+        brightness = int(self.bright_spinbox.get())
+        contrast = int(self.contrast_spinbox.get())
+
+        # contrast depends on mean gray level of image, it's taken from displayed image
+        gray = enhance_image(self.displayed_image_copy, brightness, 100).convert("L")
+        mean = int(ImageStat.Stat(gray).mean[0] + 0.5)
+
+        lut = CubeLUT.bake(filter, self.tint_color_tuple, self.rgb1_tuple, self.rgb2_tuple,
+                           brightness, contrast, mean, size, self.lut)
+        try:
+            lut.save(filename)
+        except OSError:
+            mb.showerror("Error!", "Can't save 3D LUT in this folder!")
+
+
+    def saveRecipe(self):
+        "Saves current filter, its colors, brightness, contrast, and 3D LUT path as JSON recipe"
+
+        filename = asksaveasfilename(filetypes=[("Recipe files", "*.json")],
+                                     title="Save Recipe",
+                                     defaultextension=".json")
+        if not filename:
+            return
+
+        recipe = Recipe(self.filters_combobox.get(),
+                        self.tint_color_tuple,
+                        self.rgb1_tuple,
+                        self.rgb2_tuple,
+                        int(self.bright_spinbox.get()),
+                        int(self.contrast_spinbox.get()),
+                        self.lut.filename if self.lut is not None else None)
+        try:
+            recipe.save(filename)
+        except OSError:
+            mb.showerror("Error!", "Can't save recipe in this folder!")
+
+
+    def loadRecipe(self):
+        "Loads JSON recipe and applies its filter, colors, brightness, and contrast to image"
+
+        filename = askopenfilename(filetypes=[("Recipe files", "*.json")], title="Load Recipe")
+        if not filename:
+            return
+
+        try:
+            recipe = Recipe.load(filename)
+            lut = CubeLUT.load(recipe.lut) if recipe.lut is not None else self.lut
+        except (OSError, ValueError):
+            mb.showerror("Error", "Can't open this recipe or its 3D LUT!")
+            return
+
+        if recipe.filter not in self.filters_combobox["values"]:
+            mb.showerror("Error", f"{recipe.filter} filter\n"
+                                  f"isn't available for this image!")
+            return
+
+        self.lut = lut
+        self.applyRecipe(recipe)
+
+
+    def applyRecipe(self, recipe):
+        "Sets filter, its colors, brightness, and contrast of recipe and applies them to image"
+
+        self.tint_color_tuple = recipe.tint_color
+        self.rgb1_tuple = recipe.color1
+        self.rgb2_tuple = recipe.color2
+        self.rgb_tint_color_frame.configure(bg=self.tint_color_tuple[1])
+        self.rgb1_frame.configure(bg=self.rgb1_tuple[1])
+        self.rgb2_frame.configure(bg=self.rgb2_tuple[1])
+        self.bright_var.set(recipe.brightness)
+        self.contrast_var.set(recipe.contrast)
+
+        self.filters_combobox.set(recipe.filter)
+        self.applyFilter(recipe.filter)
+
+
+    def contactSheet(self):
+        """Shows thumbnails of image with every filter, with several pairs of colors for 2-colored filter,
+        and with several values of brightness and contrast. Click on thumbnail applies its settings to image"""
+
+        brightness = int(self.bright_spinbox.get())
+        contrast = int(self.contrast_spinbox.get())
+        filter = self.filters_combobox.get()
+
+        def variant(filter=filter, color1=self.rgb1_tuple, color2=self.rgb2_tuple,
+                    brightness=brightness, contrast=contrast):
+            return Recipe(filter, self.tint_color_tuple, color1, color2, brightness, contrast)
+
+        # 3D LUT can be shown only if it's loaded, the last 9 thumbnails have current filter
+        recipes = [variant(f) for f in self.filters_combobox["values"] if f != "3D LUT (.cube)" or self.lut is not None]
+        recipes += [variant("2-Colored RGB (Linear)", color1, color2) for color1, color2 in TWO_TONE_PAIRS]
+        recipes += [variant(brightness=b, contrast=c) for b in (80, 100, 120) for c in (80, 100, 120)]
+
+        # downscaled image is taken from pipeline
+        thumbnails = contact_sheet(self.pipeline.fit((self.viewer_w, self.viewer_h)), recipes, lut=self.lut)
+
+        root = Toplevel()
+        root.title("Contact Sheet")
+        root.resizable(False, False)
+
+        # PhotoImages are kept by window, otherwise they are removed by garbage collector
+        root.photos = []
+        for i, (recipe, thumbnail) in enumerate(zip(recipes, thumbnails)):
+            if recipe.filter == "2-Colored RGB (Linear)":
+                caption = f"Linear {recipe.color1[1]} {recipe.color2[1]}"
+            else:
+                caption = recipe.filter
+            if i >= len(recipes) - 9:
+                caption += f"\nbrightness {recipe.brightness}%, contrast {recipe.contrast}%"
+
+            root.photos.append(ImageTk.PhotoImage(thumbnail))
+            label = Label(root, image=root.photos[-1], text=caption, compound="top", font="Helvetica 9")
+            label.grid(row=i // 8, column=i % 8, padx=2, pady=2)
+            label.bind("<Button-1>", lambda event, recipe=recipe: self.applyRecipe(recipe))
+
+
+    def autoLevels(self):
+        """Sets brightness and contrast which stretch levels of filtered image from black to white. Statistics of
+        filtered preview which aren't gathered yet are gathered by 2nd thread"""
+
+        pipeline = self.pipeline
+        statistics = pipeline.filtered_statistics(cached=True)
+        if statistics is not None:
+            self.setLevels(pipeline, statistics)
+            return
+
+        def statistics_flow():
+            try:
+                with self.preview_lock:
+                    statistics = pipeline.filtered_statistics()
+            except Exception as error:
+                call_in_ui(mb.showerror, "Error!", f"Can't find levels of this image:\n{error}")
+                return
+            if statistics is not None:
+                call_in_ui(self.setLevels, pipeline, statistics)
+
+        Thread(target=statistics_flow, daemon=True).start()
+
+
+    def setLevels(self, pipeline, statistics):
+        "Sets brightness and contrast suggested by statistics, unless another image has been opened meanwhile"
+
+        if pipeline is not self.pipeline:
+            return
+        brightness, contrast = statistics.levels()
+        self.bright_var.set(brightness)
+        self.contrast_var.set(contrast)
+        self.getBrightnessAndContrast()
+
+
+    def autoColors(self):
+        "Sets colors of shadows and highlights of image as colors of 2-colored RGB filter and applies it"
+
+        self.rgb1_tuple, self.rgb2_tuple = self.pipeline.statistics().endpoints()
+        self.rgb1_frame.configure(bg=self.rgb1_tuple[1])
+        self.rgb2_frame.configure(bg=self.rgb2_tuple[1])
+        self.filterFromMenu("2-Colored RGB (Linear)")
+
+
     def filterFromMenu(self, value):
         "Duplicates filters combobox, sets the same value both for combobox and menu"
         self.menu_var.set(value)
@@ -1012,6 +4868,11 @@ class DualTone:
         except AttributeError:
             return
 
+        # all frames of animated image or image sequence are saved in another way
+        if self.sequence is not None:
+            self.saveSequence()
+            return
+
         # checks if image is transparent and suggests two different extensions lists for each case
         if not has_transparency(self.original_image):
             ftypes = [
@@ -1046,155 +4907,159 @@ class DualTone:
         if not new_image_name:
             return
 
+        filter, colors, brightness, contrast, lut = self.renderSettings()
+        size = self.viewerSize()
+        image = self.reserve_copy
+        reduction = self.reduction
+        raw_image = self.raw_image if self.raw_image is not None and self.canRenderRaw(filter, new_image_name) else None
+        palette = self.original_clr_mode == "P" and has_transparency(self.original_image)
+
         def saving_flow():
             "Flow that is being executed along with progressbar"
-            new_image = self.reserve_copy
 
             # applies filter, brightness and contrast
-            filter = self.filters_combobox.get()
-
-            if filter == "Black and White":
-                new_image = ImageOps.grayscale(new_image)
 
-            elif filter == "Sepia":
-                new_image = RGB_filter(new_image, self.sepia)
-
-            elif filter == "Red":
-                new_image = RGB_filter(new_image, self.red)
+            # uncompressed images are processed band by band from one memory-mapped file to another one
+            if raw_image is not None:
+                try:
+                    render_raw(raw_image, new_image_name, filter, *colors, brightness, contrast, lut)
+                except OSError:
+                    call_in_ui(mb.showerror, "Error!", "Can't save image in this folder!")
+                    return
+                except MemoryError:
+                    call_in_ui(mb.showerror, "Error!", "There isn't enough memory to save this image!")
+                    return
+                metrics.count_image(raw_image)
+
+            elif reduction > 1:
+                call_in_ui(mb.showerror, "Error!", "This image is shown reduced because it doesn't fit memory,\n"
+                                                   "it can't be saved at full resolution!")
+                return
 
-            elif filter == "Overall Tint RGB Filter":
-                new_image = RGB_filter_custom_color(new_image, self.tint_color_tuple[0])
+            else:
+                # image is processed band by band if it doesn't fit memory budget as a whole
+                try:
+                    new_image = render_full(image, filter, *colors, brightness, contrast, lut)
+                except MemoryError:
+                    call_in_ui(mb.showerror, "Error!", "There isn't enough memory to save this image!")
+                    return
+
+                if palette:
+                    # saves transparent ico-files in RGBA mode
+                    if new_image_name.lower().endswith(".ico"):
+                        pass
+                    # returns P mode if it was original mode of transparent image
+                    else:
+                        new_image = new_image.convert("P")
 
-            elif filter == "2-Colored RGB (Bicubic)":
-                new_image = bicubic_interpolation(new_image, self.rgb1_tuple, self.rgb2_tuple)
+                # exception for a case if user can't save image in a chosen folder
+                try:
+                    with metrics.stage("encode"):
+                        convert_for_saving(new_image, new_image_name).save(new_image_name)
+                except:
+                    call_in_ui(mb.showerror, "Error!", "Can't save image in this folder!")
+                    return
+                metrics.count_image(new_image)
 
-            elif filter == "2-Colored RGB (Linear)":
-                new_image = linear_interpolation(new_image, self.rgb1_tuple, self.rgb2_tuple)
+            self.reloadImage(new_image_name, size)
 
-            elif filter == "Emboss":
-                new_image = new_image.filter(ImageFilter.EMBOSS)
+        ProgressbarFrame(self.root, saving_flow, "Saving your file, please wait...")
 
-            elif filter == "Blur":
-                new_image = new_image.filter(ImageFilter.BLUR)
 
-            elif filter == "Sharpen":
-                new_image = new_image.filter(ImageFilter.SHARPEN)
+    def exportDerivatives(self):
+        """Saves filtered image as full size PNG, 2048 px JPEG, WebP thumbnail and 256x256 ICO at once, filter is
+        applied once for all of them"""
 
-            elif filter == "Smooth":
-                new_image = new_image.filter(ImageFilter.SMOOTH)
+        if self.reduction > 1:
+            mb.showerror("Error!", "This image is shown reduced because it doesn't fit memory,\n"
+                                   "it can't be exported at full resolution!")
+            return
 
-            elif filter == "Mirror":
-                new_image = ImageOps.mirror(new_image)
+        new_image_name = asksaveasfilename(filetypes=[("All derivatives", "*")], title="Export Derivatives",
+                                           defaultextension="")
+        if not new_image_name:
+            return
+        root = os.path.splitext(new_image_name)[0]
 
-            elif filter == "Invert":
-                if not has_transparency(self.original_image):
-                    new_image = ImageOps.invert(new_image)
-                if has_transparency(self.original_image):
-                    new_image = invert_colors_rgba(new_image)
+        filter, colors, brightness, contrast, lut = self.renderSettings()
+        image = self.reserve_copy
 
-            elif filter == "Detail":
-                new_image = new_image.filter(ImageFilter.DETAIL)
+        def exporting_flow():
+            "Flow that is being executed along with progressbar"
 
-            elif filter == "Edge Enhance":
-                new_image = new_image.filter(ImageFilter.EDGE_ENHANCE)
+            try:
+                new_image = render_full(image, filter, *colors, brightness, contrast, lut)
+            except MemoryError:
+                call_in_ui(mb.showerror, "Error!", "There isn't enough memory to export this image!")
+                return
 
-            elif filter == "Contour #2":
-                new_image = new_image.convert("L").filter(ImageFilter.FIND_EDGES)
+            failed = export_derivatives(new_image, [(root + suffix + extension, size)
+                                                    for suffix, size, extension in DERIVATIVES])
+            if failed:
+                call_in_ui(mb.showerror, "Error!", "Can't save these files:\n" + "\n".join(failed))
 
-            elif filter == "Contour #1":
-                new_image = new_image.filter(ImageFilter.CONTOUR)
+        ProgressbarFrame(self.root, exporting_flow, "Exporting your files, please wait...")
 
-            elif filter == "Posterize 1 bit":
-                new_image = ImageOps.posterize(new_image, 1)
 
-            elif filter == "Posterize 2 bit":
-                new_image = ImageOps.posterize(new_image, 2)
+    def saveSequence(self):
+        "Saves all frames of animated image or image sequence applying color filter, brightness and contrast"
 
-            elif filter == "Posterize 3 bit":
-                new_image = ImageOps.posterize(new_image, 3)
+        ftypes = [
+            ("GIF files", "*.gif"),
+            ("WebP files", "*.webp"),
+            ("PNG files", "*.png"),
+        ]
 
-            elif filter == "Posterize 4 bit":
-                new_image = ImageOps.posterize(new_image, 4)
+        # numbered files can also be saved in any format of single images
+        if len(self.sequence.filenames) > 1:
+            ftypes += [("BMP files", "*.bmp"),
+                       ("TIF files", "*.tif"),
+                       ("TGA files", "*.tga"),
+                       ("JPG files (Lower Quality)", "*.jpg")]
 
-            brightness_rate = int(self.bright_spinbox.get()) * 0.01
-            contrast_rate = int(self.contrast_spinbox.get()) * 0.01
+        new_image_name = asksaveasfilename(filetypes=ftypes, title="Save All Frames", defaultextension="")
+        if not new_image_name:
+            return
 
-            if float(brightness_rate) != int(1):
-                brightness_enhancer = ImageEnhance.Brightness(new_image)
-                new_image = brightness_enhancer.enhance(float(brightness_rate))
+        # animated image is saved as one file, image sequence is saved as numbered files
+        if len(self.sequence.filenames) == 1 and not new_image_name.lower().endswith(FrameSequence.animated_extensions):
+            mb.showerror("Error", "Animated image can be saved\n"
+                                  "only as gif, webp, or png file!")
+            return
 
-            if float(contrast_rate) != int(1):
-                contrast_enhancer = ImageEnhance.Contrast(new_image)
-                new_image = contrast_enhancer.enhance(float(contrast_rate))
+        filter, colors, brightness, contrast, lut = self.renderSettings()
+        size = self.viewerSize()
+        frames = self.sequence
 
-            if self.original_clr_mode == "P" and has_transparency(self.original_image):
-                # saves transparent ico-files in RGBA mode
-                if new_image_name.lower().endswith(".ico"):
-                    pass
-                # returns P mode if it was original mode of transparent image
-                else:
-                    new_image = new_image.convert("P")
+        def sequence_flow():
+            "Flow that is being executed along with progressbar"
 
-            # exception for a case if user can't save image in a chosen folder
             try:
-                new_image.save(new_image_name)
-            except:
-                mb.showerror("Error!", "Can't save image in this folder!")
+                first_name = frames.save(new_image_name, filter, *colors, brightness, contrast, lut)
+            except (OSError, ValueError):
+                call_in_ui(mb.showerror, "Error!", "Can't save frames in this folder!")
                 return
 
-            # sets default settings
-            self.filters_combobox.set("None")
-            self.menu_var.set("None")
-            self.bright_var.set(self.default_spinbox_val)
-            self.contrast_var.set(self.default_spinbox_val)
-
-            # opens and displays new image with its new filter, brightness, and contrast. These lines of code are
-            # taken from displayImage method to being executed while Progressbar Window is shown for better user's
-            # experience
-            self.filename = new_image_name
-            self.original_image = Image.open(self.filename)
-
-            self.original_clr_mode = copy.deepcopy(self.original_image.mode)
-
-            # if opening image has "P" color mode, it will be converted to RGBA
-            if self.original_image.mode == "P" or "RGBX":
-                self.original_image = self.original_image.convert("RGBA")
+            # saved numbered files make new sequence, animated file is recognized when it's opened
+            sequence = None
+            if len(frames.filenames) > 1:
+                sequence = FrameSequence(FrameSequence.numbered(first_name))
 
-            # activates only filters available for RGBA
-            if has_transparency(self.original_image):
-                self.filters_combobox.configure(values=self.RGBA_filters)
-                for e in self.RGB_filters:
-                    if e in self.RGBA_filters:
-                        self.menu.entryconfig(e, state="active")
-                    else:
-                        self.menu.entryconfig(e, state="disabled")
-
-            # activates all filters for RGB
-            elif not has_transparency(self.original_image):
-                if self.original_image.mode != "RGB":
-                    self.original_image = self.original_image.convert("RGB")
-                self.filters_combobox.configure(values=self.RGB_filters)
-                for e in self.RGB_filters:
-                    self.menu.entryconfig(e, state="active")
+            self.reloadImage(first_name, size, sequence)
 
-            # gets reserve copy of image for next operations, with it file can be saved even if it's deleted from PC
-            self.reserve_copy = deepcopy(self.original_image)
+        ProgressbarFrame(self.root, sequence_flow, f"Saving {len(self.sequence)} frames, please wait...")
 
-            # converts reserve copy to numpy array for optimization
-            a = np.asarray(self.reserve_copy)
-            self.reserve_copy = Image.fromarray(a)
-
-            # sets default brightness and contrast values
-            self.menu_var.set("None")
-            self.filters_combobox.set("None")
-            self.bright_var.set(self.default_spinbox_val)
-            self.contrast_var.set(self.default_spinbox_val)
 
-            # continues displaying by fitting image to window size
-            self.resizeToFit()
-            self.configStatusbar()
+    def reloadImage(self, filename, size, sequence=None):
+        """Opens saved image and prepares its preview of given size in 2nd thread while Progressbar Window is shown
+        for better user's experience, then Tk thread displays it with default filter, brightness, and contrast"""
 
-        ProgressbarFrame(self.root, saving_flow, "Saving your file, please wait...")
+        image = Image.open(filename)
+        result = prepare_within_budget(filename, image, size)
+        if result is None:
+            call_in_ui(mb.showerror, "Error", "Image is saved, but there isn't enough memory to open it!")
+            return
+        call_in_ui(self.showOriginalImage, filename, image, *result, sequence)
 
 
     def saveCMYK(self, *args):
@@ -1208,6 +5073,11 @@ class DualTone:
         except AttributeError:
             return
 
+        if self.reduction > 1:
+            mb.showerror("Error!", "This image is shown reduced because it doesn't fit memory,\n"
+                                   "it can't be converted at full resolution!")
+            return
+
         if has_transparency(self.original_image):
             warning = mb.askyesno("Warning", "If you save your image as CMYK,\n"
                                              "its transparency will be lost.\n"
@@ -1229,128 +5099,32 @@ class DualTone:
         if not new_image_name:
             return
 
+        filter, colors, brightness, contrast, lut = self.renderSettings()
+        size = self.viewerSize()
+        image = self.reserve_copy
+
         def CMYK_flow():
             "Flow that is being executed along with Progressbar"
 
-            filter = self.filters_combobox.get()
-
-            new_image = self.reserve_copy
-
-            if filter == "Black and White":
-                new_image = ImageOps.grayscale(new_image)
-
-            elif filter == "Sepia":
-                new_image = RGB_filter(new_image, self.sepia)
-
-            elif filter == "Red":
-                new_image = RGB_filter(new_image, self.red)
-
-            elif filter == "Overall Tint RGB Filter":
-                new_image = RGB_filter_custom_color(new_image, self.tint_color_tuple[0])
-
-            elif filter == "2-Colored RGB (Bicubic)":
-                new_image = bicubic_interpolation(new_image, self.rgb1_tuple, self.rgb2_tuple)
-
-            elif filter == "2-Colored RGB (Linear)":
-                new_image = linear_interpolation(new_image, self.rgb1_tuple, self.rgb2_tuple)
-
-            elif filter == "Emboss":
-                new_image = new_image.filter(ImageFilter.EMBOSS)
-
-            elif filter == "Blur":
-                new_image = new_image.filter(ImageFilter.BLUR)
-
-            elif filter == "Sharpen":
-                new_image = new_image.filter(ImageFilter.SHARPEN)
-
-            elif filter == "Smooth":
-                new_image = new_image.filter(ImageFilter.SMOOTH)
-
-            elif filter == "Mirror":
-                new_image = ImageOps.mirror(new_image)
-
-            elif filter == "Invert":
-                new_image = ImageOps.invert(new_image)
-
-            elif filter == "Detail":
-                new_image = new_image.filter(ImageFilter.DETAIL)
-
-            elif filter == "Edge Enhance":
-                new_image = new_image.filter(ImageFilter.EDGE_ENHANCE)
-
-            elif filter == "Contour #2":
-                new_image = new_image.convert("L").filter(ImageFilter.FIND_EDGES)
-
-            elif filter == "Contour #1":
-                new_image = new_image.filter(ImageFilter.CONTOUR)
-
-            elif filter == "Posterize 1 bit":
-                new_image = ImageOps.posterize(new_image, 1)
-
-            elif filter == "Posterize 2 bit":
-                new_image = ImageOps.posterize(new_image, 2)
-
-            elif filter == "Posterize 3 bit":
-                new_image = ImageOps.posterize(new_image, 3)
-
-            elif filter == "Posterize 4 bit":
-                new_image = ImageOps.posterize(new_image, 4)
-
-            brightness_rate = int(self.bright_spinbox.get()) * 0.01
-            contrast_rate = int(self.contrast_spinbox.get()) * 0.01
-
-            if float(brightness_rate) != int(1):
-                brightness_enhancer = ImageEnhance.Brightness(new_image)
-                new_image = brightness_enhancer.enhance(float(brightness_rate))
-
-            if float(contrast_rate) != int(1):
-                contrast_enhancer = ImageEnhance.Contrast(new_image)
-                new_image = contrast_enhancer.enhance(float(contrast_rate))
+            try:
+                new_image = render_full(image, filter, *colors, brightness, contrast, lut)
+            except MemoryError:
+                call_in_ui(mb.showerror, "Error!", "There isn't enough memory to convert this image!")
+                return
 
             # exception if user can't save image in directory he or she chose
             try:
                 # converts RGB to CMYK and saves
-                new_image.convert("CMYK").save(new_image_name)
+                with metrics.stage("encode"):
+                    new_image.convert("CMYK").save(new_image_name)
             except:
-                mb.showerror("Error!", "Can't save image in this folder!")
+                call_in_ui(mb.showerror, "Error!", "Can't save image in this folder!")
                 return
+            metrics.count_image(new_image)
 
-            # sets default settings
-            self.filters_combobox.set("None")
-            self.menu_var.set("None")
-            self.bright_var.set(self.default_spinbox_val)
-            self.contrast_var.set(self.default_spinbox_val)
-
-            # Opens and displays new image with its new filter, brightness, and contrast. These lines of code are
-            # taken from displayImage method to being executed while Progressbar Window is shown
-            self.filename = new_image_name
-            self.original_image = Image.open(self.filename)
-            self.original_clr_mode = copy.deepcopy(self.original_image.mode)
-
-            # converts CMYK to RGB so that user could apply anothef filter again
-            self.original_image = self.original_image.convert("RGB")
-
-                # activates all filters for RGB
-            self.filters_combobox.configure(values=self.RGB_filters)
-            for e in self.RGB_filters:
-                self.menu.entryconfig(e, state="active")
-
-            # gets reserve copy of image for next operations, with it file can be saved even if it's deleted from PC
-            self.reserve_copy = deepcopy(self.original_image)
-
-            # converts reserve copy to numpy array for optimization
-            a = np.asarray(self.reserve_copy)
-            self.reserve_copy = Image.fromarray(a)
-
-            # sets default brightness and contrast values
-            self.menu_var.set("None")
-            self.filters_combobox.set("None")
-            self.bright_var.set(self.default_spinbox_val)
-            self.contrast_var.set(self.default_spinbox_val)
-
-            # continues displaying by fitting image to window size
-            self.resizeToFit()
-            self.configStatusbar()
+            # Opens and displays new image with its new filter, brightness, and contrast, CMYK is converted to RGB
+            # so that user could apply another filter again
+            self.reloadImage(new_image_name, size)
 
         ProgressbarFrame(self.root, CMYK_flow, "Converting to CMYK...")
 
@@ -1396,10 +5170,16 @@ class DualTone:
         elif self.original_size >= 1073741824:
             self.original_size = str(f"{round(self.original_size / 1073741824, 2)} Gb")
 
+        # number of frames is shown for animated images and image sequences
+        frames = f", frames: {len(self.sequence)}" if self.sequence is not None else ""
+
+        # image which doesn't fit memory is shown reduced
+        reduced = f", shown at 1/{self.reduction} to fit memory" if self.reduction > 1 else ""
+
         self.statusbar.config(text=f"{self.filename}; "
-                                   f"resolution: {self.original_image.width}x{self.original_image.height}, "
+                                   f"resolution: {self.resolution[0]}x{self.resolution[1]}{reduced}, "
                                    f"image size: {self.original_size}, "
-                                   f"original color mode: {self.original_clr_mode}")
+                                   f"original color mode: {self.original_clr_mode}{frames}")
 
     def showMenu(self, e):
         """Call of menu by clicking right mouse button"""
@@ -1413,12 +5193,51 @@ class DualTone:
         self.canv.height = event.height
         self.canv.config(width=self.canv.width, height=self.canv.height)
 
+        # current preview is scaled fast while window is being resized, image is fitted again when resizing stops
+        self.quickFit()
+        self.interact(self.resizeToFit)
+
+
+    def interact(self, redraw, delay=200):
+        """Marks that user is resizing window or scrubbing spinboxes, so images are resampled fast. Redraw is called
+        to resample them with LANCZOS once there is no input for delay milliseconds"""
+
+        self.interactive = True
+
         # Cancel the previous call, if there is one
-        if hasattr(self, "_after_id"):
-            self.canv.after_cancel(self._after_id)
+        if redraw in self.settling:
+            self.canv.after_cancel(self.settling[redraw])
+
+        def settle():
+            del self.settling[redraw]
+            self.interactive = bool(self.settling)
+            redraw()
+
+        self.settling[redraw] = self.canv.after(delay, settle)
+
+
+    def quickFit(self):
+        "Scales displayed image to window by BILINEAR resampling without fitting and filtering original image again"
 
-        # planning image update after 200 milliseconds (or other suitable delay)
-        self._after_id = self.canv.after(200, self.resizeToFit)
+        try:
+            image = self.displayed_image
+            scale = min(1, self.canv.width / self.reserve_copy.width,
+                        (self.canv.height - self.statusbar.winfo_height()) / self.reserve_copy.height)
+        except AttributeError:    # no image is open
+            return
+
+        # zoomed image is drawn by tiles, and before/after view is drawn when image is fitted again
+        size = (max(1, int(self.reserve_copy.width * scale)), max(1, int(self.reserve_copy.height * scale)))
+        if self.zoom is not None or self.split_var.get() or size == image.size:
+            return
+
+        self.displayed_image_2 = ImageTk.PhotoImage(image.resize(size, Resampling.BILINEAR, reducing_gap=2))
+        self.canv.delete("image")
+        self.canv.create_image(self.canv.width // 2,
+                               (self.canv.height - self.statusbar.winfo_height()) // 2,
+                               image=self.displayed_image_2,
+                               anchor="center",
+                               tag="image")
 
 
     def info(self, *args):
@@ -1498,4 +5317,51 @@ Payoneer: 7524440@gmail.com
 
 
 if __name__ == '__main__':
-    DualTone()
+    parser = argparse.ArgumentParser(description="DualTone image filters")
+    parser.add_argument("--serve", action="store_true", help="run local HTTP rendering service instead of window")
+    parser.add_argument("--host", default="127.0.0.1", help="address of HTTP service")
+    parser.add_argument("--port", type=int, default=8000, help="port of HTTP service")
+    parser.add_argument("--workers", type=int, default=None, help="number of rendering threads")
+    parser.add_argument("--recipe", help="render files by JSON recipe saved in window")
+    parser.add_argument("--output", default="output", help="folder for files rendered by recipe")
+    parser.add_argument("--extension", help="new extension of rendered files, e.g. .webp")
+    parser.add_argument("--size", type=int, help="size of thumbnails rendered by recipe instead of its size")
+    parser.add_argument("--auto-levels", action="store_true", help="suggest brightness and contrast for each file")
+    parser.add_argument("--auto-colors", action="store_true", help="suggest colors of 2-colored filters for each file")
+    parser.add_argument("--watch", metavar="FOLDER", help="render images dropped into folder by recipe")
+    parser.add_argument("--backend", default="auto", choices=["auto"] + list(BACKENDS),
+                        help="compute backend of filters, auto uses Numba if it's installed")
+    parser.add_argument("--metrics", help="write metrics to .prom file as Prometheus text or to other file as JSON lines")
+    parser.add_argument("--memory-limit", type=int, metavar="MB",
+                        help="memory which app may take, larger images are processed band by band; by default it's "
+                             "taken from available RAM")
+    parser.add_argument("files", nargs="*", help="files to render by recipe")
+    args = parser.parse_args()
+
+    select_backend(args.backend)
+    if args.memory_limit:
+        memory_budget.limit = args.memory_limit << 20
+
+    # service always collects metrics for its /metrics endpoint
+    if args.metrics or args.serve:
+        metrics.enable(args.metrics)
+
+    if args.serve:
+        RenderService(args.host, args.port, args.workers).run()
+    elif args.recipe:
+        recipe = Recipe.load(args.recipe)
+        recipe.size = args.size or recipe.size
+        recipe.auto_levels = args.auto_levels or recipe.auto_levels
+        recipe.auto_colors = args.auto_colors or recipe.auto_colors
+        if args.watch:
+            try:
+                WatchFolder(recipe, args.watch, args.output, args.extension, args.workers).run()
+            except KeyboardInterrupt:
+                pass
+        else:
+            rendered, skipped, failed = run_recipe(recipe, args.files, args.output, args.extension, args.workers)
+            print(f"{rendered} files rendered, {skipped} files skipped")
+            for filename, error in failed:
+                print(f"Can't render {filename} ({error})")
+    else:
+        DualTone()
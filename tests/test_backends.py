@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+import DualTone
+
+COLORS = (((0, 0, 0), "#000000"), ((255, 255, 255), "#ffffff"), ((20, 200, 90), "#14c85a"),
+          ((250, 30, 160), "#fa1ea0"))
+
+# Sepia and Red run by matrix kernel. Numba compiler may fuse its multiplications and additions, so a few levels are
+# rounded to the other side: about 70 of 1.35M Sepia pixels differed by 1 level on one machine. Other kernels are
+# integer table lookups or float32 math done in the same order, so they must be equal
+TOLERANCES = {"Sepia": 1, "Red": 1}
+
+
+@pytest.fixture(scope="module")
+def backends():
+    pytest.importorskip("numba")
+    return DualTone.NumpyBackend(), DualTone.NumbaBackend()
+
+
+class PythonBackend(DualTone.NumbaBackend):
+    "Numba backend running its kernels as plain Python functions, so kernel logic is tested without Numba"
+
+    name = "python"
+
+    def __init__(self):
+        self.matrix_kernel = DualTone.matrix_kernel
+        self.table_kernel = DualTone.table_kernel
+        self.lut_kernel = DualTone.lut_kernel
+
+
+@pytest.fixture(params=(3, 4), ids=("RGB", "RGBA"))
+def images(request):
+    return np.random.default_rng(0).integers(0, 256, (2, 300, 400, request.param), dtype=np.uint8)
+
+
+def filter_by(backend, images, filter, color1=DualTone.DEFAULT_RGB1, color2=DualTone.DEFAULT_RGB2):
+    current, DualTone.backend = DualTone.backend, backend
+    try:
+        return DualTone.filter_batch(images, filter, DualTone.DEFAULT_TINT_COLOR, color1, color2)
+    finally:
+        DualTone.backend = current
+
+
+@pytest.mark.parametrize("filter", DualTone.BATCH_FILTERS)
+def test_filters_match_numpy(backends, images, filter):
+    reference, numba = backends
+    # equal colors make division by zero in linear filter, window warns about them
+    pairs = [(color1, color2) for color1 in COLORS for color2 in COLORS if color1 != color2]
+    for color1, color2 in pairs:
+        expected = filter_by(reference, images, filter, color1, color2)
+        result = filter_by(numba, images, filter, color1, color2)
+        assert DualTone.same_results(result, expected, TOLERANCES.get(filter, 0)), (color1, color2)
+
+
+def test_lut_matches_numpy(backends, images):
+    reference, numba = backends
+    lut = DualTone.CubeLUT(np.random.default_rng(1).random((17, 17, 17, 3)))
+    assert np.array_equal(numba.lut(lut, images), reference.lut(lut, images))
+
+
+def test_numba_backend_passes_check(backends):
+    assert DualTone.check_backend(backends[1])
+
+
+def test_python_kernels_pass_check():
+    assert DualTone.check_backend(PythonBackend())
+
+
+def test_missing_backend_falls_back_to_numpy(monkeypatch):
+    def broken():
+        raise ImportError("No module named 'numba'")
+
+    monkeypatch.setitem(DualTone.BACKENDS, "numba", broken)
+    assert isinstance(DualTone.create_backend("auto"), DualTone.NumpyBackend)
+    assert isinstance(DualTone.create_backend("numba"), DualTone.NumpyBackend)
+    assert isinstance(DualTone.create_backend("unknown"), DualTone.NumpyBackend)
+
+
+def test_backend_differing_from_numpy_is_rejected(monkeypatch):
+    class WrongBackend(DualTone.NumpyBackend):
+        def lut(self, lut, images):
+            return images
+
+    monkeypatch.setitem(DualTone.BACKENDS, "numba", WrongBackend)
+    assert type(DualTone.create_backend("auto")) is DualTone.NumpyBackend
+
+
+def test_select_backend_creates_it_on_first_use(monkeypatch):
+    monkeypatch.setattr(DualTone, "backend", None)
+    monkeypatch.setattr(DualTone, "backend_name", "auto")
+    DualTone.select_backend("numpy")
+    assert DualTone.backend is None
+    assert DualTone.get_backend().name == "numpy"
+    assert DualTone.get_backend() is DualTone.get_backend()
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import DualTone
+
+
+def random_color(rng):
+    color = tuple(int(value) for value in rng.integers(0, 256, 3))
+    return color, "#%02x%02x%02x" % color
+
+
+@pytest.mark.parametrize("channels", (3, 4), ids=("RGB", "RGBA"))
+@pytest.mark.parametrize("filter", DualTone.BATCH_FILTERS)
+def test_filter_batch_equals_filter_image(filter, channels):
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (3, 40, 50, channels), dtype=np.uint8)
+    mode = "RGBA" if channels == 4 else "RGB"
+    for colors in ((DualTone.DEFAULT_TINT_COLOR, DualTone.DEFAULT_RGB1, DualTone.DEFAULT_RGB2),
+                   (random_color(rng), random_color(rng), random_color(rng))):
+        result = DualTone.filter_batch(images, filter, *colors)
+        expected = np.stack([np.asarray(DualTone.filter_image(Image.fromarray(image, mode), filter, *colors))
+                             for image in images])
+        assert np.array_equal(result, expected), colors
+
+
+@pytest.mark.parametrize("channels", (3, 4))
+@pytest.mark.parametrize("filter", DualTone.BATCH_FILTERS)
+def test_filter_variants_equal_filter_batch(filter, channels):
+    rng = np.random.default_rng(1)
+    image = rng.integers(0, 256, (40, 50, channels), dtype=np.uint8)
+    colors = [(random_color(rng), random_color(rng), random_color(rng)) for i in range(8)]
+    colors.append((DualTone.DEFAULT_TINT_COLOR, DualTone.DEFAULT_RGB1, DualTone.DEFAULT_RGB2))
+
+    variants = DualTone.filter_variants(image, filter, colors)
+    expected = np.stack([DualTone.filter_batch(image[np.newaxis], filter, *color)[0] for color in colors])
+    assert variants.shape == expected.shape
+    assert np.array_equal(variants, expected)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import DualTone
+
+LUT = DualTone.CubeLUT(np.random.default_rng(2).random((5, 5, 5, 3)))
+
+
+def source_images():
+    "Returns 120 x 100 images of every mode which filters take, the last rows don't fill a whole band"
+
+    rng = np.random.default_rng(0)
+    rgba = Image.fromarray(rng.integers(0, 256, (100, 120, 4), dtype=np.uint8), "RGBA")
+    transparent = rgba.quantize(16)
+    transparent.info["transparency"] = 3
+    return {"RGB": rgba.convert("RGB"),
+            "RGBA": rgba,
+            "L": rgba.convert("L"),
+            "P": rgba.convert("RGB").quantize(16),
+            "P with transparency": transparent}
+
+
+def rendered_whole(image, filter, brightness, contrast):
+    new_image = DualTone.filter_image(image, filter, lut=LUT)
+    return DualTone.enhance_image(new_image, brightness, contrast)
+
+
+def pixels(image):
+    "Returns RGBA pixels, transparency which filters copy from info of palette source isn't taken for L image"
+
+    image = image.copy()
+    if image.mode != "P":
+        image.info.pop("transparency", None)
+    return np.asarray(image.convert("RGBA"))
+
+
+@pytest.fixture
+def bands(monkeypatch):
+    "Makes render_full process images by bands of 37 rows, palette filters of P and L images never use bands"
+
+    def plan(size, mode, filter, *args, **kwargs):
+        return "whole" if DualTone.keeps_palette(mode, filter) else 37
+
+    monkeypatch.setattr(DualTone.memory_budget, "plan", plan)
+
+
+@pytest.mark.parametrize("levels", ((100, 100), (120, 100), (90, 140)), ids=("plain", "brightness", "contrast"))
+@pytest.mark.parametrize("filter", DualTone.FILTERS)
+@pytest.mark.parametrize("mode", source_images())
+def test_bands_equal_whole_image(bands, mode, filter, levels):
+    image = source_images()[mode]
+    try:
+        expected = rendered_whole(image, filter, *levels)
+    except OSError:
+        # PIL can't posterize RGBA images, bands must fail the same way
+        with pytest.raises(OSError):
+            DualTone.render_full(image, filter, brightness=levels[0], contrast=levels[1], lut=LUT)
+        return
+    result = DualTone.render_full(image, filter, brightness=levels[0], contrast=levels[1], lut=LUT)
+    assert result.size == image.size
+    assert np.array_equal(pixels(result), pixels(expected))
+
+
+def budget_with_free(monkeypatch, free):
+    budget = DualTone.MemoryBudget()
+    monkeypatch.setattr(budget, "free", lambda: free)
+    return budget
+
+
+def test_plan_processes_whole_image_if_it_fits(monkeypatch):
+    budget = budget_with_free(monkeypatch, 1 << 30)
+    assert budget.plan((1000, 1000), "RGB", "Sepia", 120, 130) == "whole"
+
+
+def test_plan_lowers_bands_to_fit_budget(monkeypatch):
+    new, temporary = DualTone.footprint("RGB", "Sepia")
+    row = 1000 * (new + temporary + 6)
+    budget = budget_with_free(monkeypatch, 1000 * 1000 * new + 101 * row)
+    assert budget.plan((1000, 1000), "RGB", "Sepia") == 101
+    assert budget.plan((1000, 1000), "RGB", "Sepia", band_height=64) == 64
+
+
+def test_plan_gives_up_if_one_row_doesnt_fit(monkeypatch):
+    new, temporary = DualTone.footprint("RGB", "Sepia")
+    budget = budget_with_free(monkeypatch, 1000 * 1000 * new + 1000 * (new + temporary))
+    assert budget.plan((1000, 1000), "RGB", "Sepia") is None
+
+
+def test_render_full_raises_memory_error_if_one_row_doesnt_fit(monkeypatch):
+    monkeypatch.setattr(DualTone.memory_budget, "free", lambda: 0)
+    with pytest.raises(MemoryError):
+        DualTone.render_full(source_images()["RGB"], "Sepia")
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import DualTone
+
+LUT = DualTone.CubeLUT(np.random.default_rng(2).random((5, 5, 5, 3)))
+
+# PIL can't posterize RGBA images
+RGBA_FILTERS = [filter for filter in DualTone.FILTERS if not filter.startswith("Posterize")]
+
+
+def transparent_images():
+    "Returns RGBA images with transparent margins, transparent pixels inside the box and hidden colors"
+
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (60, 80, 4), dtype=np.uint8)
+    pixels[:, :, 3] = np.maximum(pixels[:, :, 3], 1)
+    margins = pixels.copy()
+    margins[:15] = margins[:, :20] = 0
+
+    sparse = margins.copy()
+    sparse[rng.random((60, 80)) < 0.8] = 0
+
+    colored = sparse.copy()
+    colored[colored[:, :, 3] == 0] = (200, 40, 90, 0)
+
+    mixed = sparse.copy()
+    mixed[:5, :, :3] = rng.integers(0, 256, (5, 80, 3), dtype=np.uint8)
+
+    empty = np.zeros_like(pixels)
+    empty[:, :, :3] = (10, 20, 30)
+    return {name: Image.fromarray(array, "RGBA") for name, array in
+            (("margins", margins), ("sparse", sparse), ("colored", colored), ("mixed", mixed), ("empty", empty))}
+
+
+@pytest.mark.parametrize("levels", ((100, 100), (110, 150)), ids=("plain", "contrast"))
+@pytest.mark.parametrize("filter", RGBA_FILTERS)
+@pytest.mark.parametrize("name", transparent_images())
+def test_skipping_transparent_pixels_equals_pixel_path(name, filter, levels):
+    image = transparent_images()[name]
+    result = DualTone.filter_image(image, filter, lut=LUT)
+    expected = DualTone.filter_image(image, filter, lut=LUT, skip_transparent=False)
+    assert result.mode == expected.mode
+    assert np.array_equal(np.asarray(DualTone.enhance_image(result, *levels)),
+                          np.asarray(DualTone.enhance_image(expected, *levels)))
+
+
+def palette_images():
+    "Returns P images with and without transparency and grayscale image, the pixel path filters their RGB copies"
+
+    rgba = Image.fromarray(np.random.default_rng(3).integers(0, 256, (50, 70, 4), dtype=np.uint8), "RGBA")
+    transparent = rgba.quantize(32)
+    transparent.info["transparency"] = 5
+    return {"P": rgba.convert("RGB").quantize(32),
+            "P with transparency": transparent,
+            "P with RGBA palette": rgba.quantize(32, method=Image.Quantize.FASTOCTREE),
+            "L": rgba.convert("L")}
+
+
+def pixel_path(image, filter):
+    "Filters every pixel of RGB or RGBA copy of image, fast paths are turned off"
+
+    mode = "RGBA" if DualTone.has_transparency(image) else "RGB"
+    if mode == "RGBA" and filter.startswith("Posterize"):
+        pytest.skip("PIL can't posterize RGBA images")
+    return DualTone.filter_image(image.convert(mode), filter, lut=LUT, max_colors=0, skip_transparent=False)
+
+
+@pytest.mark.parametrize("filter", DualTone.COLOR_FILTERS)
+@pytest.mark.parametrize("name", palette_images())
+def test_palette_filtering_equals_pixel_path(name, filter):
+    image = palette_images()[name]
+    expected = pixel_path(image, filter)
+    result = DualTone.filter_image(image, filter, lut=LUT)
+    assert np.array_equal(np.asarray(result.convert(expected.mode)), np.asarray(expected))
+
+
+def low_color_images():
+    "Returns RGB and RGBA images with 40 colors, alpha of RGBA image isn't one for each color"
+
+    rng = np.random.default_rng(4)
+    palette = rng.integers(0, 256, (40, 4), dtype=np.uint8)
+    pixels = palette[rng.integers(0, 40, (50, 70))]
+    pixels[:, :, 3] = rng.integers(1, 256, (50, 70))
+    return {"RGB": Image.fromarray(np.ascontiguousarray(pixels[:, :, :3]), "RGB"),
+            "RGBA": Image.fromarray(pixels, "RGBA")}
+
+
+@pytest.fixture(params=("table", "search"))
+def color_table(request, monkeypatch):
+    "Finds new colors by shared lookup table or by binary search if the table doesn't fit memory budget"
+
+    monkeypatch.setattr(DualTone.color_table, "table", None)
+    if request.param == "search":
+        monkeypatch.setattr(DualTone.color_table, "nbytes", 1 << 62)
+        monkeypatch.setattr(DualTone.memory_budget, "free", lambda: 1 << 30)
+
+
+@pytest.mark.parametrize("filter", DualTone.COLOR_FILTERS)
+@pytest.mark.parametrize("mode", ("RGB", "RGBA"))
+def test_unique_colors_filtering_equals_pixel_path(color_table, mode, filter):
+    image = low_color_images()[mode]
+    expected = pixel_path(image, filter)
+    result = DualTone.filter_image(image, filter, lut=LUT, skip_transparent=False)
+    assert result.mode == expected.mode
+    assert np.array_equal(np.asarray(result), np.asarray(expected))
+    if filter in DualTone.UNIQUE_COLORS_FILTERS and not (mode == "RGBA" and "Bicubic" in filter):
+        assert DualTone.filter_unique_colors(image, filter, lut=LUT) is not None
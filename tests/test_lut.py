@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import DualTone
+
+
+def write_cube(tmp_path, text):
+    filename = tmp_path / "test.cube"
+    filename.write_text(text)
+    return str(filename)
+
+
+def cube_rows(size):
+    "Returns identity table rows, red changes fastest"
+
+    levels = np.linspace(0, 1, size)
+    return "".join(f"{r} {g} {b}\n" for b in levels for g in levels for r in levels)
+
+
+def test_save_load_round_trip(tmp_path):
+    lut = DualTone.CubeLUT(np.random.default_rng(0).random((5, 5, 5, 3)), "Test", (0, 0.1, 0), (1, 0.9, 2))
+    filename = str(tmp_path / "test.cube")
+    lut.save(filename)
+
+    loaded = DualTone.CubeLUT.load(filename)
+    assert loaded.title == "Test"
+    assert loaded.filename == filename
+    assert np.allclose(loaded.table, lut.table, atol=1e-6)
+    assert np.allclose(loaded.domain_min, lut.domain_min) and np.allclose(loaded.domain_max, lut.domain_max)
+
+
+def test_load_reads_keywords_and_comments(tmp_path):
+    filename = write_cube(tmp_path, '# comment\nTITLE "Warm look"\n\nLUT_3D_SIZE 2\n'
+                                    'DOMAIN_MIN 0 0 0\nDOMAIN_MAX 1 1 2\nLUT_IN_VIDEO_RANGE\n' + cube_rows(2))
+    lut = DualTone.CubeLUT.load(filename)
+    assert lut.title == "Warm look"
+    assert lut.table.shape == (2, 2, 2, 3)
+    # table is indexed by blue, green, and red
+    assert np.array_equal(lut.table[0, 0, 1], [1, 0, 0])
+    assert np.array_equal(lut.table[1, 0, 0], [0, 0, 1])
+    assert np.array_equal(lut.domain_max, [1, 1, 2])
+
+
+def test_load_reads_input_range(tmp_path):
+    lut = DualTone.CubeLUT.load(write_cube(tmp_path, "LUT_3D_SIZE 2\nLUT_3D_INPUT_RANGE 0.5 2\n" + cube_rows(2)))
+    assert np.array_equal(lut.domain_min, [0.5] * 3)
+    assert np.array_equal(lut.domain_max, [2] * 3)
+
+
+@pytest.mark.parametrize("text", ("LUT_3D_SIZE 3\n" + cube_rows(2),
+                                  "LUT_3D_SIZE 2\n" + cube_rows(2) + "0 0 0\n",
+                                  cube_rows(2),
+                                  "LUT_1D_SIZE 2\n0 0 0\n1 1 1\n",
+                                  "LUT_3D_SIZE 2\nDOMAIN_MIN 0 0 0\nDOMAIN_MAX 1 0 1\n" + cube_rows(2),
+                                  "LUT_3D_SIZE 2\nLUT_3D_INPUT_RANGE 1 1\n" + cube_rows(2)),
+                         ids=("too few rows", "too many rows", "no size", "1D LUT", "empty domain", "empty range"))
+def test_load_rejects_wrong_files(tmp_path, text):
+    with pytest.raises(ValueError):
+        DualTone.CubeLUT.load(write_cube(tmp_path, text))
+
+
+def test_identity_lut_keeps_colors(tmp_path):
+    lut = DualTone.CubeLUT.load(write_cube(tmp_path, "LUT_3D_SIZE 17\n" + cube_rows(17)))
+    images = np.random.default_rng(1).integers(0, 256, (1, 20, 30, 4), dtype=np.uint8)
+    assert np.array_equal(lut.apply_batch(images), images)
+
+
+@pytest.mark.parametrize("filter", ("Sepia", "2-Colored RGB (Linear)", "Invert"))
+def test_baked_lut_is_close_to_filter(filter):
+    lut = DualTone.CubeLUT.bake(filter, brightness=110)
+    image = np.random.default_rng(2).integers(0, 256, (40, 50, 3), dtype=np.uint8)
+    expected = DualTone.enhance_image(DualTone.filter_image(Image.fromarray(image), filter), 110, 100)
+    difference = np.abs(lut.apply_batch(image[np.newaxis])[0].astype(int) - np.asarray(expected))
+    assert difference.max() <= 8
@@ -0,0 +1,41 @@
+import threading
+
+from PIL import Image
+
+import DualTone
+
+
+def test_running_prefetch_is_waited_for(tmp_path, monkeypatch):
+    filename = str(tmp_path / "a.png")
+    Image.new("RGB", (40, 30), (200, 100, 50)).save(filename)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    open_for_preview = DualTone.open_for_preview
+
+    def blocked_open_for_preview(*args):
+        calls.append(args)
+        started.set()
+        release.wait(10)
+        return open_for_preview(*args)
+
+    monkeypatch.setattr(DualTone, "open_for_preview", blocked_open_for_preview)
+    prefetcher = DualTone.Prefetcher(workers=1)
+    prefetcher.prefetch([filename], (20, 20))
+    assert started.wait(10)
+
+    # window doesn't wait on Tk thread, but sees that worker opens the file
+    assert prefetcher.get(filename, timeout=0) is None
+    assert prefetcher.opening(filename)
+
+    release.set()
+    result = prefetcher.get(filename)
+    assert result is not None and result[1].size == (40, 30)
+    assert len(calls) == 1 and not prefetcher.cache.items
+
+
+def test_cache_limit_follows_memory_budget(monkeypatch):
+    prefetcher = DualTone.Prefetcher(cache_bytes=1 << 30)
+    monkeypatch.setattr(DualTone.memory_budget, "free", lambda: 1 << 20)
+    assert prefetcher.limit() == 1 << 18
+    monkeypatch.setattr(DualTone.memory_budget, "free", lambda: None)
+    assert prefetcher.limit() == 1 << 30
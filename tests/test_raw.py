@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import DualTone
+
+WRITABLE = [(extension, mode) for extension, modes in DualTone.RawImage.writable.items() for mode in modes]
+
+
+def source_image(mode, width=45, height=31):
+    "Returns image whose width makes bmp rows padded and whose height doesn't fill a whole band"
+
+    rgba = Image.fromarray(np.random.default_rng(0).integers(0, 256, (height, width, 4), dtype=np.uint8), "RGBA")
+    return rgba.convert(mode)
+
+
+@pytest.mark.parametrize("extension, mode", WRITABLE)
+def test_created_image_is_read_by_pil(tmp_path, extension, mode):
+    filename = str(tmp_path / ("new" + extension))
+    image = source_image(mode)
+    raw_image = DualTone.RawImage.create(filename, image.size, mode).open()
+    raw_image.write_band(0, np.asarray(image))
+    raw_image.close()
+
+    with Image.open(filename) as saved:
+        assert saved.mode == mode
+        assert np.array_equal(np.asarray(saved), np.asarray(image))
+
+
+@pytest.mark.parametrize("filter", ("Sepia", "Blur", "Black and White"))
+@pytest.mark.parametrize("extension, mode", WRITABLE)
+def test_render_raw_equals_render_full(tmp_path, extension, mode, filter):
+    source = str(tmp_path / ("source" + extension))
+    target = str(tmp_path / ("target" + extension))
+    image = source_image(mode)
+    image.save(source)
+
+    DualTone.render_raw(DualTone.RawImage(source), target, filter, DualTone.DEFAULT_TINT_COLOR,
+                        DualTone.DEFAULT_RGB1, DualTone.DEFAULT_RGB2, 120, 130, band_height=8)
+    expected = DualTone.render_full(image, filter, brightness=120, contrast=130)
+    with Image.open(target) as rendered:
+        # grayscale image colored by palette is kept as P image in memory, file gets its RGB colors
+        assert rendered.mode == DualTone.filtered_mode(mode, filter)
+        assert np.array_equal(np.asarray(rendered), np.asarray(expected.convert(rendered.mode)))
+
+
+@pytest.mark.parametrize("extension", (".bmp", ".tga", ".ppm"))
+@pytest.mark.parametrize("factor", (2, 3, 4))
+def test_reduce_raw_equals_reduce(tmp_path, extension, factor):
+    filename = str(tmp_path / ("source" + extension))
+    image = source_image("RGB")
+    image.save(filename)
+
+    raw_image = DualTone.RawImage(filename).open()
+    try:
+        reduced = DualTone.reduce_raw(raw_image, factor, band_height=7)
+    finally:
+        raw_image.close()
+    assert np.array_equal(np.asarray(reduced), np.asarray(image.reduce(factor)))
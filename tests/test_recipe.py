@@ -0,0 +1,149 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import DualTone
+
+
+def write_recipe(tmp_path, **params):
+    filename = tmp_path / "recipe.json"
+    filename.write_text(json.dumps(params))
+    return str(filename)
+
+
+def test_load_round_trip(tmp_path):
+    recipe = DualTone.Recipe("2-Colored RGB (Linear)", brightness=120, size=256)
+    filename = str(tmp_path / "recipe.json")
+    recipe.save(filename)
+    assert DualTone.Recipe.load(filename).to_dict() == recipe.to_dict()
+
+
+@pytest.mark.parametrize("params", ({"filter": "Unknown"},
+                                    {"filter": "3D LUT (.cube)"},
+                                    {"tint": "not a color"},
+                                    {"brightness": [100]}))
+def test_load_rejects_wrong_parameters(tmp_path, params):
+    with pytest.raises(ValueError):
+        DualTone.Recipe.load(write_recipe(tmp_path, **params))
+
+
+def write_image(filename, color):
+    Image.new("RGB", (8, 6), color).save(filename)
+
+
+def test_run_recipe_skips_unchanged_files(tmp_path):
+    source, output = tmp_path / "source", tmp_path / "output"
+    source.mkdir()
+    write_image(source / "a.png", (200, 100, 50))
+    write_image(source / "b.png", (10, 20, 30))
+    filenames = sorted(str(filename) for filename in source.iterdir())
+    recipe = DualTone.Recipe("Sepia")
+
+    assert DualTone.run_recipe(recipe, filenames, str(output), source_folder=str(source)) == (2, 0, [])
+    assert DualTone.run_recipe(recipe, filenames, str(output), source_folder=str(source)) == (0, 2, [])
+
+    # changed source and changed recipe are rendered again
+    write_image(source / "b.png", (30, 20, 10))
+    assert DualTone.run_recipe(recipe, filenames, str(output), source_folder=str(source)) == (1, 1, [])
+    recipe.brightness = 120
+    assert DualTone.run_recipe(recipe, filenames, str(output), source_folder=str(source)) == (2, 0, [])
+
+
+def test_run_recipe_keys_manifest_by_source_path(tmp_path):
+    source, output = tmp_path / "source", tmp_path / "output"
+    source.mkdir()
+    write_image(source / "a.png", (200, 100, 50))
+    write_image(source / "a.bmp", (10, 20, 30))
+    filenames = sorted(str(filename) for filename in source.iterdir())
+    recipe = DualTone.Recipe("Sepia")
+
+    DualTone.run_recipe(recipe, filenames, str(output), ".png", source_folder=str(source))
+    manifest = json.loads((output / "dualtone_manifest.json").read_text())
+    assert sorted(manifest) == ["a.bmp", "a.png"]
+    assert manifest["a.bmp"]["source"] != manifest["a.png"]["source"]
+
+
+def test_watch_folder_renders_changed_files_once(tmp_path):
+    source, output = tmp_path / "source", tmp_path / "output"
+    source.mkdir()
+    watcher = DualTone.WatchFolder(DualTone.Recipe("Sepia"), str(source), str(output), settle=0, use_inotify=False)
+
+    def poll():
+        ready = watcher.scan()
+        return watcher.render(ready) if ready else None
+
+    # file is ready when its size and time haven't changed since the previous poll
+    write_image(source / "a.png", (200, 100, 50))
+    assert poll() is None
+    assert poll() == (1, 0, [])
+    assert poll() is None
+    assert (output / "a.png").exists()
+
+    # rewritten file is rendered again
+    write_image(source / "a.png", (10, 20, 30))
+    os.utime(source / "a.png", ns=(0, os.stat(source / "a.png").st_mtime_ns + 10 ** 9))
+    assert poll() is None
+    assert poll() == (1, 0, [])
+    assert poll() is None
+
+    # damaged file isn't tried again until it changes, deleted files are forgotten
+    (source / "b.png").write_bytes(b"not an image")
+    assert poll() is None
+    rendered, skipped, failed = poll()
+    assert (rendered, skipped) == (0, 0) and [key for key, error in failed] == ["b.png"]
+    assert poll() is None
+    os.remove(source / "a.png")
+    os.remove(source / "b.png")
+    assert poll() is None
+    assert not watcher.done and not watcher.changes
+
+
+def test_watch_folder_waits_for_settle_unless_file_is_closed(tmp_path):
+    source, output = tmp_path / "source", tmp_path / "output"
+    source.mkdir()
+    watcher = DualTone.WatchFolder(DualTone.Recipe("Sepia"), str(source), str(output), settle=60,
+                                   use_inotify=False)
+
+    write_image(source / "a.png", (200, 100, 50))
+    write_image(source / "b.png", (10, 20, 30))
+    assert watcher.scan() == []
+    assert watcher.scan() == []
+
+    # inotify saw the file closed after writing, so it's ready at once
+    watcher.closed.add(str(source / "b.png"))
+    assert watcher.scan() == [str(source / "b.png")]
+
+
+def test_render_filters_image_once_with_automatic_colors_and_levels(monkeypatch):
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (60, 80, 3), dtype=np.uint8))
+    recipe = DualTone.Recipe("2-Colored RGB (Linear)", size=40, auto_levels=True, auto_colors=True)
+    calls = []
+    render_full = DualTone.render_full
+    monkeypatch.setattr(DualTone, "render_full", lambda *args, **kwargs: calls.append(args) or
+                        render_full(*args, **kwargs))
+
+    new_image = recipe.render(image)
+    assert len(calls) == 1 and new_image.size == (40, 30)
+
+    fitted = DualTone.load_image(image.copy(), 40)
+    color1, color2 = DualTone.ImageStatistics(fitted).endpoints()
+    filtered = DualTone.filter_image(fitted, recipe.filter, color1=color1, color2=color2)
+    expected = DualTone.enhance_image(filtered, *DualTone.ImageStatistics(filtered).levels())
+    assert np.array_equal(np.asarray(new_image), np.asarray(expected))
+
+
+def test_moved_recipe_finds_its_lut(tmp_path):
+    folder = tmp_path / "recipes"
+    (folder / "luts").mkdir(parents=True)
+    lut = str(folder / "luts" / "warm.cube")
+    DualTone.CubeLUT(np.random.default_rng(0).random((2, 2, 2, 3))).save(lut)
+    DualTone.Recipe("3D LUT (.cube)", lut=lut).save(str(folder / "recipe.json"))
+    assert json.loads((folder / "recipe.json").read_text())["lut"] == os.path.join("luts", "warm.cube")
+
+    moved = tmp_path / "moved"
+    os.rename(folder, moved)
+    recipe = DualTone.Recipe.load(str(moved / "recipe.json"))
+    assert os.path.samefile(recipe.lut, moved / "luts" / "warm.cube")
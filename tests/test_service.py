@@ -0,0 +1,197 @@
+import asyncio
+import contextlib
+import http.client
+import io
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import DualTone
+
+FORMATS = ("PNG", "JPEG", "WEBP", "GIF")
+
+
+def source_images():
+    "Returns images of every mode which render service may get"
+
+    rgba = Image.fromarray(np.random.default_rng(0).integers(0, 256, (24, 32, 4), dtype=np.uint8), "RGBA")
+    transparent = rgba.quantize(16)
+    transparent.info["transparency"] = 0
+    return {"RGB": rgba.convert("RGB"),
+            "RGBA": rgba,
+            "P": rgba.convert("RGB").quantize(16),
+            "P with transparency": transparent,
+            "L": rgba.convert("L"),
+            "LA": rgba.convert("LA"),
+            "1": rgba.convert("1"),
+            "CMYK": rgba.convert("RGB").convert("CMYK"),
+            "I;16": rgba.convert("L").convert("I;16")}
+
+
+def encoded(image):
+    buffer = io.BytesIO()
+    image.save(buffer, "TIFF")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("format", FORMATS)
+@pytest.mark.parametrize("mode", source_images())
+@pytest.mark.parametrize("filter", ("None", "Black and White", "Sepia", "Sharpen"))
+def test_render_bytes_converts_every_mode(mode, format, filter):
+    data = DualTone.render_bytes(encoded(source_images()[mode]), filter, format=format)
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.format == format
+        assert image.size == (32, 24)
+
+
+@pytest.mark.parametrize("extension", (".jpg", ".jpeg", ".jfif", ".ppm", ".png", ".webp", ".gif", ".bmp", ".tiff"))
+@pytest.mark.parametrize("mode", source_images())
+def test_convert_for_saving_gives_savable_mode(mode, extension):
+    image = DualTone.working_mode(source_images()[mode])
+    image = DualTone.convert_for_saving(image, "out" + extension)
+    image.save(io.BytesIO(), Image.registered_extensions()[extension])
+
+
+def test_render_batch_equals_render_bytes():
+    images = source_images()
+    batch = []
+    for filter in ("Sepia", "2-Colored RGB (Linear)", "Sharpen"):
+        for mode in ("RGB", "RGBA", "P"):
+            for brightness, contrast in ((100, 100), (120, 100), (90, 140)):
+                batch.append((encoded(images[mode]), filter, DualTone.DEFAULT_TINT_COLOR, DualTone.DEFAULT_RGB1,
+                              DualTone.DEFAULT_RGB2, brightness, contrast, None, "PNG"))
+    batch.append((b"not an image",) + batch[0][1:])
+
+    results = DualTone.RenderService.render_batch(batch)
+    for args, result in zip(batch[:-1], results):
+        with Image.open(io.BytesIO(result)) as image, Image.open(io.BytesIO(DualTone.render_bytes(*args))) as expected:
+            assert image.mode == expected.mode
+            assert np.array_equal(np.asarray(image), np.asarray(expected)), args[1:]
+    assert isinstance(results[-1], ValueError)
+
+
+def test_lru_cache_evicts_by_size():
+    cache = DualTone.LRUCache(10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"
+    cache.put("c", b"1234")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234" and cache.get("c") == b"1234"
+    assert cache.size == 8
+
+    # item larger than cache isn't kept and doesn't evict others
+    cache.put("d", b"x" * 11)
+    assert cache.get("d") is None and len(cache.items) == 2
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def service():
+    "Starts render service on free port of localhost in its own thread"
+
+    service = DualTone.RenderService(port=0, workers=1, queue_size=1, batch_size=1)
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(service.serve())
+
+    def run():
+        with contextlib.suppress(asyncio.CancelledError):
+            loop.run_until_complete(task)
+        loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    wait_for(lambda: service.port)
+
+    yield service
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(5)
+
+
+def post(service, query, data, headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", service.port, timeout=10)
+    try:
+        connection.request("POST", "/render?" + query, data, headers or {})
+        response = connection.getresponse()
+        return response.status, response.read(), dict(response.getheaders())
+    finally:
+        connection.close()
+
+
+def get_stats(service):
+    connection = http.client.HTTPConnection("127.0.0.1", service.port, timeout=10)
+    try:
+        connection.request("GET", "/stats")
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+def test_service_serves_repeated_request_from_cache(service):
+    data = encoded(source_images()["RGB"])
+    status, first, headers = post(service, "filter=Sepia&format=png", data)
+    assert status == 200 and headers["Content-Type"] == "image/png"
+    status, second, headers = post(service, "filter=Sepia&format=png", data)
+    assert status == 200 and second == first
+
+    stats = get_stats(service)
+    assert stats["rendered"] == 1 and stats["cache_hits"] == 1
+
+
+def test_service_answers_304_for_known_etag(service):
+    data = encoded(source_images()["RGB"])
+    status, body, headers = post(service, "filter=Invert", data)
+    assert status == 200
+    status, body, headers = post(service, "filter=Invert", data, {"If-None-Match": headers["ETag"]})
+    assert status == 304 and body == b""
+    assert get_stats(service)["rendered"] == 1
+
+
+def test_service_rejects_unknown_filter(service):
+    status, body, headers = post(service, "filter=Unknown", encoded(source_images()["RGB"]))
+    assert status == 400 and b"unknown filter" in body
+
+
+def test_service_answers_503_when_queue_is_full(service, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    load_image = DualTone.load_image
+
+    def blocked_load_image(*args):
+        started.set()
+        release.wait(10)
+        return load_image(*args)
+
+    monkeypatch.setattr(DualTone, "load_image", blocked_load_image)
+    data = encoded(source_images()["RGB"])
+    results = []
+    threads = [threading.Thread(target=lambda query=query: results.append(post(service, query, data)))
+               for query in ("filter=Sepia", "filter=Red", "filter=Sepia")]
+
+    # the first request keeps the only worker busy, the second one fills the queue, the third one is identical to
+    # the first one, so it waits for the same render instead of being queued
+    threads[0].start()
+    assert started.wait(10)
+    threads[1].start()
+    wait_for(lambda: service.queue.qsize() == 1)
+    threads[2].start()
+    wait_for(lambda: service.stats["requests"] == 3)
+
+    status, body, headers = post(service, "filter=Blur", data)
+    assert status == 503 and headers["Retry-After"] == "1"
+
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    assert [status for status, body, headers in results] == [200, 200, 200]
+    stats = get_stats(service)
+    assert stats["rendered"] == 2 and stats["rejected"] == 1